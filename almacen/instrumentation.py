@@ -0,0 +1,327 @@
+"""
+Instrumentación de peticiones: número y tiempo de consultas SQL, tiempo de
+render de plantillas y tiempo total, con histogramas por ruta.
+
+Cada proceso acumula sus estadísticas en memoria y las publica periódicamente
+en su propio archivo JSON dentro de INSTRUMENTATION_DIR, de donde las leen la
+vista para el staff y el comando `instrumentation_report` para combinar todos
+los procesos de mod_wsgi. Cada archivo se reemplaza de forma atómica y solo
+lo escribe su proceso, así que no hay un índice compartido que actualizar. El
+directorio debe poder escribirlo el usuario de Apache y, con varios
+servidores, estar en un volumen compartido.
+"""
+
+import contextvars
+import glob
+import json
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import connections
+from django.http import JsonResponse
+from django.template.backends.django import Template as DjangoTemplate
+
+# Límites superiores (ms) de los histogramas de tiempo total
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+# Máximo de rutas por lista en el reporte de la vista
+MAX_REPORT_LIMIT = 100
+
+_current = contextvars.ContextVar('instrumentation_metrics', default=None)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _directory():
+    return str(_setting('INSTRUMENTATION_DIR', os.path.join(tempfile.gettempdir(), 'almacen-instrumentation')))
+
+
+def normalize_sql(sql):
+    """Agrupa consultas que solo difieren en sus parámetros, incluyendo listas IN"""
+    sql = re.sub(r'\(\s*%s(?:\s*,\s*%s)*\s*\)', '(...)', sql)
+    return re.sub(r'\b\d+\b', '?', sql)
+
+
+class RequestMetrics:
+    """Métricas de una sola petición, también usada como `execute_wrapper`"""
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.sql_count += 1
+            self.statements[normalize_sql(sql)] += 1
+
+    def repeated_statement(self):
+        """
+        :return: Par (consulta, repeticiones) de la consulta más repetida si
+                 supera INSTRUMENTATION_NPLUSONE_THRESHOLD, en otro caso None
+        """
+        if not self.statements:
+            return None
+
+        sql, count = self.statements.most_common(1)[0]
+        if count < _setting('INSTRUMENTATION_NPLUSONE_THRESHOLD', 5):
+            return None
+
+        return sql, count
+
+    def server_timing(self, total):
+        return (f'sql;dur={self.sql_time * 1000:.1f};desc="{self.sql_count} queries", '
+                f'tpl;dur={self.template_time * 1000:.1f}, '
+                f'total;dur={total * 1000:.1f}')
+
+
+class RouteStats:
+    """Estadísticas acumuladas de una ruta"""
+
+    def __init__(self):
+        self.count = 0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+        self.samples = deque(maxlen=_setting('INSTRUMENTATION_SAMPLES', 200))
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.nplusone = 0
+        self.nplusone_example = None
+
+    def record(self, total, metrics):
+        total_ms = total * 1000
+        bucket = next((index for index, bound in enumerate(BUCKETS) if total_ms <= bound), len(BUCKETS))
+
+        self.count += 1
+        self.histogram[bucket] += 1
+        self.samples.append(round(total_ms, 3))
+        self.sql_count += metrics.sql_count
+        self.sql_time += metrics.sql_time
+        self.template_time += metrics.template_time
+
+        repeated = metrics.repeated_statement()
+        if repeated:
+            self.nplusone += 1
+            self.nplusone_example = {'sql': repeated[0], 'count': repeated[1]}
+
+    def export(self):
+        return {
+            'count': self.count,
+            'histogram': list(self.histogram),
+            'samples': list(self.samples),
+            'sql_count': self.sql_count,
+            'sql_time': self.sql_time,
+            'template_time': self.template_time,
+            'nplusone': self.nplusone,
+            'nplusone_example': self.nplusone_example,
+        }
+
+
+class Registry:
+    """Estadísticas por ruta del proceso actual"""
+
+    def __init__(self, name=None):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.last_flush = time.monotonic()
+        self.name = name
+
+    def filename(self):
+        # El pid se lee al publicar: mod_wsgi puede importar el módulo antes de crear los procesos
+        return f'{self.name or f"{socket.gethostname()}-{os.getpid()}"}.json'
+
+    def record(self, route, total, metrics):
+        with self.lock:
+            self.routes.setdefault(route, RouteStats()).record(total, metrics)
+            flush = time.monotonic() - self.last_flush >= _setting('INSTRUMENTATION_FLUSH_SECONDS', 30)
+            if flush:
+                self.last_flush = time.monotonic()
+
+        if flush:
+            try:
+                self.flush()
+            except OSError:
+                pass  # un directorio sin permisos no debe tumbar la petición; se reintenta en el siguiente intervalo
+
+    def export(self):
+        with self.lock:
+            return {route: stats.export() for route, stats in self.routes.items()}
+
+    def flush(self):
+        """Publica las estadísticas de este proceso en su archivo de INSTRUMENTATION_DIR"""
+        directory = _directory()
+        os.makedirs(directory, exist_ok=True)
+
+        # Se escribe un temporal y se renombra: quien lee nunca ve un archivo a medias
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w') as file:
+                json.dump(self.export(), file)
+            os.replace(temporary, os.path.join(directory, self.filename()))
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+
+registry = Registry()
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return None
+
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def published_exports(exclude=None):
+    """
+    :param exclude: Nombre de archivo que se omite (el del proceso actual)
+    :return: Estadísticas publicadas por los procesos en las últimas INSTRUMENTATION_TTL segundos
+    """
+    ttl = _setting('INSTRUMENTATION_TTL', 24 * 60 * 60)
+    exports = []
+
+    for path in glob.glob(os.path.join(glob.escape(_directory()), '*.json')):
+        if os.path.basename(path) == exclude:
+            continue
+        try:
+            if time.time() - os.path.getmtime(path) > ttl:
+                continue  # proceso que ya terminó
+            with open(path) as file:
+                exports.append(json.load(file))
+        except (OSError, ValueError):
+            continue  # el archivo se borró o quedó ilegible
+
+    return exports
+
+
+def report(limit=10):
+    """
+    Combina las estadísticas de todos los procesos publicadas en INSTRUMENTATION_DIR.
+
+    :param limit: Número de rutas en cada lista
+    :return: Diccionario con las rutas más lentas y las que tienen patrones N+1
+    """
+    exports = [registry.export()] + published_exports(exclude=registry.filename())
+
+    merged = {}
+    for export in exports:
+        for route, stats in export.items():
+            total = merged.setdefault(route, {
+                'count': 0, 'histogram': [0] * (len(BUCKETS) + 1), 'samples': [],
+                'sql_count': 0, 'sql_time': 0.0, 'template_time': 0.0, 'nplusone': 0, 'nplusone_example': None,
+            })
+            total['count'] += stats['count']
+            total['histogram'] = [a + b for a, b in zip(total['histogram'], stats['histogram'])]
+            total['samples'] += stats['samples']
+            total['sql_count'] += stats['sql_count']
+            total['sql_time'] += stats['sql_time']
+            total['template_time'] += stats['template_time']
+            total['nplusone'] += stats['nplusone']
+            total['nplusone_example'] = stats['nplusone_example'] or total['nplusone_example']
+
+    routes = []
+    for route, stats in merged.items():
+        count = stats['count'] or 1
+        routes.append({
+            'route': route,
+            'count': stats['count'],
+            'p50_ms': _percentile(stats['samples'], 0.50),
+            'p95_ms': _percentile(stats['samples'], 0.95),
+            'p99_ms': _percentile(stats['samples'], 0.99),
+            'mean_queries': round(stats['sql_count'] / count, 2),
+            'mean_sql_ms': round(stats['sql_time'] * 1000 / count, 3),
+            'mean_template_ms': round(stats['template_time'] * 1000 / count, 3),
+            'histogram': dict(zip([f'<={bound}ms' for bound in BUCKETS] + ['inf'], stats['histogram'])),
+            'nplusone_requests': stats['nplusone'],
+            'nplusone_example': stats['nplusone_example'],
+        })
+
+    return {
+        'slowest': sorted(routes, key=lambda route: route['p95_ms'] or 0, reverse=True)[:limit],
+        'nplusone': sorted((route for route in routes if route['nplusone_requests']),
+                           key=lambda route: route['nplusone_requests'], reverse=True)[:limit],
+    }
+
+
+def _install_template_timer():
+    """Envuelve el render de plantillas para medir su tiempo dentro de la petición actual"""
+    original = DjangoTemplate.render
+    if getattr(original, 'instrumented', False):
+        return
+
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return original(self, context, request)
+
+        # Solo se mide el render más externo para no contar dos veces los anidados
+        metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            metrics.template_depth -= 1
+            if metrics.template_depth == 0:
+                metrics.template_time += time.perf_counter() - start
+
+    render.instrumented = True
+    DjangoTemplate.render = render
+
+
+class InstrumentationMiddleware:
+    """Agrega el encabezado `Server-Timing` y registra las métricas de cada petición"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        _install_template_timer()
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        total = time.perf_counter() - start
+        response['Server-Timing'] = metrics.server_timing(total)
+
+        match = request.resolver_match
+        route = f'{request.method} /{match.route}' if match else f'{request.method} <sin ruta>'
+        registry.record(route, total, metrics)
+
+        return response
+
+
+@staff_member_required
+def instrumentation_report_view(request):
+    """Reporte en JSON de las rutas más lentas y con patrones N+1"""
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        limit = 10
+
+    return JsonResponse(report(min(max(limit, 1), MAX_REPORT_LIMIT)))
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'almacen.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -123,13 +125,32 @@ USE_TZ = True
 
 # https://docs.djangoproject.com/en/5.0/howto/static-files/
 STATIC_URL = 'static/'
-STATIC_ROOT = BASE_DIR / STATIC_URL
+STATIC_ROOT = BASE_DIR / 'staticfiles'  # /static/ en 000-default.conf
+STATICFILES_DIRS = [
+    BASE_DIR / "static",
+]
 
 # Archivos subidos desde django
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / MEDIA_URL #'/media/'
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 
+# Entrega de archivos estáticos y media
+# - Django (SERVE_FILES_WITH_DJANGO = True): rutas de respaldo en almacen/urls.py, solo para desarrollo.
+# - Apache (False): `collectstatic` genera nombres con hash y copias .gz/.br en STATIC_ROOT y
+#   Apache sirve /static/ y /media/ directamente (ver 000-default.conf).
+SERVE_FILES_WITH_DJANGO = DEBUG
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': ('django.contrib.staticfiles.storage.StaticFilesStorage' if SERVE_FILES_WITH_DJANGO
+                    else 'almacen.storage.CompressedManifestStaticFilesStorage'),
+    },
+}
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -140,6 +161,48 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_REDIRECT_URL = 'order_list'
 LOGOUT_REDIRECT_URL = '/'
 
+# Consultar los traslapes en la tabla de reservaciones activas en lugar de todo
+# el historial de `Order.units`. Al activarlo ejecutar `rebuild_reservations`.
+PRESTAMOS_ACTIVE_RESERVATIONS = False
+
+# Segundos que se conserva en caché la línea de tiempo de capacidad de cada artículo
+PRESTAMOS_TIMELINE_TIMEOUT = 300
+
+# Segundos que se guarda en caché la disponibilidad del carrito por artículos y ventana
+PRESTAMOS_CART_AVAILABILITY_TIMEOUT = 10
+
+# Segundos que se guardan en caché la barra de categorías y la cuadrícula del catálogo
+PRESTAMOS_CATALOG_CACHE_TIMEOUT = 600
+
+# Segundos que se guarda en caché el total aproximado de la paginación por llave (None para no mostrarlo)
+PRESTAMOS_PAGINATION_COUNT_TIMEOUT = 60
+
+# Segundos que se recuerda que el archivo de un QR ya existe en media
+PRESTAMOS_QR_CACHE_TIMEOUT = 3600
+
+# Filas a partir de las cuales el admin usa totales aproximados (None para contar siempre)
+PRESTAMOS_ADMIN_APPROXIMATE_COUNT_THRESHOLD = 100000
+
+# Instrumentación de peticiones (almacen/instrumentation.py)
+INSTRUMENTATION_NPLUSONE_THRESHOLD = 5  # repeticiones de una misma consulta para marcar N+1
+INSTRUMENTATION_SAMPLES = 200  # muestras recientes por ruta para los percentiles
+INSTRUMENTATION_FLUSH_SECONDS = 30  # cada cuánto publica cada proceso sus estadísticas
+# Un archivo JSON por proceso, fuera del repositorio. Apache y `manage.py` deben ver el mismo directorio
+# (con PrivateTmp de systemd, usar una ruta fuera de /tmp)
+INSTRUMENTATION_DIR = Path(tempfile.gettempdir()) / 'almacen-instrumentation'
+
+# Intentos al reservar unidades cuando otra solicitud las bloquea o hay un deadlock
+PRESTAMOS_ALLOCATION_RETRIES = 3
+
+# Segundos entre revisiones de SETTINGS_VERSION para refrescar la configuración local de cada proceso
+PRESTAMOS_SETTINGS_TTL = 5
+
+# Manifiestos de avance de `download_book_covers`; fuera de MEDIA_ROOT porque /media/ es público
+PRESTAMOS_DOWNLOAD_MANIFEST_DIR = BASE_DIR / 'var' / 'book_covers'
+
+# Anchos (px) de las miniaturas WebP/JPEG de las imágenes de los artículos
+PRESTAMOS_THUMBNAIL_WIDTHS = (160, 320, 640)
+
 # admin personalizado
 X_FRAME_OPTIONS = "SAMEORIGIN"
 SILENCED_SYSTEM_CHECKS = ["security.W019"]
@@ -169,6 +232,13 @@ EXTRA_SETTINGS_DEFAULTS = [
         "description": "Days of the week the store is open, separated by commas",
         "editable": True,
     },
+    {
+        "name": "STORE_CLOSED_DATES",
+        "type": "text",
+        "value": "",
+        "description": "Días de cierre (vacaciones, feriados): fechas AAAA-MM-DD o rangos AAAA-MM-DD..AAAA-MM-DD separados por comas",
+        "editable": True,
+    },
     {
         "name": "BLOCK_REQUESTS_IF_REPORTS",
         "type": "bool",
@@ -212,6 +282,43 @@ EXTRA_SETTINGS_DEFAULTS = [
         "value": 20,
         "description": "Elementos en una pagina del catalogo",
         "editable": True,
+    },
+    {
+        "name": "ALTERNATIVES_SEARCH_HOURS",
+        "type": "int",
+        "value": 24,
+        "description": "Horas hacia adelante en las que se buscan horarios alternativos",
+        "editable": True,
+    },
+    {
+        "name": "ALTERNATIVES_SLOT_MINUTES",
+        "type": "int",
+        "value": 0,
+        "description": "Minutos entre horarios alternativos (0 = la duración del préstamo)",
+        "editable": True,
+    },
+    {
+        "name": "SETTINGS_VERSION",
+        "type": "int",
+        "value": 0,
+        "description": "Versión de la configuración, se incrementa al guardar un setting o con reload_settings",
+        "editable": False,
+    },
+    {
+        "name": "CATALOG_VERSION",
+        "type": "int",
+        "value": 0,
+        "description": "Versión del catálogo para la caché de fragmentos, se incrementa al cambiar artículos, "
+                       "categorías o unidades",
+        "editable": False,
+    },
+    {
+        "name": "TIMELINES_VERSION",
+        "type": "int",
+        "value": 0,
+        "description": "Versión de las líneas de tiempo de disponibilidad en caché, se incrementa al cambiar "
+                       "órdenes o unidades",
+        "editable": False,
     }
 ]
 
@@ -0,0 +1,59 @@
+"""
+Almacenamiento de archivos estáticos para producción: nombres con hash del
+contenido (ManifestStaticFilesStorage) y copias precomprimidas `.gz` y `.br`
+junto a cada archivo, para que Apache las entregue sin pasar por Django.
+"""
+
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:  # Brotli es opcional, sin él solo se generan los .gz
+    brotli = None
+
+# Tipos de archivo que vale la pena comprimir
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.mjs', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ico',
+                           '.ttf', '.otf', '.eot', '.webmanifest'}
+
+# Archivos más chicos que esto no se comprimen
+MIN_SIZE = 256
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """`collectstatic` escribe, además de los archivos con hash, sus versiones gzip y brotli"""
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+
+        if dry_run:
+            return
+
+        for name in self.hashed_files.values():
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                self.compress(name)
+
+    def compress(self, name):
+        """
+        Guarda `name.gz` y `name.br` si resultan más chicos que el original.
+
+        :param name: Nombre del archivo ya copiado a STATIC_ROOT
+        """
+        with self.open(name) as original:
+            content = original.read()
+
+        if len(content) < MIN_SIZE:
+            return
+
+        compressed = {'gz': gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed['br'] = brotli.compress(content, quality=11)
+
+        for extension, data in compressed.items():
+            if len(data) < len(content):
+                if self.exists(f'{name}.{extension}'):
+                    self.delete(f'{name}.{extension}')
+                self._save(f'{name}.{extension}', ContentFile(data))
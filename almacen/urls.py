@@ -15,22 +15,29 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.contrib.staticfiles.urls import staticfiles_urlpatterns
+from django.urls import include, path, re_path
 from django.views.static import serve
-from django.urls import include, re_path
+
+from almacen.instrumentation import instrumentation_report_view
 
 urlpatterns = [
+    path('admin/instrumentation/', instrumentation_report_view, name='instrumentation_report'),
     path('admin/', admin.site.urls),
     path('', include('prestamos.urls')),
     path('', include('pwa.urls')),
     path('qr_code/', include('qr_code.urls', namespace="qr_code")),
-
-    # datos estaticos en produccion:  https://stackoverflow.com/a/49722734
-    re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
-    re_path(r'^static/(?P<path>.*)$', serve, {'document_root': settings.STATIC_ROOT}),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Respaldo para desarrollo: en producción Apache entrega /static/ y /media/ sin pasar por Django
+if settings.SERVE_FILES_WITH_DJANGO:
+    urlpatterns += [
+        re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
+    ]
+    if settings.DEBUG:
+        urlpatterns += staticfiles_urlpatterns()  # desde STATICFILES_DIRS, sin collectstatic
+    else:
+        urlpatterns += [
+            re_path(r'^static/(?P<path>.*)$', serve, {'document_root': settings.STATIC_ROOT}),
+        ]
@@ -1,7 +1,106 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
 from import_export.admin import ImportExportModelAdmin
 
+from .exports import ItemExport, OrderExport, UnitExport, streaming_response
+from .imports import guess_format, import_file
 from .models import Category, Item, Unit, Order, Report
+from .pagination import ApproximateCountPaginator
+from .search import search_items
+
+"""
+Exportación en streaming
+"""
+
+
+class StreamingExportMixin:
+    """
+    Acciones para exportar los registros seleccionados (o todos los filtrados
+    con "seleccionar todos") en CSV o JSONL sin cargarlos en memoria.
+    """
+
+    export_class = None
+    actions = ['export_csv_stream', 'export_jsonl_stream']
+
+    @admin.action(description='Exportar seleccionados a CSV (streaming)')
+    def export_csv_stream(self, request, queryset):
+        return streaming_response(self.export_class(), 'csv', queryset)
+
+    @admin.action(description='Exportar seleccionados a JSONL (streaming)')
+    def export_jsonl_stream(self, request, queryset):
+        return streaming_response(self.export_class(), 'jsonl', queryset)
+
+
+"""
+Importación por lotes
+"""
+
+
+class BulkImportForm(forms.Form):
+    file = forms.FileField(label='Archivo CSV o XLSX')
+    batch_size = forms.IntegerField(label='Filas por lote', min_value=1, max_value=10000, initial=1000)
+
+
+class BulkImportMixin:
+    """
+    Vista de importación por lotes (`prestamos.imports`) junto a la de
+    django-import-export, para archivos grandes: valida y guarda bloques de
+    filas en lugar de fila por fila.
+    """
+
+    import_kind = None
+    change_list_template = 'admin/prestamos/change_list_bulk_import.html'
+
+    def get_urls(self):
+        info = self.opts.app_label, self.opts.model_name
+        return [
+            path('bulk-import/', self.admin_site.admin_view(self.bulk_import_view),
+                 name='%s_%s_bulk_import' % info),
+        ] + super().get_urls()
+
+    def bulk_import_view(self, request):
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            return redirect('admin:%s_%s_changelist' % (self.opts.app_label, self.opts.model_name))
+
+        form = BulkImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            result = import_file(self.import_kind, upload, guess_format(upload.name),
+                                 form.cleaned_data['batch_size'])
+
+            level = messages.WARNING if result.errors else messages.SUCCESS
+            self.message_user(request, f'Importación terminada: {result}.', level)
+            for row, message in result.errors[:50]:
+                self.message_user(request, f'Fila {row}: {message}', messages.ERROR)
+
+            return redirect('admin:%s_%s_changelist' % (self.opts.app_label, self.opts.model_name))
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.opts,
+            'title': f'Importar {self.opts.verbose_name_plural} por lotes',
+            'form': form,
+        }
+        return TemplateResponse(request, 'admin/prestamos/bulk_import.html', context)
+
+
+"""
+Listados grandes
+"""
+
+
+class LargeTableAdminMixin:
+    """
+    Listados sin `COUNT(*)` completo por página: total aproximado en tablas
+    grandes y sin el segundo conteo de "mostrar todos".
+    """
+
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+
 
 """
 Categoría y lista de artículos 
@@ -32,12 +131,24 @@ class UnitInlineForItem(admin.TabularInline):
 
 
 @admin.register(Item)
-class ItemAdmin(ImportExportModelAdmin):
+class ItemAdmin(LargeTableAdminMixin, BulkImportMixin, StreamingExportMixin, ImportExportModelAdmin):
+    export_class = ItemExport
+    import_kind = 'items'
     list_display = ('name',)
     search_fields = ('name',)
     list_filter = ('category',)
     filter_horizontal = ('category',)
     inlines = [UnitInlineForItem]
+    ordering = ('name', 'pk')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('search_document', 'thumbnails')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Búsqueda y autocompletado con el índice de texto completo en lugar de `LIKE '%...%'`
+        if not search_term.strip():
+            return queryset, False
+        return search_items(queryset, search_term), False
 
 
 """
@@ -46,10 +157,18 @@ Unidades de un artículo
 
 
 @admin.register(Unit)
-class UnitAdmin(ImportExportModelAdmin):
+class UnitAdmin(LargeTableAdminMixin, BulkImportMixin, StreamingExportMixin, ImportExportModelAdmin):
+    export_class = UnitExport
+    import_kind = 'units'
     list_display = ('item', 'serial_number', 'available')
     search_fields = ('serial_number', 'item__name')
-    list_filter = ('item',)
+    # Filtrar por artículo cargaría todos los artículos como opciones; se usa la búsqueda
+    list_filter = ('available', 'item__category')
+    ordering = ('item', 'serial_number')  # índice de unique_together
+
+    def get_queryset(self, request):
+        # `Unit.__str__` usa `item.name`: listado, autocompletado y formularios
+        return super().get_queryset(request).select_related('item')
 
 
 """
@@ -62,10 +181,18 @@ class UnitInlineForOrder(admin.TabularInline):
     autocomplete_fields = ['unit']
     extra = 0
 
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        # Las unidades ya seleccionadas se muestran con `Unit.__str__`
+        if db_field.name == 'unit':
+            kwargs['queryset'] = Unit.objects.select_related('item')
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdminMixin, StreamingExportMixin, admin.ModelAdmin):
+    export_class = OrderExport
     list_display = ('id', 'order_date', 'status', 'user')
+    list_select_related = ('user',)
     search_fields = ('user__username', 'user__email')
     list_filter = ('order_date', 'return_date', 'status')
     exclude = ('units',)
@@ -76,3 +203,4 @@ class OrderAdmin(admin.ModelAdmin):
 @admin.register(Report)
 class ReportAdmin(admin.ModelAdmin):
     list_display = ('order', 'created_at', 'active')
+    list_select_related = ('order__user',)  # `Order.__str__` usa `user.username`
@@ -0,0 +1,460 @@
+import hashlib
+import time
+from random import random, shuffle
+
+import numpy as np
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import OperationalError
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Order, Unit, Reservation, ACTIVE_ORDER_STATUSES
+from .runtime_settings import VersionStamp
+
+"""
+Motor de disponibilidad de unidades
+"""
+
+
+def use_reservations_table():
+    """La tabla de reservaciones activas es opcional, ver PRESTAMOS_ACTIVE_RESERVATIONS"""
+    return getattr(settings, 'PRESTAMOS_ACTIVE_RESERVATIONS', False)
+
+
+def reservations(start_date, end_date=None):
+    """
+    Filas de la tabla intermedia de `Order.units` cuyas órdenes activas se
+    traslapan con el intervalo [start_date, end_date).
+
+    Con PRESTAMOS_ACTIVE_RESERVATIONS se consulta la tabla `Reservation`, que
+    solo guarda los intervalos vivos, en lugar de todo el historial.
+
+    :param start_date: Fecha y hora de inicio
+    :param end_date: Fecha y hora de finalización, sin límite si es None
+    :return: QuerySet con una columna `unit_id`
+    """
+    if use_reservations_table():
+        rows = Reservation.objects.filter(end_date__gt=start_date)
+        return rows.filter(start_date__lt=end_date) if end_date is not None else rows
+
+    rows = Order.units.through.objects.filter(
+        order__return_date__gt=start_date,
+        order__status__in=ACTIVE_ORDER_STATUSES,
+    )
+    return rows.filter(order__order_date__lt=end_date) if end_date is not None else rows
+
+
+def free_units(items, start_date, end_date):
+    """
+    Unidades libres de uno o varios artículos entre las fechas especificadas.
+
+    Se resuelve en una sola consulta con un anti-join (NOT EXISTS) contra las
+    reservaciones que se traslapan, en lugar de consultar unidad por unidad.
+
+    :param items: Iterable de artículos (o de sus ids)
+    :param start_date: Fecha y hora de inicio
+    :param end_date: Fecha y hora de finalización
+    :return: QuerySet de unidades disponibles ordenado por artículo
+    """
+    busy = reservations(start_date, end_date).filter(unit_id=OuterRef('pk'))
+
+    return (Unit.objects
+            .filter(item__in=items, available=True)
+            .exclude(Exists(busy))
+            .order_by('item_id', 'pk'))
+
+
+def free_units_by_item(items, start_date, end_date):
+    """
+    Agrupa las unidades libres por artículo.
+
+    :param items: Iterable de artículos (o de sus ids)
+    :param start_date: Fecha y hora de inicio
+    :param end_date: Fecha y hora de finalización
+    :return: Diccionario {item_id: [unidades disponibles]}
+    """
+    units_by_item = {}
+
+    for unit in free_units(items, start_date, end_date):
+        units_by_item.setdefault(unit.item_id, []).append(unit)
+
+    return units_by_item
+
+
+class AllocationConflict(ValidationError):
+    """Otra solicitud está reservando las mismas unidades al mismo tiempo"""
+
+
+# Errores de MySQL que indican que la transacción puede reintentarse:
+# 1205 (tiempo de espera de bloqueo agotado) y 1213 (deadlock)
+RETRYABLE_DB_ERRORS = {1205, 1213}
+
+
+def allocate(lines, start_date, end_date):
+    """
+    Asigna unidades libres a un lote de pedidos en la misma ventana de tiempo.
+
+    Las líneas repetidas de un mismo artículo se suman y la disponibilidad de
+    todos los artículos se obtiene con una sola consulta. Después se bloquean
+    solo las unidades elegidas con SELECT ... FOR UPDATE SKIP LOCKED,
+    verificando de nuevo que sigan libres; las que otra transacción tenga
+    bloqueadas se reemplazan por otras candidatas. Debe llamarse dentro de una
+    transacción para que los bloqueos duren hasta que se guarde la orden.
+
+    :param lines: Iterable de pares (artículo, cantidad)
+    :param start_date: Fecha y hora de inicio
+    :param end_date: Fecha y hora de finalización
+    :return: Diccionario {item_id: [unidades asignadas]}
+    :raises ValidationError: Si algún artículo no tiene suficientes unidades
+    :raises AllocationConflict: Si las unidades restantes están bloqueadas por otra solicitud
+    """
+    items = {}
+    requested = {}
+
+    for item, quantity in lines:
+        if quantity < 1:
+            continue
+
+        items[item.pk] = item
+        requested[item.pk] = requested.get(item.pk, 0) + quantity
+
+    candidates = free_units_by_item(list(items), start_date, end_date) if items else {}
+    errors = []
+
+    for item_id, quantity in requested.items():
+        units = candidates.get(item_id, [])
+
+        if quantity > len(units):  # Verificar que hay suficientes unidades
+            errors.append(f"No hay suficientes unidades de '{items[item_id].name}' disponibles")
+            continue
+
+        shuffle(units)  # Revolver los elementos de la lista
+
+    if errors:
+        raise ValidationError(errors)
+
+    allocation = {item_id: [] for item_id in requested}
+
+    while True:
+        # Tomar de cada artículo las candidatas que aún faltan
+        picked = {}
+        for item_id, quantity in requested.items():
+            missing = quantity - len(allocation[item_id])
+            picked.update((unit.pk, unit) for unit in candidates[item_id][:missing])
+            del candidates[item_id][:missing]
+
+        if not picked:
+            break
+
+        locked = (free_units(list(items), start_date, end_date)
+                  .filter(pk__in=list(picked))
+                  .select_for_update(skip_locked=True, of=('self',))
+                  .values_list('pk', flat=True))
+
+        for unit_id in locked:
+            unit = picked[unit_id]
+            allocation[unit.item_id].append(unit)
+
+    for item_id, quantity in requested.items():
+        if len(allocation[item_id]) < quantity:
+            raise AllocationConflict(
+                f"Otra solicitud está reservando unidades de '{items[item_id].name}', intente de nuevo")
+
+    return allocation
+
+
+def retry_allocation(func):
+    """
+    Ejecuta `func` (que abre su propia transacción) reintentando con espera
+    exponencial cuando hay un conflicto de bloqueo o un deadlock.
+
+    :param func: Función sin argumentos que realiza la asignación
+    :return: El valor devuelto por `func`
+    :raises AllocationConflict: Si se agotan los intentos
+    """
+    attempts = getattr(settings, 'PRESTAMOS_ALLOCATION_RETRIES', 3)
+
+    for attempt in range(attempts):
+        try:
+            return func()
+        except AllocationConflict:
+            if attempt == attempts - 1:
+                raise
+        except OperationalError as e:
+            if not e.args or e.args[0] not in RETRYABLE_DB_ERRORS:
+                raise
+            if attempt == attempts - 1:
+                raise AllocationConflict("Otra solicitud está reservando las mismas unidades, intente de nuevo")
+
+        time.sleep(0.05 * 2 ** attempt * (1 + random()))
+
+
+def reservation_intervals(items, start_date, end_date=None):
+    """
+    Intervalos ocupados de las unidades habilitadas de los artículos dados que
+    se traslapan con [start_date, end_date).
+
+    :param items: Iterable de artículos (o de sus ids)
+    :param start_date: Fecha y hora de inicio
+    :param end_date: Fecha y hora de finalización, sin límite si es None
+    :return: QuerySet de tuplas (item_id, unit_id, inicio, fin)
+    """
+    if use_reservations_table():
+        dates = ('start_date', 'end_date')
+    else:
+        dates = ('order__order_date', 'order__return_date')
+
+    return (reservations(start_date, end_date)
+            .filter(unit__item__in=items, unit__available=True)
+            .values_list('unit__item_id', 'unit_id', *dates))
+
+
+def _blocked_starts(unit_ids, starts, ends, duration):
+    """
+    Convierte los intervalos ocupados de cada unidad en los rangos abiertos de
+    horas de inicio que bloquean, (inicio - duración, fin), y une los que se
+    traslapan dentro de la misma unidad. Así cada unidad cuenta una sola vez
+    en cualquier instante.
+
+    :param unit_ids: Arreglo con la unidad de cada intervalo
+    :param starts: Arreglo de inicios en segundos
+    :param ends: Arreglo de finales en segundos
+    :param duration: Duración del préstamo en segundos
+    :return: Par de arreglos ordenados (inicios, finales) de los rangos bloqueados
+    """
+    if not len(unit_ids):
+        return np.empty(0), np.empty(0)
+
+    starts = starts - duration
+    order = np.lexsort((starts, unit_ids))
+    unit_ids, starts, ends = unit_ids[order], starts[order], ends[order]
+
+    # Desplazar cada unidad a su propio tramo de la recta para unir todas con un solo barrido
+    _, unit_rank = np.unique(unit_ids, return_inverse=True)
+    offset = unit_rank * (ends.max() - starts.min() + 1)
+    running_end = np.maximum.accumulate(ends + offset)
+    new_group = np.r_[True, starts[1:] + offset[1:] >= running_end[:-1]]
+    first = np.flatnonzero(new_group)
+
+    return np.sort(starts[first]), np.sort(np.maximum.reduceat(ends, first))
+
+
+class CapacityTimeline:
+    """
+    Línea de tiempo de ocupación de un artículo a partir de `since`: sus
+    unidades habilitadas y los intervalos ocupados de cada una como arreglos
+    ordenados. Responde consultas de disponibilidad sin tocar la base de datos.
+    """
+
+    def __init__(self, item_id, since, units, unit_ids, starts, ends):
+        order = np.argsort(starts, kind='stable')
+
+        self.item_id = item_id
+        self.since = since.timestamp()
+        self.units = units
+        self.unit_ids = unit_ids[order]
+        self.starts = starts[order]
+        self.ends = ends[order]
+
+    def covers(self, start_date):
+        """Indica si la línea de tiempo incluye todas las reservaciones que pueden afectar a `start_date`"""
+        return start_date.timestamp() >= self.since
+
+    def free_units(self, start_date, end_date):
+        """
+        :param start_date: Fecha y hora de inicio
+        :param end_date: Fecha y hora de finalización
+        :return: Lista de unidades libres ordenada por id
+        """
+        # Solo los intervalos que empiezan antes del final pueden traslaparse
+        candidates = slice(0, np.searchsorted(self.starts, end_date.timestamp(), side='left'))
+        overlap = self.ends[candidates] > start_date.timestamp()
+        busy = set(self.unit_ids[candidates][overlap].tolist())
+
+        return [unit for unit in self.units if unit.pk not in busy]
+
+    def capacity(self, slots, duration):
+        """
+        :param slots: Arreglo con el inicio de cada ventana en segundos
+        :param duration: Duración de las ventanas en segundos
+        :return: Arreglo con las unidades libres por ventana
+        """
+        blocked_starts, blocked_ends = _blocked_starts(self.unit_ids, self.starts, self.ends, duration)
+
+        # Unidades ocupadas en t = rangos con inicio < t menos rangos con fin <= t
+        busy = np.searchsorted(blocked_starts, slots, side='left') - np.searchsorted(blocked_ends, slots, side='right')
+        return len(self.units) - busy
+
+
+# La caché de cada proceso es local: las llaves incluyen una versión compartida
+# que se incrementa al confirmar cualquier cambio de reservaciones o unidades
+TIMELINES_VERSION = VersionStamp('TIMELINES_VERSION')
+
+
+def timeline_key(item_id, version):
+    return f'prestamos:timeline:{version}:{item_id}'
+
+
+def build_timelines(item_ids, since):
+    """
+    Construye las líneas de tiempo de varios artículos con dos consultas.
+
+    :param item_ids: Lista de ids de artículos
+    :param since: Se ignoran las reservaciones que terminan antes de esta fecha
+    :return: Diccionario {item_id: CapacityTimeline}
+    """
+    units_by_item = {item_id: [] for item_id in item_ids}
+    for unit in Unit.objects.filter(item__in=item_ids, available=True).order_by('item_id', 'pk'):
+        units_by_item[unit.item_id].append(unit)
+
+    rows_by_item = {item_id: [] for item_id in item_ids}
+    for row in reservation_intervals(item_ids, since):
+        rows_by_item[row[0]].append(row)
+
+    timelines = {}
+
+    for item_id, rows in rows_by_item.items():
+        timelines[item_id] = CapacityTimeline(
+            item_id, since, units_by_item[item_id],
+            unit_ids=np.array([row[1] for row in rows], dtype=np.int64),
+            starts=np.array([row[2].timestamp() for row in rows], dtype=float),
+            ends=np.array([row[3].timestamp() for row in rows], dtype=float),
+        )
+
+    return timelines
+
+
+def get_timelines(items, since):
+    """
+    Obtiene las líneas de tiempo desde la caché, construyendo solo las que
+    falten. Las consultas sobre el pasado no se guardan en caché.
+
+    :param items: Iterable de artículos (o de sus ids)
+    :param since: Fecha y hora de inicio más temprana que se va a consultar
+    :return: Diccionario {item_id: CapacityTimeline}
+    """
+    item_ids = [getattr(item, 'pk', item) for item in items]
+    now = timezone.now()
+    timelines = {}
+
+    version = TIMELINES_VERSION.get()
+
+    if since >= now:
+        cached = cache.get_many([timeline_key(item_id, version) for item_id in item_ids])
+        timelines = {timeline.item_id: timeline for timeline in cached.values() if timeline.covers(since)}
+
+    missing = [item_id for item_id in item_ids if item_id not in timelines]
+
+    if missing:
+        built = build_timelines(missing, min(since, now))
+
+        if since >= now:
+            timeout = getattr(settings, 'PRESTAMOS_TIMELINE_TIMEOUT', 300)
+            cache.set_many({timeline_key(item_id, version): timeline for item_id, timeline in built.items()}, timeout)
+
+        timelines.update(built)
+
+    return timelines
+
+
+def invalidate_timelines(item_ids):
+    """
+    Descarta las líneas de tiempo en caché de los artículos indicados en este
+    proceso y, al confirmar la transacción, incrementa TIMELINES_VERSION (una
+    vez por transacción) para que los demás procesos dejen de usar las suyas en
+    su siguiente revisión (PRESTAMOS_SETTINGS_TTL).
+
+    :param item_ids: Iterable de ids de artículos
+    """
+    item_ids = set(item_ids)
+    if not item_ids:
+        return
+
+    version = TIMELINES_VERSION.get()
+    cache.delete_many([timeline_key(item_id, version) for item_id in item_ids])
+    TIMELINES_VERSION.bump_on_commit()
+
+
+def free_capacity(items, slot_starts, duration):
+    """
+    Calcula las unidades libres de cada artículo para muchas ventanas de la
+    misma duración a la vez, a partir de las líneas de tiempo en caché y un
+    barrido de eventos con NumPy.
+
+    :param items: Iterable de artículos (o de sus ids)
+    :param slot_starts: Lista de fechas y horas de inicio de cada ventana
+    :param duration: Duración de las ventanas (timedelta)
+    :return: Diccionario {item_id: arreglo con las unidades libres por ventana}
+    """
+    items = list(items)
+    slots = np.array([start.timestamp() for start in slot_starts], dtype=float)
+
+    if not items or not len(slots):
+        return {}
+
+    timelines = get_timelines(items, min(slot_starts))
+
+    return {
+        item_id: timeline.capacity(slots, duration.total_seconds())
+        for item_id, timeline in timelines.items()
+    }
+
+
+def free_counts(item_ids, start_date, end_date):
+    """
+    Unidades libres de varios artículos en una misma ventana, para revisar el
+    carrito antes de enviar la orden. El resultado se guarda en caché unos
+    segundos (`PRESTAMOS_CART_AVAILABILITY_TIMEOUT`) por artículos, ventana y
+    TIMELINES_VERSION, así que cualquier orden confirmada en otro proceso lo
+    invalida; la reservación real vuelve a validar dentro de la transacción.
+
+    :param item_ids: Iterable de ids de artículos
+    :param start_date: Fecha y hora de inicio
+    :param end_date: Fecha y hora de finalización
+    :return: Diccionario {item_id: unidades libres}; los artículos inexistentes tienen 0
+    """
+    item_ids = sorted(set(item_ids))
+    if not item_ids:
+        return {}
+
+    version = TIMELINES_VERSION.get()
+    window = f'{version}|{",".join(map(str, item_ids))}|{start_date.timestamp()}|{end_date.timestamp()}'
+    key = 'prestamos:free_counts:' + hashlib.md5(window.encode()).hexdigest()
+
+    counts = cache.get(key)
+    if counts is None:
+        capacity = free_capacity(item_ids, [start_date], end_date - start_date)
+        counts = {item_id: int(capacity[item_id][0]) for item_id in item_ids}
+        cache.set(key, counts, getattr(settings, 'PRESTAMOS_CART_AVAILABILITY_TIMEOUT', 10))
+
+    return counts
+
+
+def available_slots(lines, slot_starts, duration):
+    """
+    Indica en qué ventanas hay suficientes unidades de TODOS los artículos.
+
+    :param lines: Iterable de pares (artículo, cantidad)
+    :param slot_starts: Lista de fechas y horas de inicio de cada ventana
+    :param duration: Duración de las ventanas (timedelta)
+    :return: Arreglo booleano con una entrada por ventana
+    """
+    requested = {}
+
+    for item, quantity in lines:
+        if quantity >= 1:
+            requested[item.pk] = requested.get(item.pk, 0) + quantity
+
+    fits = np.ones(len(slot_starts), dtype=bool)
+    if not len(slot_starts):
+        return fits  # sin ventanas candidatas (horizonte 0 o tienda cerrada)
+
+    capacity = free_capacity(list(requested), slot_starts, duration)
+
+    for item_id, quantity in requested.items():
+        fits &= capacity[item_id] >= quantity
+
+    return fits
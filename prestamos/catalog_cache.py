@@ -0,0 +1,29 @@
+from .runtime_settings import VersionStamp, get_settings
+
+"""
+Versión del catálogo para la caché de fragmentos
+
+Los fragmentos del catálogo en `order_form.html` (barra de categorías y
+cuadrícula de artículos) se guardan en caché con una llave que incluye la
+versión del catálogo. Las señales de `Item`, `Category` y `Unit`, y las
+cargas por lotes, incrementan la versión en el setting CATALOG_VERSION; cada
+proceso la vuelve a leer a lo más cada PRESTAMOS_SETTINGS_TTL segundos con
+`VersionStamp`, así que los fragmentos viejos dejan de usarse en
+todos los procesos sin borrarlos uno por uno.
+"""
+
+CATALOG_VERSION = VersionStamp('CATALOG_VERSION')
+
+
+def catalog_version():
+    """
+    :return: Versión del catálogo y de la configuración, para las llaves de los
+             fragmentos; a lo más una consulta cada PRESTAMOS_SETTINGS_TTL segundos
+    """
+    # El tamaño de página y otros valores de la configuración también cambian los fragmentos
+    return f'{CATALOG_VERSION.get()}.{get_settings().version}'
+
+
+def bump_catalog_version():
+    """Invalida los fragmentos del catálogo en todos los procesos"""
+    CATALOG_VERSION.bump()
@@ -0,0 +1,173 @@
+import csv
+import json
+from abc import ABC, abstractmethod
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Item, Unit, Order
+
+"""
+Exportaciones en streaming
+
+Los registros se leen en bloques por llave primaria (`pk > último`, `LIMIT
+chunk_size`) y se escriben fila por fila en CSV o JSONL, así que en memoria
+solo hay un bloque a la vez. No se usa `.iterator()`: con mysqlclient no hay
+cursores del lado del servidor y el controlador cargaría toda la tabla. Las mismas exportaciones se usan en las acciones del admin
+(`StreamingHttpResponse`) y en el comando `export_data`.
+"""
+
+CHUNK_SIZE = 2000
+
+
+class Echo:
+    """Objeto tipo archivo que regresa lo que se le escribe, para `csv.writer`"""
+
+    def write(self, value):
+        return value
+
+
+class Export(ABC):
+    """Definición de una exportación: encabezados, QuerySet y conversión de cada registro a fila"""
+
+    model = None
+    headers = []
+
+    def queryset(self):
+        return self.model.objects.all()
+
+    def prepare(self, queryset):
+        """Agrega select_related/prefetch_related para no hacer consultas por registro"""
+        return queryset
+
+    @abstractmethod
+    def row(self, obj):
+        """
+        :param obj: Registro del QuerySet preparado
+        :return: Lista de valores alineada con `headers`
+        """
+
+    def rows(self, queryset=None, chunk_size=CHUNK_SIZE):
+        """
+        :param queryset: QuerySet a exportar, por defecto todos los registros
+        :param chunk_size: Registros leídos de la base de datos por bloque
+        :return: Generador de filas (listas alineadas con `headers`)
+        """
+        queryset = self.prepare(self.queryset() if queryset is None else queryset).order_by('pk')
+        last = None
+        while True:
+            batch = queryset if last is None else queryset.filter(pk__gt=last)
+            chunk = list(batch[:chunk_size])  # una consulta (más los prefetch) por bloque
+            for obj in chunk:
+                yield self.row(obj)
+            if len(chunk) < chunk_size:
+                return
+            last = chunk[-1].pk
+
+
+class ItemExport(Export):
+    model = Item
+    headers = ['id', 'name', 'description', 'categories', 'available_units_count']
+
+    def prepare(self, queryset):
+        return queryset.defer('search_document').prefetch_related('category')
+
+    def row(self, item):
+        return [item.pk, item.name, item.description or '', ';'.join(c.name for c in item.category.all()),
+                item.available_units_count]
+
+
+class UnitExport(Export):
+    model = Unit
+    headers = ['id', 'item', 'item_name', 'serial_number', 'available']
+
+    def prepare(self, queryset):
+        return queryset.select_related('item').only('serial_number', 'available', 'item__name')
+
+    def row(self, unit):
+        return [unit.pk, unit.item_id, unit.item.name, unit.serial_number, unit.available]
+
+
+class OrderExport(Export):
+    """Historial de órdenes con sus unidades y su reporte"""
+
+    model = Order
+    headers = ['id', 'user', 'status', 'order_date', 'return_date', 'created_at', 'approved_by',
+               'units', 'report_active', 'report_details']
+
+    def prepare(self, queryset):
+        return (queryset
+                .select_related('user', 'approved_by', 'reports')
+                .prefetch_related(Prefetch('units', Unit.objects.select_related('item').only(
+                    'serial_number', 'item__name'))))
+
+    def row(self, order):
+        report = getattr(order, 'reports', None)
+        return [
+            order.pk,
+            order.user.username,
+            order.status,
+            order.order_date,
+            order.return_date,
+            order.created_at,
+            order.approved_by.username if order.approved_by else '',
+            ';'.join(f'{unit.item.name} ({unit.serial_number})' for unit in order.units.all()),
+            report.active if report else '',
+            (report.details or '') if report else '',
+        ]
+
+
+EXPORTS = {
+    'items': ItemExport,
+    'units': UnitExport,
+    'orders': OrderExport,
+}
+
+
+def _format_value(value):
+    if hasattr(value, 'isoformat'):
+        return timezone.localtime(value).isoformat() if timezone.is_aware(value) else value.isoformat()
+    return value
+
+
+def csv_lines(export, queryset=None, chunk_size=CHUNK_SIZE):
+    """
+    :return: Generador de líneas CSV, empezando por los encabezados
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(export.headers)
+    for row in export.rows(queryset, chunk_size):
+        yield writer.writerow([_format_value(value) for value in row])
+
+
+def jsonl_lines(export, queryset=None, chunk_size=CHUNK_SIZE):
+    """
+    :return: Generador de líneas JSON, un objeto por registro
+    """
+    for row in export.rows(queryset, chunk_size):
+        yield json.dumps(dict(zip(export.headers, map(_format_value, row))), cls=DjangoJSONEncoder,
+                         ensure_ascii=False) + '\n'
+
+
+FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'jsonl': (jsonl_lines, 'application/x-ndjson'),
+}
+
+
+def streaming_response(export, file_format, queryset=None, filename=None):
+    """
+    :param export: Instancia de Export
+    :param file_format: 'csv' o 'jsonl'
+    :param queryset: Registros a exportar
+    :param filename: Nombre del archivo descargado
+    :return: StreamingHttpResponse con la exportación
+    """
+    lines, content_type = FORMATS[file_format]
+    filename = filename or f'{export.model._meta.model_name}-{timezone.localdate():%Y%m%d}.{file_format}'
+
+    response = StreamingHttpResponse(lines(export, queryset), content_type=f'{content_type}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
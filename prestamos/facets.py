@@ -0,0 +1,51 @@
+import hashlib
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from .catalog_cache import catalog_version
+from .models import Item
+from .search import search_items
+
+"""
+Facetas de categorías del catálogo
+
+El número de artículos de cada categoría, para el término de búsqueda
+actual, se calcula con una sola consulta agrupada sobre la tabla intermedia
+`Item.category` y se guarda en caché por versión del catálogo y término.
+Las categorías sin artículos no aparecen en el resultado.
+"""
+
+CategoryFacet = namedtuple('CategoryFacet', ['pk', 'name', 'count'])
+
+
+def category_facets(search_query=''):
+    """
+    :param search_query: Término de búsqueda; vacío para todo el catálogo
+    :return: Lista de CategoryFacet con al menos un artículo, ordenada por nombre
+    """
+    search_query = ' '.join(search_query.split())
+    key = 'prestamos:facets:' + hashlib.md5(f'{catalog_version()}|{search_query}'.encode()).hexdigest()
+
+    facets = cache.get(key)
+    if facets is None:
+        if search_query:
+            # Agrupar los artículos encontrados por su categoría, sin el orden por relevancia
+            rows = (search_items(Item.objects.all(), search_query)
+                    .order_by()
+                    .filter(category__isnull=False)
+                    .values_list('category', 'category__name')
+                    .annotate(count=Count('pk'))
+                    .order_by('category__name'))
+        else:
+            rows = (Item.category.through.objects
+                    .values_list('category_id', 'category__name')
+                    .annotate(count=Count('item_id'))
+                    .order_by('category__name'))
+
+        facets = [CategoryFacet(*row) for row in rows]
+        cache.set(key, facets, getattr(settings, 'PRESTAMOS_CATALOG_CACHE_TIMEOUT', 600))
+
+    return facets
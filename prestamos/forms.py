@@ -1,12 +1,10 @@
-import datetime
-
 from django import forms
 from django.core.exceptions import ValidationError
-from django.forms import formset_factory
+from django.forms import BaseFormSet, formset_factory
 from django.utils import timezone
-from extra_settings.models import Setting
 
 from .models import Order, Item, Report
+from .store_calendar import get_calendar
 
 """
 Formulario para aprobar una orden
@@ -32,31 +30,76 @@ Formulario de artículos y unidades
 """
 
 
+class ItemIdField(forms.IntegerField):
+    """
+    Id de un artículo en un campo oculto. A diferencia de `ModelChoiceField`
+    no enumera el catálogo al renderizar ni consulta la base de datos al
+    validar; el formset resuelve los artículos de todas las líneas a la vez.
+    """
+
+    widget = forms.HiddenInput
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('min_value', 1)
+        super().__init__(**kwargs)
+
+
 class OrderItemForm(forms.Form):
-    item = forms.ModelChoiceField(
-        queryset=Item.objects.all(),
-        widget=forms.Select()
-    )
+    item = ItemIdField()
     quantity = forms.IntegerField(min_value=1)
 
+    # Artículos precargados por `BaseOrderItemFormSet`, {id: Item}
+    item_lookup = None
+
+    def clean_item(self):
+        item_id = self.cleaned_data['item']
+
+        if self.item_lookup is None:  # formulario usado fuera del formset
+            self.item_lookup = Item.objects.defer('search_document').in_bulk([item_id])
+
+        item = self.item_lookup.get(item_id)
+        if item is None:
+            raise ValidationError('El artículo seleccionado no existe.')
+        return item
+
     def clean(self):
         cleaned_data = super().clean()
         item = cleaned_data.get('item')
         quantity = cleaned_data.get('quantity')
-        order_date = self.initial.get('order_date')
-        return_date = self.initial.get('return_date')
 
         if item and quantity:
-            # Verificar si el artículo tiene suficientes unidades disponibles
-            available_units = item.avalable_units()
-            if len(available_units) < quantity:
-                raise ValidationError(f"Solo existen {len(available_units)} unidad(es) del artículo '{item.name}'")
+            # Verificar si el artículo tiene suficientes unidades disponibles, sin cargar las unidades
+            if item.available_units_count < quantity:
+                raise ValidationError(f"Solo existen {item.available_units_count} unidad(es) del artículo '{item.name}'")
 
         return cleaned_data
 
 
+class BaseOrderItemFormSet(BaseFormSet):
+    """Valida todas las líneas con una sola consulta `in_bulk` de los artículos"""
+
+    def full_clean(self):
+        if self.is_bound:
+            item_lookup = self.load_items()
+            for form in self.forms:
+                form.item_lookup = item_lookup
+        super().full_clean()
+
+    def load_items(self):
+        """
+        :return: Diccionario {id: Item} con los artículos enviados en todas las líneas
+        """
+        ids = set()
+        for form in self.forms:
+            try:
+                ids.add(int(form['item'].data))
+            except (TypeError, ValueError):
+                continue  # el campo reporta el error
+        return Item.objects.defer('search_document').in_bulk(ids)
+
+
 # cantidad maxima de artículos por solicitud
-OrderItemFormSet = formset_factory(OrderItemForm, max_num=50, validate_max=True)
+OrderItemFormSet = formset_factory(OrderItemForm, formset=BaseOrderItemFormSet, max_num=50, validate_max=True)
 
 """
 Formulario de Reporte
@@ -90,8 +133,7 @@ class OrderForm(forms.ModelForm):
 
         self.validate_no_past_dates(order_date, return_date)
         self.validate_dates_sequence(order_date, return_date)
-        self.validate_open_days(order_date, return_date)
-        self.validate_store_hours(order_date, return_date)
+        self.validate_store_calendar(order_date, return_date)
 
         return cleaned_data
 
@@ -100,36 +142,10 @@ class OrderForm(forms.ModelForm):
         if order_date and return_date and order_date >= return_date:
             raise ValidationError('La fecha de entrega debe ser anterior a la fecha de devolución.')
 
-    def validate_store_hours(self, order_date, return_date):
-        """Valida que las horas de las fechas estén dentro del horario de apertura y cierre de la tienda"""
-        opening_time = Setting.get("STORE_OPENING_TIME", default=datetime.time(1, 0))
-        closing_time = Setting.get("STORE_CLOSING_TIME", default=datetime.time(0, 0))
-
-        opening_time_12hr = opening_time.strftime("%I:%M %p")
-        closing_time_12hr = closing_time.strftime("%I:%M %p")
-
-        if order_date.time() < opening_time or return_date.time() < opening_time:
-            raise ValidationError(f'Lo más temprano que puede ordenar es {opening_time_12hr}')
-        if order_date.time() > closing_time or return_date.time() > closing_time:
-            raise ValidationError(f'Lo más tarde que puede ordenar es {closing_time_12hr}')
-
-    def validate_open_days(self, order_date, return_date):
-        """Valida que las fechas caigan en días en los que la tienda está abierta"""
-        # Obtener los días de apertura y convertir todo a minúsculas
-        store_open_days = Setting.get("STORE_OPEN_DAYS", "")
-        store_open_days_list = [day.strip().lower() for day in
-                                store_open_days.split(",")]  # Elimina espacios y convierte a minúsculas
-
-        # Validar días de apertura
-        if order_date:
-            order_day = order_date.strftime("%A").lower()  # Obtener el día de la semana en inglés (minúscula)
-            if order_day not in store_open_days_list:
-                raise ValidationError(f'La tienda no está abierta el día {self.translate_day_to_spanish(order_day)}.')
-
-        if return_date:
-            return_day = return_date.strftime("%A").lower()  # Obtener el día de la semana en inglés (minúscula)
-            if return_day not in store_open_days_list:
-                raise ValidationError(f'La tienda no está abierta el día {self.translate_day_to_spanish(return_day)}.')
+    def validate_store_calendar(self, order_date, return_date):
+        """Valida que la entrega y la devolución caigan en días y horario de atención de la tienda"""
+        if order_date and return_date:
+            get_calendar().validate(order_date, return_date)
 
     def validate_no_past_dates(self, order_date, return_date):
         """Valida que las fechas no estén en el pasado"""
@@ -140,17 +156,3 @@ class OrderForm(forms.ModelForm):
 
         if return_date and return_date < now:
             raise ValidationError('La fecha de devolución no puede estar en el pasado.')
-
-    def translate_day_to_spanish(self, day_in_english):
-        """Traduce el nombre del día de la semana del inglés al español solo para los mensajes de error"""
-        days_mapping = {
-            'monday': 'lunes',
-            'tuesday': 'martes',
-            'wednesday': 'miércoles',
-            'thursday': 'jueves',
-            'friday': 'viernes',
-            'saturday': 'sábado',
-            'sunday': 'domingo'
-        }
-        return days_mapping.get(day_in_english,
-                                day_in_english).capitalize()  # Capitaliza la primera letra para el mensaje
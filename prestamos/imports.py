@@ -0,0 +1,262 @@
+import csv
+import io
+import os
+from abc import ABC, abstractmethod
+from itertools import islice
+
+from django.db import DatabaseError, connection, transaction
+
+from .availability import invalidate_timelines
+from .catalog_cache import bump_catalog_version
+from .ingestion import CatalogIngestor, IngestResult, name_key
+from .models import Item, Unit
+
+"""
+Importación por lotes de artículos y unidades
+
+Lee CSV o XLSX (openpyxl en modo read-only) fila por fila y procesa bloques
+de `batch_size` filas: las llaves foráneas de cada bloque se resuelven con
+una sola consulta, las unidades se insertan o actualizan con un upsert sobre
+`unique_together (item, serial_number)` y cada bloque corre en su propia
+transacción. La memoria usada depende del tamaño del bloque, no del archivo.
+"""
+
+TRUE_VALUES = {'1', 'true', 'verdadero', 'si', 'sí', 'yes', 'y', 's', 'x'}
+FALSE_VALUES = {'0', 'false', 'falso', 'no', 'n', ''}
+
+# Máximo de errores por fila que se conservan en el resultado
+MAX_ERRORS = 1000
+
+
+def read_table(file, file_format):
+    """
+    :param file: Archivo binario
+    :param file_format: 'csv' o 'xlsx'
+    :return: Generador de pares (número de fila, diccionario {columna: valor})
+    """
+    if file_format == 'xlsx':
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            headers = [str(header or '').strip().lower() for header in next(rows, [])]
+            for number, values in enumerate(rows, start=2):
+                if any(value is not None for value in values):
+                    yield number, dict(zip(headers, values))
+        finally:
+            workbook.close()
+    else:
+        text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+        reader = csv.DictReader(text)
+        reader.fieldnames = [header.strip().lower() for header in reader.fieldnames or []]
+        for number, row in enumerate(reader, start=2):
+            yield number, row
+
+
+def guess_format(filename):
+    return 'xlsx' if os.path.splitext(filename)[1].lower() in ('.xlsx', '.xlsm') else 'csv'
+
+
+def parse_bool(value, default=True):
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return default if text == '' else False
+    raise ValueError(f'Valor booleano no válido: {value!r}')
+
+
+class ImportResult:
+    """Resumen de una importación, con los errores de cada lote"""
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.errors = []  # (fila, mensaje)
+
+    def add_error(self, row, message):
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((row, message))
+
+    def __str__(self):
+        return (f'{self.rows} filas en {self.batches} lotes: {self.imported} importadas, '
+                f'{len(self.errors)} errores, {self.failed_batches} lotes fallidos')
+
+
+class Importer(ABC):
+    """Recorre el archivo por bloques; cada subclase procesa un bloque"""
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+
+    def run(self, rows):
+        """
+        :param rows: Iterable de pares (número de fila, diccionario) de `read_table`
+        :return: ImportResult
+        """
+        result = ImportResult()
+        rows = iter(rows)
+
+        while batch := list(islice(rows, self.batch_size)):
+            result.rows += len(batch)
+            result.batches += 1
+            try:
+                with transaction.atomic():
+                    result.imported += self.import_batch(batch, result)
+            except DatabaseError as e:
+                result.failed_batches += 1
+                result.add_error(batch[0][0], f'Lote de las filas {batch[0][0]}-{batch[-1][0]} revertido: {e}')
+
+        return result
+
+    @abstractmethod
+    def import_batch(self, batch, result):
+        """
+        :param batch: Lista de pares (número de fila, diccionario)
+        :param result: ImportResult donde se anotan los errores por fila
+        :return: Número de filas importadas
+        """
+
+
+class ItemImporter(Importer):
+    """Columnas: name, description y categories (separadas por ';')"""
+
+    def __init__(self, batch_size=1000):
+        super().__init__(batch_size)
+        self.ingestor = CatalogIngestor(batch_size)
+
+    def import_batch(self, batch, result):
+        records = []
+        for number, row in batch:
+            if not str(row.get('name') or '').strip():
+                result.add_error(number, 'Falta el nombre del artículo')
+                continue
+            records.append({
+                'name': str(row['name']),
+                'description': str(row.get('description') or ''),
+                'categories': str(row.get('categories') or '').split(';'),
+            })
+
+        if not records:
+            return 0
+
+        ingested = IngestResult()
+        # Si el lote se revierte, el ingestor descarta también los nombres que agregó a sus índices
+        self.ingestor.ingest_atomic(records, ingested)
+        # Los nombres que ya existían se omiten, no cuentan como importados
+        return len(ingested.created)
+
+
+class UnitImporter(Importer):
+    """
+    Columnas: item (nombre del artículo) o item_id (id del artículo),
+    serial_number y available (opcional). Una unidad existente con el mismo
+    artículo y número de serie se actualiza.
+    """
+
+    def __init__(self, batch_size=1000):
+        super().__init__(batch_size)
+        self.names = None  # {name_key: id}, se carga con el primer bloque
+
+    def resolve_items(self, ids, names):
+        """
+        Resuelve los artículos de un bloque: los ids con una sola consulta y los
+        nombres con un índice `name_key` precargado, como `CatalogIngestor`, para
+        que "  arduino uno" encuentre "Arduino Uno".
+
+        :param ids: Conjunto de valores de la columna `item_id`
+        :param names: Conjunto de valores de la columna `item`
+        :return: Diccionario {(columna, valor): id del artículo}
+        """
+        if names and self.names is None:
+            # Nombres repetidos en el catálogo: se usa el artículo más antiguo
+            self.names = {name_key(name.strip()): pk
+                          for name, pk in Item.objects.order_by('-pk').values_list('name', 'pk')}
+
+        resolved = {}
+        valid_ids = {int(ref) for ref in ids if ref.isdigit()}
+        for pk in Item.objects.filter(pk__in=valid_ids).values_list('pk', flat=True):
+            resolved['item_id', str(pk)] = pk
+        for name in names:
+            if name_key(name) in self.names:
+                resolved['item', name] = self.names[name_key(name)]
+        return resolved
+
+    def import_batch(self, batch, result):
+        references = {}  # número de fila -> (columna, valor)
+        for number, row in batch:
+            item_id = str(row.get('item_id') or '').strip()
+            references[number] = ('item_id', item_id) if item_id else ('item', str(row.get('item') or '').strip())
+
+        items = self.resolve_items({value for column, value in references.values() if column == 'item_id'},
+                                   {value for column, value in references.values() if column == 'item'} - {''})
+
+        max_length = Unit._meta.get_field('serial_number').max_length
+        units = {}  # (item_id, serial) -> Unit; la última fila repetida gana
+        for number, row in batch:
+            reference = references[number]
+            serial = str(row.get('serial_number') or '').strip()
+
+            if reference not in items:
+                column, value = reference
+                result.add_error(number, f'No existe el artículo con id {value!r}' if column == 'item_id'
+                                 else f'No existe el artículo {value!r}')
+                continue
+            if not serial:
+                result.add_error(number, 'Falta el número de serie')
+                continue
+            if len(serial) > max_length:
+                result.add_error(number, f'El número de serie tiene más de {max_length} caracteres')
+                continue
+            try:
+                available = parse_bool(row.get('available'))
+            except ValueError as e:
+                result.add_error(number, str(e))
+                continue
+
+            units[items[reference], serial] = Unit(item_id=items[reference], serial_number=serial,
+                                                   available=available)
+
+        if not units:
+            return 0
+
+        # MySQL no acepta columnas de conflicto: ON DUPLICATE KEY UPDATE usa cualquier llave única
+        conflict_target = {'unique_fields': ['item', 'serial_number']}
+        if not connection.features.supports_update_conflicts_with_target:
+            conflict_target = {}
+
+        Unit.objects.bulk_create(units.values(), batch_size=self.batch_size, update_conflicts=True,
+                                 update_fields=['available'], **conflict_target)
+
+        # bulk_create no emite señales: actualizar conteos, versión del catálogo y líneas de tiempo del lote
+        item_ids = {item_id for item_id, _ in units}
+        Item.update_available_units_count(item_ids)
+        bump_catalog_version()
+        transaction.on_commit(lambda: invalidate_timelines(item_ids))
+
+        return len(units)
+
+
+IMPORTERS = {
+    'items': ItemImporter,
+    'units': UnitImporter,
+}
+
+
+def import_file(kind, file, file_format, batch_size=1000):
+    """
+    :param kind: 'items' o 'units'
+    :param file: Archivo binario CSV o XLSX
+    :param file_format: 'csv' o 'xlsx'
+    :param batch_size: Filas por lote y por transacción
+    :return: ImportResult
+    """
+    return IMPORTERS[kind](batch_size).run(read_table(file, file_format))
@@ -0,0 +1,197 @@
+import csv
+import json
+from itertools import islice
+
+from django.db import transaction
+
+from .catalog_cache import bump_catalog_version
+from .models import Category, Item
+from .search import index_items, normalize
+
+"""
+Carga masiva del catálogo
+
+Recibe un flujo de registros {'name', 'description', 'categories'} (de la API
+de Google Books, CSV o JSONL), los compara en memoria contra un índice de
+nombres precargado y escribe artículos, categorías y filas de
+`Item.category.through` con `bulk_create` por lotes, una transacción por lote.
+
+Los índices usan el nombre sin acentos ni mayúsculas (`name_key`): la
+colación por defecto de MySQL considera iguales "Física" y "fisica", así que
+se tratan como el mismo artículo o categoría.
+"""
+
+
+def name_key(name):
+    """
+    :param name: Nombre de un artículo o categoría
+    :return: Llave con la que la colación de MySQL (*_ai_ci) lo compara
+    """
+    return normalize(name).casefold()
+
+
+def read_csv(file, categories_separator=';'):
+    """
+    :param file: Archivo de texto con encabezados name, description y categories
+    :param categories_separator: Separador de las categorías dentro de la columna
+    :return: Generador de registros
+    """
+    for row in csv.DictReader(file):
+        yield {
+            'name': row.get('name', ''),
+            'description': row.get('description', ''),
+            'categories': [name for name in (row.get('categories') or '').split(categories_separator)],
+        }
+
+
+def read_jsonl(file):
+    """
+    :param file: Archivo de texto con un objeto JSON por línea
+    :return: Generador de registros
+    """
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def google_books_records(volumes, category_name):
+    """
+    :param volumes: Volúmenes de la API de Google Books
+    :param category_name: Categoría con la que se buscaron
+    :return: Generador de registros
+    """
+    for volume in volumes:
+        volume_info = volume.get('volumeInfo', {})
+        yield {
+            'name': volume_info.get('title', 'Título Desconocido'),
+            'description': volume_info.get('description', 'Sin descripción disponible.'),
+            'categories': [category_name, *volume_info.get('categories', [])],
+        }
+
+
+class IngestResult:
+    """Resumen de una carga"""
+
+    def __init__(self):
+        self.created = {}  # nombre -> id de los artículos creados
+        self.existing = {}  # nombre -> id de los artículos que ya existían
+        self.categories_created = 0
+        self.links_created = 0
+        self.skipped = 0  # registros sin nombre
+
+    def __str__(self):
+        return (f'{len(self.created)} artículos creados, {len(self.existing)} existentes, '
+                f'{self.categories_created} categorías nuevas, {self.links_created} relaciones, '
+                f'{self.skipped} registros omitidos')
+
+
+class CatalogIngestor:
+    """Carga registros de artículos sin consultas por registro"""
+
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
+        # Índices {name_key: id} precargados, se actualizan con cada lote
+        self.items = {name_key(name): pk for name, pk in Item.objects.values_list('name', 'pk')}
+        self.categories = {name_key(name): pk for name, pk in Category.objects.values_list('name', 'pk')}
+        self.created_keys = set()  # artículos creados por esta carga
+
+    def ingest(self, records):
+        """
+        :param records: Iterable de registros {'name', 'description', 'categories'}
+        :return: IngestResult
+        """
+        result = IngestResult()
+        records = iter(records)
+
+        while batch := list(islice(records, self.batch_size)):
+            self.ingest_atomic(batch, result)
+
+        return result
+
+    def ingest_atomic(self, batch, result):
+        """
+        Carga un lote en su propia transacción. Si se revierte, los índices
+        vuelven a su estado anterior para no apuntar a ids que no existen.
+        """
+        snapshot = dict(self.items), dict(self.categories), set(self.created_keys)
+        try:
+            with transaction.atomic():
+                self.ingest_batch(batch, result)
+        except BaseException:
+            self.items, self.categories, self.created_keys = snapshot
+            raise
+
+    def ingest_batch(self, batch, result):
+        new_items = {}  # name_key -> (nombre, registro), deduplicado también dentro del lote
+        links = {}  # name_key del artículo -> name_keys de sus categorías
+        category_names = {}  # name_key -> primer nombre con el que aparece
+
+        for record in batch:
+            name = (record.get('name') or '').strip()[:255]
+            if not name:
+                result.skipped += 1
+                continue
+
+            key = name_key(name)
+            if key in self.items:
+                if key not in self.created_keys:
+                    result.existing[name] = self.items[key]
+                continue
+
+            new_items.setdefault(key, (name, record))
+            for category in record.get('categories') or []:
+                if category.strip():
+                    category = category.strip()[:255]
+                    category_names.setdefault(name_key(category), category)
+                    links.setdefault(key, set()).add(name_key(category))
+
+        # Categorías nuevas; se vuelven a leer por nombre porque la base de datos puede
+        # considerar igual una categoría existente y descartarla con ignore_conflicts
+        missing = {category for keys in links.values() for category in keys} - self.categories.keys()
+        if missing:
+            names = [category_names[key] for key in missing]
+            Category.objects.bulk_create([Category(name=name) for name in names],
+                                         batch_size=self.batch_size, ignore_conflicts=True)
+            rows = Category.objects.filter(name__in=names).values_list('name', 'pk')
+            created = {name_key(name): pk for name, pk in rows}
+            result.categories_created += len(created.keys() & missing)
+            self.categories.update(created)
+
+        if not new_items:
+            return
+
+        # Artículos nuevos; MySQL no devuelve las llaves de bulk_create, se leen por nombre
+        created = Item.objects.bulk_create([
+            Item(name=name, description=record.get('description') or '')
+            for name, record in new_items.values()
+        ], batch_size=self.batch_size)
+
+        if all(item.pk for item in created):
+            rows = [(item.name, item.pk) for item in created]
+        else:
+            rows = (Item.objects.filter(name__in=[name for name, _ in new_items.values()])
+                    .order_by('pk').values_list('name', 'pk'))
+        created = {name_key(name): pk for name, pk in rows}
+
+        self.items.update(created)
+        self.created_keys.update(created)
+        result.created.update((name, created[key]) for key, (name, _) in new_items.items())
+
+        through = Item.category.through
+        rows = [through(item_id=created[key], category_id=self.categories[category])
+                for key, categories in links.items() for category in categories if category in self.categories]
+        through.objects.bulk_create(rows, batch_size=self.batch_size, ignore_conflicts=True)
+        result.links_created += len(rows)
+
+        # bulk_create no emite señales: actualizar el índice de búsqueda del lote y la versión del catálogo
+        index_items(created.values())
+        bump_catalog_version()
+
+
+def ingest_items(records, batch_size=500):
+    """
+    :param records: Iterable de registros {'name', 'description', 'categories'}
+    :param batch_size: Registros por lote y por transacción
+    :return: IngestResult
+    """
+    return CatalogIngestor(batch_size).ingest(records)
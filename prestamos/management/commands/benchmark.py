@@ -0,0 +1,238 @@
+import json
+import platform
+import random
+import statistics
+import time
+from datetime import timedelta
+
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from prestamos.catalog_cache import bump_catalog_version
+from prestamos.forms import OrderForm, OrderItemFormSet
+from prestamos.models import Category, Item, Unit, Order, OrderStatusChoices
+from prestamos.pagination import encode_cursor
+from prestamos.runtime_settings import invalidate_settings
+from prestamos.search import index_items
+from prestamos.views import OrderCreateView
+
+
+class Command(BaseCommand):
+    help = ('Carga un catálogo de prueba y mide latencia y número de consultas del flujo de órdenes. '
+            'Usar con --settings=almacen.settings.demo')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=500, help='Artículos en el catálogo')
+        parser.add_argument('--units', type=int, default=5, help='Unidades por artículo')
+        parser.add_argument('--categories', type=int, default=20, help='Número de categorías')
+        parser.add_argument('--orders', type=int, default=2000, help='Órdenes en el historial')
+        parser.add_argument('--iterations', type=int, default=30, help='Repeticiones por escenario')
+        parser.add_argument('--warmup', type=int, default=3, help='Repeticiones descartadas por escenario')
+        parser.add_argument('--seed', type=int, default=0, help='Semilla para los datos aleatorios')
+        parser.add_argument('--output', type=str, help='Archivo JSON de salida (por defecto stdout)')
+        parser.add_argument('--use-current-db', action='store_true',
+                            help='Usar la base de datos actual en lugar de una base de prueba temporal')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+
+        if options['use_current_db']:
+            results = self.run(options)
+        else:
+            # Base de datos temporal, igual que `manage.py test`
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            cache.clear()  # descartar valores en caché de la base de datos anterior
+            invalidate_settings()
+            try:
+                results = self.run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        report = json.dumps(results, indent=2)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report)
+            self.stderr.write(self.style.SUCCESS(f'Resultados guardados en {options["output"]}'))
+        else:
+            self.stdout.write(report)
+
+    def run(self, options):
+        started = time.perf_counter()
+        user, admin = self.seed(options)
+        seed_seconds = time.perf_counter() - started
+
+        client = Client()
+        client.force_login(user)
+        admin_client = Client()
+        admin_client.force_login(admin)
+
+        items = list(Item.objects.order_by('pk').values_list('pk', flat=True)[:3])
+
+        # Cursor hacia el último 10% del catálogo
+        deep_item = Item.objects.order_by('name', 'pk')[options['items'] * 9 // 10]
+        deep_cursor = encode_cursor([deep_item.name, deep_item.pk])
+        window = iter(range(1, 10 ** 6))
+        scenarios = {
+            # Con la caché de fragmentos llena; las variantes `_cold` la vacían antes de cada repetición
+            'order_create_get': lambda: client.get('/items/'),
+            'order_create_get_search': lambda: client.get('/items/', {'search': 'libro 1'}),
+            'order_create_get_deep_page': lambda: client.get('/items/', {'cursor': deep_cursor}),
+            'order_create_post': lambda: client.post('/items/', self.order_data(items, 1, next(window))),
+            # La primera repetición reserva todas las unidades, las demás buscan alternativas
+            'order_create_post_unavailable': lambda: client.post(
+                '/items/', self.order_data(items, options['units'], 0)),
+            'suggest_alternatives': lambda: self.suggest_alternatives(user, items),
+            'order_history_list': lambda: client.get('/orders/history/'),
+            'admin_order_changelist': lambda: admin_client.get('/admin/prestamos/order/'),
+            'admin_unit_changelist': lambda: admin_client.get('/admin/prestamos/unit/'),
+            'admin_item_changelist': lambda: admin_client.get('/admin/prestamos/item/'),
+        }
+
+        cold = {
+            f'{name}_cold': scenarios[name]
+            for name in ('order_create_get', 'order_create_get_search', 'order_create_get_deep_page')
+        }
+
+        iterations, warmup = options['iterations'], options['warmup']
+        results = {name: self.measure(scenario, iterations, warmup) for name, scenario in scenarios.items()}
+        results.update((name, self.measure(scenario, iterations, warmup, before=cache.clear))
+                       for name, scenario in cold.items())
+
+        return {
+            'meta': {
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'timestamp': timezone.now().isoformat(),
+                'seed_seconds': round(seed_seconds, 3),
+                'dataset': {key: options[key] for key in ('items', 'units', 'categories', 'orders', 'seed')},
+                'iterations': options['iterations'],
+                'warmup': options['warmup'],
+            },
+            'scenarios': results,
+        }
+
+    def measure(self, scenario, iterations, warmup, before=None):
+        """
+        Ejecuta un escenario varias veces y resume latencias y consultas.
+
+        :param scenario: Función sin argumentos a medir
+        :param iterations: Repeticiones medidas
+        :param warmup: Repeticiones previas que no se cuentan
+        :param before: Función que se llama antes de cada repetición, fuera de la medición
+        :return: Diccionario con percentiles en milisegundos y consultas SQL
+        """
+        for _ in range(warmup):
+            scenario()
+
+        timings = []
+        queries = []
+
+        for _ in range(iterations):
+            if before:
+                before()
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = scenario()
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(context.captured_queries))
+
+            status = getattr(response, 'status_code', 200)
+            if status >= 400:
+                raise RuntimeError(f'El escenario respondió con estado {status}')
+
+        percentiles = statistics.quantiles(timings, n=100, method='inclusive') if len(timings) > 1 else timings * 99
+
+        return {
+            'ms': {
+                'min': round(min(timings), 3),
+                'mean': round(statistics.fmean(timings), 3),
+                'p50': round(percentiles[49], 3),
+                'p90': round(percentiles[89], 3),
+                'p95': round(percentiles[94], 3),
+                'p99': round(percentiles[98], 3),
+                'max': round(max(timings), 3),
+            },
+            'queries': {
+                'min': min(queries),
+                'mean': round(statistics.fmean(queries), 2),
+                'max': max(queries),
+            },
+        }
+
+    def seed(self, options):
+        """Crea usuarios, categorías, artículos, unidades y un historial de órdenes"""
+        with transaction.atomic():
+            user = User.objects.create_user(username='benchmark', password='benchmark')
+            admin = User.objects.create_superuser(username='benchmark-admin', password='benchmark')
+
+            categories = Category.objects.bulk_create(
+                Category(name=f'Categoría {n}') for n in range(options['categories']))
+
+            items = Item.objects.bulk_create(
+                Item(name=f'Libro {n}', description=f'Descripción del libro {n}') for n in range(options['items']))
+
+            Item.category.through.objects.bulk_create(
+                Item.category.through(item_id=item.pk, category_id=category.pk)
+                for item in items for category in random.sample(categories, min(2, len(categories))))
+
+            units = Unit.objects.bulk_create(
+                Unit(item=item, serial_number=f'S-{item.pk}-{n}') for item in items for n in range(options['units']))
+
+            # bulk_create no emite señales: índice de búsqueda, conteos y versión del catálogo
+            index_items([item.pk for item in items])
+            Item.update_available_units_count([item.pk for item in items])
+            bump_catalog_version()
+
+            now = timezone.now()
+            orders = Order.objects.bulk_create(
+                Order(user=user,
+                      order_date=(start := now + timedelta(hours=random.randint(-24 * 365, 24 * 30))),
+                      return_date=start + timedelta(hours=random.randint(1, 8)),
+                      status=random.choice(OrderStatusChoices.values))
+                for _ in range(options['orders']))
+
+            Order.units.through.objects.bulk_create(
+                (Order.units.through(order_id=order.pk, unit_id=unit.pk)
+                 for order in orders for unit in random.sample(units, min(3, len(units)))),
+                ignore_conflicts=True)
+
+        return user, admin
+
+    def order_data(self, items, quantity, day):
+        """Datos de un POST a OrderCreateView en una ventana de las 10:00 a las 11:00"""
+        start = timezone.localtime() + timedelta(days=400 + day)
+        start = start.replace(hour=10, minute=0, second=0, microsecond=0)
+
+        data = {
+            'order_date': start.strftime('%Y-%m-%dT%H:%M'),
+            'return_date': (start + timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M'),
+            'form-TOTAL_FORMS': str(len(items)),
+            'form-INITIAL_FORMS': '0',
+        }
+        for index, item_id in enumerate(items):
+            data[f'form-{index}-item'] = item_id
+            data[f'form-{index}-quantity'] = quantity
+
+        return data
+
+    def suggest_alternatives(self, user, items):
+        """Llama directamente a `OrderCreateView.suggest_alternatives`"""
+        data = self.order_data(items, 1, 0)
+        order_form = OrderForm(data)
+        item_formset = OrderItemFormSet(data)
+        if not (order_form.is_valid() and item_formset.is_valid()):
+            raise RuntimeError('Los datos del escenario no son válidos')
+
+        view = OrderCreateView()
+        view.request = type('Request', (), {'user': user})()
+        return view.suggest_alternatives(order_form, item_formset)
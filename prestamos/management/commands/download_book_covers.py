@@ -1,104 +1,200 @@
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
-from django.core.management.base import BaseCommand
-from prestamos.models import Item, Category
-from django.core.files import File
-from urllib.parse import urlparse
 from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from prestamos.ingestion import google_books_records, ingest_items
+from prestamos.models import Item
+
+API_URL = 'https://www.googleapis.com/books/v1/volumes'
 
 
 class Command(BaseCommand):
-    help = 'Descarga libros desde la API de Google Books y los guarda en el modelo Item'
+    help = ('Descarga libros desde la API de Google Books y los guarda en el modelo Item. '
+            'Las portadas se descargan en paralelo y el avance se guarda en un manifiesto para poder reanudar')
 
     def add_arguments(self, parser):
         parser.add_argument('category', type=str, help='La categoría de los libros')
         parser.add_argument('--limit', type=int, default=10, help='Número de libros a descargar')
+        parser.add_argument('--page-size', type=int, default=40, help='Libros por petición a la API (máximo 40)')
+        parser.add_argument('--workers', type=int, default=8, help='Descargas de portadas simultáneas')
+        parser.add_argument('--retries', type=int, default=3, help='Reintentos por petición fallida')
+        parser.add_argument('--backoff', type=float, default=0.5, help='Factor de espera exponencial entre reintentos')
+        parser.add_argument('--timeout', type=float, default=10, help='Segundos de espera por petición')
+        parser.add_argument('--manifest', type=str,
+                            help='Archivo JSON con el avance '
+                                 '(por defecto PRESTAMOS_DOWNLOAD_MANIFEST_DIR/<categoría>.json)')
+        parser.add_argument('--api-url', type=str, default=API_URL, help='URL de la API de volúmenes')
 
     def handle(self, *args, **kwargs):
         category_name = kwargs['category']
-        limit = kwargs['limit']
-
-        # URL base de la API de Google Books
-        api_url = f"https://www.googleapis.com/books/v1/volumes?q=subject:{category_name}&maxResults={limit}"
+        self.timeout = kwargs['timeout']
+        self.session = self.build_session(kwargs['workers'], kwargs['retries'], kwargs['backoff'])
 
-        # Realizamos la petición a la API
-        response = requests.get(api_url)
+        # Fuera de MEDIA_ROOT: Apache sirve /media/ y el manifiesto no es un archivo público
+        manifest_dir = getattr(settings, 'PRESTAMOS_DOWNLOAD_MANIFEST_DIR', os.path.join(settings.BASE_DIR, 'var'))
+        manifest_path = kwargs['manifest'] or os.path.join(manifest_dir, f'{category_name.replace(os.sep, "_")}.json')
+        manifest = self.load_manifest(manifest_path)
 
-        if response.status_code != 200:
-            self.stdout.write(self.style.ERROR(f'Error en la solicitud a la API. Status Code: {response.status_code}'))
+        books = self.fetch_books(kwargs['api_url'], category_name, kwargs['limit'], min(kwargs['page_size'], 40))
+        if books is None:
             return
 
-        books = response.json().get('items', [])
-
         if not books:
             self.stdout.write(self.style.WARNING(f'No se encontraron libros para la categoría "{category_name}".'))
             return
 
-        # Intentamos obtener o crear la categoría en el modelo Category
-        category_obj, created = Category.objects.get_or_create(name=category_name)
-        if created:
-            self.stdout.write(self.style.SUCCESS(f'Se creó la categoría "{category_name}".'))
-
+        # Volúmenes que faltan por procesar, sin repetir los de ejecuciones anteriores
+        volumes = []
         for book in books:
-            title = book.get('volumeInfo', {}).get('title', 'Título Desconocido')
-            description = book.get('volumeInfo', {}).get('description', 'Sin descripción disponible.')
-            categories = book.get('volumeInfo', {}).get('categories', [])
-            image_links = book.get('volumeInfo', {}).get('imageLinks', {})
+            volume_id = book.get('id') or book.get('volumeInfo', {}).get('title')
+            if manifest.get(volume_id, {}).get('status') != 'done':
+                volumes.append((volume_id, book))
+
+        # Artículos, categorías y relaciones en lotes
+        result = ingest_items(google_books_records([book for _, book in volumes], category_name))
+        previous = Item.objects.in_bulk(
+            entry['item'] for entry in manifest.values() if entry.get('status') != 'done' and entry.get('item'))
+        created = Item.objects.in_bulk(result.created.values())
+
+        pending = []  # (volume_id, artículo, url de la portada)
+
+        for volume_id, book in volumes:
+            volume_info = book.get('volumeInfo', {})
+            title = volume_info.get('title', 'Título Desconocido')
+            image_links = volume_info.get('imageLinks', {})
 
             # Obtener una única URL de portada (thumbnail o smallThumbnail)
-            cover_url = image_links.get('thumbnail') or image_links.get(
-                'smallThumbnail')  # Asegurarse de que sea una cadena
-
-            # Creación del objeto Item en la base de datos
-            item_obj, created = Item.objects.get_or_create(
-                name=title,
-                defaults={'description': description}
-            )
-
-            if created:
-                # Asignamos las categorías
-                item_obj.category.add(category_obj)
-                for cat_name in categories:
-                    cat_obj, _ = Category.objects.get_or_create(name=cat_name)
-                    item_obj.category.add(cat_obj)
-
-                # Guardamos la imagen si existe una URL válida
-                if cover_url and isinstance(cover_url, str):  # Verificar que cover_url sea una cadena válida
-                    image_path = self.download_image(cover_url, title)
-                    if image_path:
-                        item_obj.image.save(os.path.basename(image_path), File(open(image_path, 'rb')))
-                        self.stdout.write(self.style.SUCCESS(f'Portada guardada para el libro: {title}'))
-
-                item_obj.save()
-                self.stdout.write(self.style.SUCCESS(f'Se creó el libro: {title}'))
-            else:
+            cover_url = image_links.get('thumbnail') or image_links.get('smallThumbnail')
+
+            # Artículo creado ahora o en una ejecución anterior que no terminó
+            item_obj = previous.get(manifest.get(volume_id, {}).get('item')) or created.get(result.created.get(title.strip()[:255]))
+            if item_obj is None:
                 self.stdout.write(self.style.WARNING(f'El libro "{title}" ya existe en la base de datos.'))
+                continue
+
+            manifest[volume_id] = {'item': item_obj.pk, 'title': item_obj.name, 'status': 'pending'}
+            if cover_url and isinstance(cover_url, str):
+                pending.append((volume_id, item_obj, cover_url))
+            else:
+                manifest[volume_id]['status'] = 'done'
+
+        self.stdout.write(self.style.SUCCESS(f'Catálogo: {result}.'))
+        self.save_manifest(manifest_path, manifest)
+        failed = self.download_covers(pending, manifest, manifest_path, kwargs['workers'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Se procesaron {len(books)} libros: {len(pending) - failed} portadas descargadas, {failed} fallidas.'))
+
+    def build_session(self, workers, retries, backoff):
+        """
+        :return: Sesión con un pool de conexiones por host del tamaño del número
+                 de hilos y reintentos con espera exponencial
+        """
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=('GET',))
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(workers, 1), max_retries=retry)
+
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def fetch_books(self, api_url, category_name, limit, page_size):
+        """
+        Recorre las páginas de resultados de la API hasta juntar `limit` libros.
 
-    def download_image(self, url, title):
+        :return: Lista de volúmenes, o None si la API respondió con error
         """
-        Descarga una imagen desde la URL y la guarda en el sistema de archivos.
+        books = []
+
+        while len(books) < limit:
+            params = {
+                'q': f'subject:{category_name}',
+                'startIndex': len(books),
+                'maxResults': min(page_size, limit - len(books)),
+            }
+            try:
+                response = self.session.get(api_url, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                self.stdout.write(self.style.ERROR(f'Error en la solicitud a la API: {e}'))
+                return None
+
+            if response.status_code != 200:
+                self.stdout.write(self.style.ERROR(
+                    f'Error en la solicitud a la API. Status Code: {response.status_code}'))
+                return None
+
+            page = response.json().get('items', [])
+            books += page
+            if len(page) < params['maxResults']:
+                break  # no hay más resultados
+
+        return books[:limit]
+
+    def download_covers(self, pending, manifest, manifest_path, workers):
+        """
+        Descarga las portadas en un pool de hilos y las guarda desde memoria.
+        Las escrituras a la base de datos se hacen en el hilo principal.
+
+        :return: Número de portadas que no se pudieron descargar
+        """
+        failed = 0
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            futures = {executor.submit(self.download_image, url): (volume_id, item_obj)
+                       for volume_id, item_obj, url in pending}
+
+            for completed, future in enumerate(as_completed(futures), start=1):
+                volume_id, item_obj = futures[future]
+                content = future.result()
+
+                if content is None:
+                    failed += 1
+                    manifest[volume_id]['status'] = 'failed'
+                    self.stdout.write(self.style.WARNING(
+                        f'No se pudo descargar la imagen para el libro: {item_obj.name}'))
+                else:
+                    item_obj.image.save(f'book_covers/{volume_id}.jpg', ContentFile(content))
+                    manifest[volume_id]['status'] = 'done'
+                    self.stdout.write(self.style.SUCCESS(f'Portada guardada para el libro: {item_obj.name}'))
+
+                if completed % 50 == 0:
+                    self.save_manifest(manifest_path, manifest)
+
+        self.save_manifest(manifest_path, manifest)
+        return failed
+
+    def download_image(self, url):
+        """
+        Descarga una imagen a memoria. Se ejecuta en los hilos del pool.
+
         :param url: URL de la imagen
-        :param title: Título del libro (se usa para nombrar el archivo)
-        :return: Ruta del archivo de la imagen descargada o None si falla
+        :return: Contenido de la imagen o None si falla
         """
         try:
-            # Obtener el nombre del archivo desde la URL
-            filename = f"{title.replace(' ', '_')}.jpg"
-            path = os.path.join(settings.MEDIA_ROOT, 'book_covers', filename)
-
-            # Crear el directorio si no existe
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-
-            # Descargar la imagen
-            response = requests.get(url, stream=True)
-            if response.status_code == 200:
-                with open(path, 'wb') as img_file:
-                    for chunk in response.iter_content(1024):
-                        img_file.write(chunk)
-                return path
-            else:
-                self.stdout.write(self.style.WARNING(f"No se pudo descargar la imagen para el libro: {title}"))
-                return None
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f'Error al descargar la imagen: {str(e)}'))
+            response = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException:
             return None
+
+        return response.content if response.status_code == 200 else None
+
+    def load_manifest(self, path):
+        try:
+            with open(path) as manifest_file:
+                return json.load(manifest_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save_manifest(self, path, manifest):
+        """Escribe el manifiesto de forma atómica para no dejarlo corrupto si se interrumpe"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(f'{path}.tmp', 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        os.replace(f'{path}.tmp', path)
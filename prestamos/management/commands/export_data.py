@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from prestamos.exports import CHUNK_SIZE, EXPORTS, FORMATS
+
+
+class Command(BaseCommand):
+    help = 'Exporta artículos, unidades u órdenes (con unidades y reportes) en CSV o JSONL usando memoria constante'
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', choices=sorted(EXPORTS), help='Datos a exportar')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv', help='Formato de salida')
+        parser.add_argument('--output', type=str, help='Archivo de salida (por defecto stdout)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Registros leídos por bloque')
+
+    def handle(self, *args, **kwargs):
+        lines, _ = FORMATS[kwargs['format']]
+        export = EXPORTS[kwargs['export']]()
+
+        if kwargs['output']:
+            # En CSV la primera línea son los encabezados
+            count = -1 if kwargs['format'] == 'csv' else 0
+            with open(kwargs['output'], 'w', newline='', encoding='utf-8') as output:
+                for line in lines(export, chunk_size=kwargs['chunk_size']):
+                    output.write(line)
+                    count += 1
+
+            self.stderr.write(self.style.SUCCESS(f'Se exportaron {count} registros a {kwargs["output"]}'))
+        else:
+            for line in lines(export, chunk_size=kwargs['chunk_size']):
+                self.stdout.write(line, ending='')
@@ -0,0 +1,66 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from prestamos.catalog_cache import bump_catalog_version
+from prestamos.models import Item
+from prestamos.thumbnails import generate_thumbnails
+
+
+def _init_worker():
+    # Con el método spawn los procesos hijos empiezan sin Django configurado
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = 'Genera las miniaturas faltantes de las imágenes de los artículos en un pool de procesos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Procesos simultáneos')
+        parser.add_argument('--batch-size', type=int, default=500, help='Artículos por cada UPDATE')
+        parser.add_argument('--force', action='store_true', help='Volver a calcular aunque ya tengan miniaturas')
+
+    def handle(self, *args, **kwargs):
+        default_image = Item._meta.get_field('image').default
+
+        # Artículos por imagen: una imagen compartida se procesa una sola vez
+        pending = {}
+        for pk, image, thumbnails in (Item.objects
+                                      .exclude(image__in=['', default_image])
+                                      .values_list('pk', 'image', 'thumbnails')
+                                      .iterator(chunk_size=2000)):
+            if kwargs['force'] or (thumbnails or {}).get('source') != image:
+                pending.setdefault(image, []).append(pk)
+
+        if not pending:
+            self.stdout.write(self.style.SUCCESS('Todas las imágenes tienen miniaturas.'))
+            return
+
+        # Los procesos hijos no usan la base de datos; no deben heredar conexiones abiertas
+        connections.close_all()
+
+        images = list(pending)
+        updated = failed = 0
+        batch = []
+
+        with ProcessPoolExecutor(max_workers=kwargs['workers'], initializer=_init_worker) as executor:
+            generate = partial(generate_thumbnails, force=kwargs['force'])
+            for image, variants in zip(images, executor.map(generate, images, chunksize=8)):
+                if variants is None:
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f'No se pudo leer la imagen {image}'))
+
+                batch += [Item(pk=pk, thumbnails=variants or {'source': image}) for pk in pending[image]]
+                if len(batch) >= kwargs['batch_size']:
+                    updated += Item.objects.bulk_update(batch, ['thumbnails'])
+                    batch = []
+
+        updated += Item.objects.bulk_update(batch, ['thumbnails'])
+        bump_catalog_version()  # bulk_update no emite señales
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Se procesaron {len(images)} imágenes ({failed} con error) de {updated} artículos.'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from prestamos.imports import IMPORTERS, guess_format, import_file
+
+
+class Command(BaseCommand):
+    help = ('Importa artículos (name, description, categories) o unidades (item o item_id, serial_number, available) '
+            'desde CSV o XLSX, en lotes transaccionales')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS), help='Tipo de registros a importar')
+        parser.add_argument('path', type=str, help='Archivo a importar')
+        parser.add_argument('--format', choices=('csv', 'xlsx'), help='Formato, por defecto según la extensión')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Filas por lote y por transacción')
+
+    def handle(self, *args, **kwargs):
+        path = kwargs['path']
+
+        try:
+            with open(path, 'rb') as file:
+                result = import_file(kwargs['kind'], file, kwargs['format'] or guess_format(path),
+                                     kwargs['batch_size'])
+        except OSError as e:
+            raise CommandError(f'No se pudo leer el archivo: {e}')
+
+        for row, message in result.errors:
+            self.stderr.write(f'Fila {row}: {message}')
+
+        style = self.style.WARNING if result.errors else self.style.SUCCESS
+        self.stdout.write(style(f'Importación terminada: {result}.'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from prestamos.ingestion import ingest_items, read_csv, read_jsonl
+
+
+class Command(BaseCommand):
+    help = ('Carga artículos y categorías desde un archivo CSV (name, description, categories) '
+            'o JSONL en lotes con bulk_create')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str, help='Archivo a cargar')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='Formato, por defecto según la extensión')
+        parser.add_argument('--batch-size', type=int, default=500, help='Registros por lote y por transacción')
+        parser.add_argument('--separator', type=str, default=';', help='Separador de categorías en la columna CSV')
+
+    def handle(self, *args, **kwargs):
+        path = kwargs['path']
+        file_format = kwargs['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+
+        try:
+            with open(path, newline='', encoding='utf-8') as file:
+                records = read_jsonl(file) if file_format == 'jsonl' else read_csv(file, kwargs['separator'])
+                result = ingest_items(records, kwargs['batch_size'])
+        except OSError as e:
+            raise CommandError(f'No se pudo leer el archivo: {e}')
+
+        self.stdout.write(self.style.SUCCESS(f'Carga terminada: {result}.'))
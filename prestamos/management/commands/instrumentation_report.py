@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from almacen.instrumentation import report
+
+
+class Command(BaseCommand):
+    help = 'Muestra las rutas más lentas y las que ejecutan consultas N+1 según la instrumentación'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10, help='Número de rutas a mostrar')
+        parser.add_argument('--json', action='store_true', help='Imprimir el reporte completo en JSON')
+
+    def handle(self, *args, **kwargs):
+        data = report(kwargs['limit'])
+
+        if kwargs['json']:
+            self.stdout.write(json.dumps(data, indent=2))
+            return
+
+        if not data['slowest']:
+            self.stdout.write(self.style.WARNING('Todavía no hay estadísticas publicadas.'))
+            return
+
+        self.stdout.write(self.style.SUCCESS('Rutas más lentas (p95)'))
+        for route in data['slowest']:
+            self.stdout.write(
+                f"  {route['route']:<45} n={route['count']:<6} p50={route['p50_ms']}ms p95={route['p95_ms']}ms "
+                f"sql={route['mean_queries']} ({route['mean_sql_ms']}ms) plantillas={route['mean_template_ms']}ms")
+
+        self.stdout.write(self.style.SUCCESS('Rutas con consultas N+1'))
+        for route in data['nplusone']:
+            example = route['nplusone_example']
+            self.stdout.write(f"  {route['route']:<45} peticiones={route['nplusone_requests']} "
+                              f"repeticiones={example['count']}: {example['sql'][:120]}")
@@ -0,0 +1,33 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from prestamos.models import Order, Reservation, ACTIVE_ORDER_STATUSES
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye la tabla de reservaciones activas a partir de las órdenes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='Filas por cada INSERT')
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs['batch_size']
+
+        rows = (Order.units.through.objects
+                .filter(order__status__in=ACTIVE_ORDER_STATUSES)
+                .values_list('order_id', 'unit_id', 'order__order_date', 'order__return_date'))
+
+        with transaction.atomic():
+            deleted, _ = Reservation.objects.all().delete()
+            reservations = (Reservation(order_id=order_id, unit_id=unit_id, start_date=start_date, end_date=end_date)
+                            for order_id, unit_id, start_date, end_date in rows.iterator(chunk_size=batch_size))
+
+            # bulk_create convierte su argumento en lista: se le pasan lotes para no cargar todo en memoria
+            created = 0
+            while batch := list(islice(reservations, batch_size)):
+                created += len(Reservation.objects.bulk_create(batch))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Se eliminaron {deleted} y se crearon {created} reservaciones activas.'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from prestamos.models import Item
+from prestamos.search import index_items
+
+
+class Command(BaseCommand):
+    help = 'Recalcula el índice de búsqueda de texto completo de todos los artículos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Artículos por lote')
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs['batch_size']
+        item_ids = list(Item.objects.order_by('pk').values_list('pk', flat=True))
+
+        with transaction.atomic():
+            for offset in range(0, len(item_ids), batch_size):
+                index_items(item_ids[offset:offset + batch_size])
+
+        self.stdout.write(self.style.SUCCESS(f'Se indexaron {len(item_ids)} artículos.'))
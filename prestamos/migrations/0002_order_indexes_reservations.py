@@ -0,0 +1,85 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:17
+
+from itertools import islice
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+ACTIVE_ORDER_STATUSES = ['pending', 'approved', 'delivered']
+
+
+def create_order_units_index(apps, schema_editor):
+    schema_editor.execute('CREATE INDEX order_units_unit_order_idx ON prestamos_order_units (unit_id, order_id)')
+
+
+def drop_order_units_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute('DROP INDEX order_units_unit_order_idx ON prestamos_order_units')
+    else:
+        schema_editor.execute('DROP INDEX order_units_unit_order_idx')
+
+
+def populate_reservations(apps, schema_editor):
+    """Copia los intervalos de las órdenes activas a la tabla de reservaciones"""
+    OrderUnit = apps.get_model('prestamos', 'Order').units.through
+    Reservation = apps.get_model('prestamos', 'Reservation')
+
+    rows = (OrderUnit.objects
+            .filter(order__status__in=ACTIVE_ORDER_STATUSES)
+            .values_list('order_id', 'unit_id', 'order__order_date', 'order__return_date'))
+
+    reservations = (Reservation(order_id=order_id, unit_id=unit_id, start_date=start_date, end_date=end_date)
+                    for order_id, unit_id, start_date, end_date in rows.iterator(chunk_size=2000))
+
+    # bulk_create convierte su argumento en lista: se le pasan lotes para no cargar todo en memoria
+    while batch := list(islice(reservations, 2000)):
+        Reservation.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prestamos', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateTimeField()),
+                ('end_date', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Reservación',
+                'verbose_name_plural': 'Reservaciones',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'order_date', 'return_date'], name='order_status_dates_idx'),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='prestamos.order'),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='unit',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='prestamos.unit'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['unit', 'start_date', 'end_date'], name='reservation_unit_dates_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='reservation',
+            unique_together={('order', 'unit')},
+        ),
+        # La tabla intermedia de `Order.units` es automática, el índice se crea a mano
+        migrations.RunPython(create_order_units_index, drop_order_units_index),
+        migrations.RunPython(populate_reservations, migrations.RunPython.noop),
+    ]
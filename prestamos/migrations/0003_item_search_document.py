@@ -0,0 +1,40 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:31
+
+from django.db import migrations, models
+
+
+def install_search(apps, schema_editor):
+    """Crea el índice de texto completo y lo llena con el catálogo actual"""
+    from prestamos.search import get_backend
+
+    Item = apps.get_model('prestamos', 'Item')
+    backend = get_backend(schema_editor.connection)
+    backend.install(schema_editor)
+
+    documents = {
+        item.pk: (item.name, [category.name for category in item.category.all()], item.description)
+        for item in Item.objects.prefetch_related('category')
+    }
+    backend.index(documents, model=Item)
+
+
+def uninstall_search(apps, schema_editor):
+    from prestamos.search import get_backend
+
+    get_backend(schema_editor.connection).uninstall(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prestamos', '0002_order_indexes_reservations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(install_search, uninstall_search),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:30
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_available_units_count(apps, schema_editor):
+    Item = apps.get_model('prestamos', 'Item')
+    Unit = apps.get_model('prestamos', 'Unit')
+
+    available = (Unit.objects
+                 .filter(item=OuterRef('pk'), available=True)
+                 .values('item')
+                 .annotate(count=Count('pk'))
+                 .values('count'))
+    Item.objects.update(available_units_count=Coalesce(Subquery(available), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prestamos', '0003_item_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='available_units_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_available_units_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prestamos', '0004_item_available_units_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
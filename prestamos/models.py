@@ -1,8 +1,7 @@
-from random import shuffle
-
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -39,10 +38,42 @@ class Item(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
     category = models.ManyToManyField(Category, related_name='items', blank=True)
+    # Nombre, categorías y descripción normalizados, lo mantiene `prestamos.search`
+    search_document = models.TextField(blank=True, default='', editable=False)
+    # Unidades con `available=True`, lo mantienen las señales de `Unit`
+    available_units_count = models.PositiveIntegerField(default=0, editable=False)
+    # Miniaturas de `image` generadas por `prestamos.thumbnails`
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False)
+
+    # Campos que las señales mantienen con `.update()`: una instancia leída antes
+    # (por ejemplo la del formulario del admin) no debe regresarlos a su valor viejo
+    DERIVED_FIELDS = {'search_document', 'available_units_count', 'thumbnails'}
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.DERIVED_FIELDS]
+        super().save(*args, **kwargs)
 
     def avalable_units(self):
         return Unit.objects.filter(item=self, available=True)
 
+    @staticmethod
+    def update_available_units_count(item_ids):
+        """
+        Recalcula `available_units_count` de varios artículos en una sola consulta.
+
+        :param item_ids: Iterable de ids de artículos
+        """
+        available = (Unit.objects
+                     .filter(item=models.OuterRef('pk'), available=True)
+                     .values('item')
+                     .annotate(count=models.Count('pk'))
+                     .values('count'))
+
+        Item.objects.filter(pk__in=list(item_ids)).update(
+            available_units_count=Coalesce(models.Subquery(available), 0))
+
     def units_available(self, start_date, end_date):
         """
         Verifica la disponibilidad de unidades del artículo entre las fechas especificadas.
@@ -51,7 +82,9 @@ class Item(models.Model):
         :param end_date: Fecha y hora de finalización
         :return: Una lista de unidades disponibles
         """
-        return [unit for unit in self.units.all() if unit.is_available(start_date, end_date)]
+        from .availability import get_timelines
+
+        return get_timelines([self], start_date)[self.pk].free_units(start_date, end_date)
 
     def __str__(self):
         return self.name
@@ -73,9 +106,7 @@ class Unit(models.Model):
 
     def is_available(self, start_date, end_date):
         overlapping_orders = self.orders.filter(models.Q(order_date__lt=end_date, return_date__gt=start_date,
-                                                         status__in=[OrderStatusChoices.PENDING,
-                                                                     OrderStatusChoices.APPROVED,
-                                                                     OrderStatusChoices.DELIVERED]))
+                                                         status__in=ACTIVE_ORDER_STATUSES))
         return not overlapping_orders.exists() and self.available
 
     def __str__(self):
@@ -100,6 +131,14 @@ class OrderStatusChoices(models.TextChoices):
     RETURNED = 'returned', _('Devuelta')
 
 
+# Estados en los que una orden mantiene ocupadas sus unidades
+ACTIVE_ORDER_STATUSES = [
+    OrderStatusChoices.PENDING,
+    OrderStatusChoices.APPROVED,
+    OrderStatusChoices.DELIVERED,
+]
+
+
 class Order(models.Model):
     """
 
@@ -109,6 +148,14 @@ class Order(models.Model):
         verbose_name = "Orden"
         verbose_name_plural = "Ordenes"
         ordering = ["-created_at"]
+        indexes = [
+            # Soporta el predicado de traslape de `availability.reservations`
+            models.Index(fields=['status', 'order_date', 'return_date'], name='order_status_dates_idx'),
+            # Filtros por fecha y orden por defecto del admin
+            models.Index(fields=['order_date'], name='order_order_date_idx'),
+            models.Index(fields=['return_date'], name='order_return_date_idx'),
+            models.Index(fields=['created_at'], name='order_created_at_idx'),
+        ]
 
     user = models.ForeignKey(to=User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -159,18 +206,33 @@ class Order(models.Model):
 
     def add_item(self, item, quantity):
         """
+        Agrega a la orden la cantidad indicada de unidades libres de un artículo.
 
-        :param item:
-        :param quantity:
-        :return:
+        :param item: Artículo solicitado
+        :param quantity: Número de unidades
+        :return: Lista de unidades agregadas
         """
-        units = item.units_available(self.order_date, self.return_date)
+        return self.add_items([(item, quantity)])
 
-        if quantity > len(units):  # Veríficar que hay suficientes unidades
-            raise ValidationError("No hay suficientes unidades de '" + str(item.name) + "' diponibles")
+    def add_items(self, lines):
+        """
+        Agrega a la orden unidades libres de varios artículos a la vez.
 
-        shuffle(units)  # revolver los elementos de la lista
-        self.units.add(*(units[:quantity]))  # agregar la cantidad de unidades especificadas
+        :param lines: Iterable de pares (artículo, cantidad)
+        :return: Lista de unidades agregadas
+        :raises ValidationError: Si algún artículo no tiene suficientes unidades
+        :raises AllocationConflict: Si otra solicitud bloqueó las unidades restantes
+        """
+        from .availability import allocate
+
+        # Las unidades quedan bloqueadas hasta que se confirme la transacción
+        with transaction.atomic():
+            allocation = allocate(lines, self.order_date, self.return_date)
+            units = [unit for item_units in allocation.values() for unit in item_units]
+
+            self.units.add(*units)  # agregar todas las unidades en un solo INSERT
+
+        return units
 
     def get_report(self):
         """
@@ -183,6 +245,30 @@ class Order(models.Model):
         return f'Orden {self.id} - {self.user.username}'
 
 
+class Reservation(models.Model):
+    """
+    Intervalo vivo de una unidad dentro de una orden pendiente, aprobada o
+    entregada. Es una copia de `Order.units` que solo conserva las órdenes
+    activas, para que las consultas de traslape no recorran el historial.
+    """
+
+    class Meta:
+        verbose_name = "Reservación"
+        verbose_name_plural = "Reservaciones"
+        unique_together = ('order', 'unit')
+        indexes = [
+            models.Index(fields=['unit', 'start_date', 'end_date'], name='reservation_unit_dates_idx'),
+        ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    unit = models.ForeignKey(Unit, on_delete=models.CASCADE, related_name='reservations')
+    start_date = models.DateTimeField()
+    end_date = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.unit_id}: {self.start_date} - {self.end_date}'
+
+
 class Report(models.Model):
     class Meta:
         verbose_name_plural = "Reportes"
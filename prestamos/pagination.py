@@ -0,0 +1,293 @@
+import base64
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, FieldError, ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+"""
+Paginación por llave (keyset)
+
+En lugar de `OFFSET`, cada página se pide a partir de los valores de orden
+del último (o primer) registro de la página anterior, por ejemplo
+`(order_date, id)` o `(name, id)`. El costo de una página no depende de qué
+tan profundo esté y no se necesita un `COUNT(*)` por petición; el total, si
+se muestra, es aproximado y se guarda en caché.
+"""
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values, backwards=False):
+    """
+    :param values: Valores de los campos de orden del registro de referencia
+    :param backwards: True si el cursor pide la página anterior
+    :return: Token opaco para usar en la URL
+    """
+    payload = json.dumps({'v': values, 'b': backwards}, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    :param token: Token generado por `encode_cursor`
+    :return: Par (valores, backwards)
+    :raises InvalidCursor: Si el token no es válido
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        return list(payload['v']), bool(payload['b'])
+    except (ValueError, TypeError, KeyError) as e:
+        raise InvalidCursor(token) from e
+
+
+class KeysetPage:
+    """Página de resultados, compatible con el uso de `Page` en las plantillas"""
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Pagina un QuerySet ordenado por campos cuyo último elemento es la llave
+    primaria, para que el orden sea total.
+    """
+
+    def __init__(self, queryset, per_page, ordering=None, count_timeout=None):
+        """
+        :param queryset: QuerySet a paginar
+        :param per_page: Registros por página
+        :param ordering: Campos de orden, por defecto los del QuerySet; se agrega 'pk' si falta
+        :param count_timeout: Segundos que se guarda en caché el total aproximado, None para no calcularlo
+        """
+        ordering = list(ordering or queryset.query.order_by or ['pk'])
+        if ordering[-1].lstrip('-') not in ('pk', 'id'):
+            ordering.append('-pk' if ordering[-1].startswith('-') else 'pk')
+
+        self.queryset = queryset.order_by(*ordering)
+        self.per_page = int(per_page)
+        self.ordering = ordering
+        self.count_timeout = count_timeout
+
+    @property
+    def fields(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    def cursor_values(self, obj):
+        return [getattr(obj, field) for field in self.fields]
+
+    def _to_python(self, values):
+        """
+        Convierte los valores del cursor (JSON) a los tipos de los campos del
+        modelo o de las anotaciones, como `search_rank`.
+
+        :raises ValidationError: Si algún valor no corresponde a su campo
+        """
+        opts = self.queryset.model._meta
+        converted = []
+        for field, value in zip(self.fields, values):
+            try:
+                model_field = opts.pk if field == 'pk' else opts.get_field(field)
+            except FieldDoesNotExist:
+                try:
+                    model_field = self.queryset.query.annotations[field].output_field
+                except (KeyError, FieldError) as e:
+                    raise ValidationError(f'No se puede convertir el valor de {field}') from e
+            converted.append(model_field.to_python(value))
+        return converted
+
+    def _after(self, values, backwards):
+        """
+        Condición "viene después de `values`" en el orden de la página:
+        (a > x) OR (a = x AND b > y) OR ...
+        """
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            descending = field.startswith('-') != backwards
+            name = field.lstrip('-')
+            step = Q(**{f'{name}__{"lt" if descending else "gt"}': values[index]})
+            for previous, value in zip(self.fields[:index], values[:index]):
+                step &= Q(**{previous: value})
+            condition |= step
+        return condition
+
+    def page(self, token=None):
+        """
+        :param token: Cursor de la URL; None o un cursor inválido dan la primera página
+        :return: KeysetPage
+        """
+        queryset = self.queryset
+        backwards = False
+
+        if token:
+            try:
+                values, backwards = decode_cursor(token)
+                if len(values) != len(self.ordering):
+                    raise InvalidCursor(token)
+                queryset = queryset.filter(self._after(self._to_python(values), backwards))
+            except (ValueError, TypeError, ValidationError):  # InvalidCursor o valores de otro tipo
+                queryset, backwards = self.queryset, False
+                token = None
+
+        if backwards:
+            queryset = queryset.reverse()
+
+        # Un registro extra indica si hay más allá de esta página
+        rows = list(queryset[:self.per_page + 1])
+        if token and not rows:
+            return self.page()  # cursor más allá del final: sin enlaces para salir, se vuelve al inicio
+
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if backwards:
+            rows.reverse()
+
+        # Hacia atrás siempre queda la página de la que se vino como siguiente
+        has_next = backwards or more
+        has_previous = more if backwards else token is not None
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_next:
+                next_cursor = encode_cursor(self.cursor_values(rows[-1]))
+            if has_previous:
+                previous_cursor = encode_cursor(self.cursor_values(rows[0]), backwards=True)
+
+        return KeysetPage(rows, self, next_cursor, previous_cursor)
+
+    @cached_property
+    def approximate_count(self):
+        """Total de registros, tomado de la caché si se calculó hace menos de `count_timeout` segundos"""
+        if self.count_timeout is None:
+            return None
+
+        return cached_count(self.queryset, self.count_timeout)
+
+
+def cached_count(queryset, timeout):
+    """
+    :param queryset: QuerySet a contar
+    :param timeout: Segundos que se guarda el total en caché
+    :return: `queryset.count()`, calculado como máximo una vez cada `timeout` segundos
+    """
+    key = 'keyset_count:' + hashlib.md5(str(queryset.query).encode()).hexdigest()
+    return cache.get_or_set(key, queryset.count, timeout)
+
+
+def estimated_count(model, using='default'):
+    """
+    Filas de la tabla según las estadísticas del motor, sin recorrerla.
+
+    :param model: Modelo de la tabla
+    :param using: Alias de la base de datos
+    :return: Número estimado de filas, o None si el motor no lo ofrece (SQLite)
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute('SELECT TABLE_ROWS FROM information_schema.TABLES '
+                           'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s', [table])
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+
+    return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+def paginate(request, queryset, per_page, ordering=None):
+    """
+    Pagina un QuerySet con el cursor del parámetro `cursor` de la petición.
+
+    :param request: Petición actual
+    :param queryset: QuerySet a paginar
+    :param per_page: Registros por página
+    :param ordering: Campos de orden, por defecto los del QuerySet
+    :return: Contexto de plantilla con `paginator`, `page_obj`, `is_paginated` y `pagination_query`
+    """
+    paginator = KeysetPaginator(queryset, per_page, ordering,
+                                count_timeout=getattr(settings, 'PRESTAMOS_PAGINATION_COUNT_TIMEOUT', None))
+    page = paginator.page(request.GET.get('cursor'))
+
+    # Parámetros de la URL sin el cursor, para construir los enlaces
+    query = request.GET.copy()
+    query.pop('cursor', None)
+    query.pop('page', None)
+
+    return {
+        'paginator': paginator,
+        'page_obj': page,
+        'is_paginated': page.has_other_pages(),
+        'pagination_query': query.urlencode(),
+    }
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    Paginador del admin para tablas grandes. Si la tabla tiene más filas que
+    `PRESTAMOS_ADMIN_APPROXIMATE_COUNT_THRESHOLD`, el total sin filtros se toma
+    de las estadísticas del motor y el total filtrado se guarda en caché, en
+    lugar de correr un `COUNT(*)` en cada página. En tablas chicas, o sin
+    estadísticas, el total es exacto.
+    """
+
+    @cached_property
+    def count(self):
+        threshold = getattr(settings, 'PRESTAMOS_ADMIN_APPROXIMATE_COUNT_THRESHOLD', None)
+        queryset = self.object_list
+
+        if threshold is None:
+            return super().count
+
+        estimate = estimated_count(queryset.model, queryset.db)
+        if estimate is None or estimate < threshold:
+            return super().count
+
+        if not queryset.query.where:
+            return estimate
+        return cached_count(queryset, getattr(settings, 'PRESTAMOS_PAGINATION_COUNT_TIMEOUT', None) or 60)
+
+
+class KeysetPaginationMixin:
+    """Reemplaza la paginación por número de página de `ListView` por paginación por llave"""
+
+    pagination_ordering = None
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size, self.pagination_ordering)
+        page = paginator.page(self.request.GET.get('cursor'))
+        return paginator, page, page.object_list, page.has_other_pages()
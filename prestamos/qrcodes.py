@@ -0,0 +1,46 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from qr_code.qrcode.maker import make_qr_code_image
+from qr_code.qrcode.utils import QRCodeOptions
+
+"""
+Códigos QR de las órdenes
+
+El QR de un texto (la URL absoluta de la orden) se genera una sola vez y se
+guarda en media con un nombre derivado del texto, así que el archivo nunca
+cambia y Apache lo entrega con caché de larga duración. Saber si ya existe
+se guarda en la caché por `PRESTAMOS_QR_CACHE_TIMEOUT` segundos para no tocar
+el almacenamiento en cada vista; al vencer se vuelve a revisar, así que un
+archivo borrado de media se regenera.
+"""
+
+QR_OPTIONS = {'size': 14, 'border': 3, 'image_format': 'svg'}
+
+
+def qr_code_name(text):
+    """
+    :param text: Texto codificado en el QR
+    :return: Nombre del archivo del QR en el almacenamiento
+    """
+    return f'qr/{hashlib.sha1(text.encode()).hexdigest()[:20]}.svg'
+
+
+def qr_code_url(text, storage=default_storage):
+    """
+    :param text: Texto codificado en el QR
+    :param storage: Almacenamiento de archivos
+    :return: URL del QR, generándolo si todavía no existe
+    """
+    name = qr_code_name(text)
+    key = f'prestamos:qr:{name}'
+
+    if not cache.get(key):
+        if not storage.exists(name):
+            storage.save(name, ContentFile(make_qr_code_image(text, QRCodeOptions(**QR_OPTIONS))))
+        cache.set(key, True, getattr(settings, 'PRESTAMOS_QR_CACHE_TIMEOUT', 3600))
+
+    return storage.url(name)
@@ -0,0 +1,156 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from extra_settings.models import Setting
+
+"""
+Copia local de la configuración de extra_settings
+
+Cada proceso guarda todos los valores de `Setting` en memoria. Después de
+PRESTAMOS_SETTINGS_TTL segundos se consulta la versión publicada en el
+setting SETTINGS_VERSION y solo si cambió se vuelven a leer los valores. Al
+guardar un setting, o con `manage.py reload_settings`, se incrementa la
+versión y todos los procesos de mod_wsgi la detectan en su siguiente revisión.
+
+`VersionStamp` generaliza ese contador para otras cachés locales que deben
+invalidarse en todos los procesos (catálogo, disponibilidad).
+"""
+
+VERSION_SETTING = 'SETTINGS_VERSION'
+
+
+class VersionStamp:
+    """
+    Contador entero guardado en un setting y compartido por todos los procesos.
+    Cada proceso recuerda el último valor leído y lo vuelve a consultar a lo más
+    cada PRESTAMOS_SETTINGS_TTL segundos.
+    """
+
+    # Nombres de todos los contadores; guardarlos no publica una nueva configuración
+    names = set()
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._cached = None  # (versión, momento de la última revisión)
+        VersionStamp.names.add(name)
+
+    def current(self):
+        """
+        :return: Versión guardada en la base de datos, 0 si aún no existe
+        """
+        return Setting.objects.filter(name=self.name).values_list('value_int', flat=True).first() or 0
+
+    def get(self):
+        """
+        :return: Versión vista por este proceso, a lo más una consulta cada
+                 PRESTAMOS_SETTINGS_TTL segundos
+        """
+        with self._lock:
+            ttl = getattr(settings, 'PRESTAMOS_SETTINGS_TTL', 5)
+            if self._cached is None or time.monotonic() - self._cached[1] >= ttl:
+                self._cached = (self.current(), time.monotonic())
+            return self._cached[0]
+
+    def invalidate(self):
+        """Descarta la versión recordada por este proceso"""
+        with self._lock:
+            self._cached = None
+
+    def bump(self):
+        """Incrementa la versión en la base de datos con un solo UPDATE atómico"""
+        updated = Setting.objects.filter(name=self.name).update(value_int=Coalesce(F('value_int'), Value(0)) + 1)
+        if not updated:
+            Setting.objects.get_or_create(name=self.name, defaults={'value_type': Setting.TYPE_INT, 'value': 1})
+        self.invalidate()
+
+    def bump_on_commit(self):
+        """
+        Incrementa la versión al confirmar la transacción actual, una sola vez
+        aunque varias señales de la misma transacción lo pidan.
+        """
+        connection = transaction.get_connection()
+        # Los callbacks de un savepoint revertido se descartan, así que la lista siempre está al día
+        if not any(func == self.bump for _, func, _ in connection.run_on_commit):
+            transaction.on_commit(self.bump)
+
+
+SETTINGS_VERSION = VersionStamp(VERSION_SETTING)
+
+
+class SettingsSnapshot:
+    """Valores de todos los settings leídos en una sola consulta"""
+
+    def __init__(self, values, version):
+        self.values = values
+        self.version = version
+        self.checked_at = time.monotonic()
+
+    @classmethod
+    def load(cls):
+        values = {setting.name: setting.value for setting in Setting.objects.all()}
+        return cls(values, values.get(VERSION_SETTING) or 0)
+
+    def get(self, name, default=None):
+        """
+        Igual que `Setting.get`, pero sin consultar la base de datos ni la caché.
+
+        :param name: Nombre del setting
+        :param default: Valor si el setting no existe
+        :return: Valor del setting
+        """
+        value = self.values.get(name)
+        if value is None and getattr(settings, 'EXTRA_SETTINGS_FALLBACK_TO_CONF_SETTINGS', True):
+            value = getattr(settings, name, None)
+        return default if value is None else value
+
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+def get_settings():
+    """
+    :return: SettingsSnapshot vigente del proceso, a lo más una consulta cada
+             PRESTAMOS_SETTINGS_TTL segundos
+    """
+    global _snapshot
+
+    with _lock:
+        snapshot = _snapshot
+        ttl = getattr(settings, 'PRESTAMOS_SETTINGS_TTL', 5)
+
+        if snapshot is None:
+            snapshot = SettingsSnapshot.load()
+        elif time.monotonic() - snapshot.checked_at >= ttl:
+            if SETTINGS_VERSION.current() == snapshot.version:
+                snapshot.checked_at = time.monotonic()
+            else:
+                snapshot = SettingsSnapshot.load()
+
+        _snapshot = snapshot
+        return snapshot
+
+
+def invalidate_settings():
+    """Descarta la copia local de este proceso"""
+    global _snapshot
+
+    with _lock:
+        _snapshot = None
+
+
+def publish_settings_version():
+    """
+    Incrementa SETTINGS_VERSION para que todos los procesos vuelvan a leer la
+    configuración, y descarta la copia local.
+
+    :return: Nueva versión
+    """
+    SETTINGS_VERSION.bump()
+    invalidate_settings()
+    return SETTINGS_VERSION.current()
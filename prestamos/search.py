@@ -0,0 +1,194 @@
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+from .models import Item
+
+"""
+Búsqueda de texto completo en el catálogo
+
+Cada artículo tiene un documento de búsqueda normalizado (minúsculas y sin
+acentos) con su nombre, categorías y descripción. El backend depende de la
+base de datos: índice FULLTEXT en MySQL, tabla virtual FTS5 en SQLite y
+LIKE sobre el documento en cualquier otra.
+"""
+
+FTS_TABLE = 'prestamos_item_fts'
+FULLTEXT_INDEX = 'item_search_document_ft'
+
+
+def normalize(text):
+    """
+    Convierte a minúsculas y elimina acentos y diacríticos.
+
+    :param text: Texto original
+    :return: Texto normalizado
+    """
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+
+def tokenize(query):
+    """
+    :param query: Término de búsqueda escrito por el usuario
+    :return: Lista de palabras normalizadas
+    """
+    return re.findall(r'\w+', normalize(query))
+
+
+def build_document(name, category_names, description):
+    return '\n'.join([normalize(name), normalize(' '.join(category_names)), normalize(description)])
+
+
+class SearchBackend:
+    """Interfaz común de los backends de búsqueda"""
+
+    def __init__(self, db_connection=connection):
+        self.connection = db_connection
+
+    def install(self, schema_editor):
+        """Crea las estructuras de la base de datos que necesita el backend"""
+
+    def uninstall(self, schema_editor):
+        """Elimina las estructuras creadas por `install`"""
+
+    def index(self, documents, model=Item):
+        """
+        Guarda los documentos de búsqueda de varios artículos.
+
+        :param documents: Diccionario {item_id: (nombre, categorías, descripción)}
+        :param model: Modelo de artículo (el histórico dentro de las migraciones)
+        """
+        model.objects.bulk_update([
+            model(pk=item_id, search_document=build_document(name, category_names, description))
+            for item_id, (name, category_names, description) in documents.items()
+        ], ['search_document'], batch_size=500)
+
+    def remove(self, item_ids):
+        """Elimina del índice los artículos borrados"""
+
+    def search(self, queryset, query):
+        """
+        Filtra y ordena por relevancia un QuerySet de artículos.
+
+        :param queryset: QuerySet de `Item`
+        :param query: Término de búsqueda
+        :return: QuerySet filtrado, con la anotación `search_rank` si el backend la soporta
+        """
+        for token in tokenize(query):
+            queryset = queryset.filter(search_document__contains=token)
+        return queryset
+
+
+class MySQLSearchBackend(SearchBackend):
+    """Índice FULLTEXT sobre `Item.search_document` en modo booleano"""
+
+    def install(self, schema_editor):
+        schema_editor.execute(f'CREATE FULLTEXT INDEX {FULLTEXT_INDEX} ON prestamos_item (search_document)')
+
+    def uninstall(self, schema_editor):
+        schema_editor.execute(f'DROP INDEX {FULLTEXT_INDEX} ON prestamos_item')
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset
+
+        # Todas las palabras son obligatorias y se buscan como prefijo
+        expression = ' '.join(f'+{token}*' for token in tokens)
+        rank = RawSQL('MATCH (prestamos_item.search_document) AGAINST (%s IN BOOLEAN MODE)', [expression],
+                      output_field=FloatField())
+
+        return queryset.annotate(search_rank=rank).filter(search_rank__gt=0).order_by('-search_rank', 'pk')
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """Tabla virtual FTS5 con el id del artículo como rowid, ordenada con bm25"""
+
+    # Pesos de bm25 para (nombre, categorías, descripción)
+    weights = (10.0, 4.0, 1.0)
+
+    def install(self, schema_editor):
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            f"name, categories, description, tokenize='unicode61 remove_diacritics 2')")
+
+    def uninstall(self, schema_editor):
+        schema_editor.execute(f'DROP TABLE {FTS_TABLE}')
+
+    def index(self, documents, model=Item):
+        super().index(documents, model)
+
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in documents])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, categories, description) VALUES (%s, %s, %s, %s)',
+                [(pk, normalize(name), normalize(' '.join(category_names)), normalize(description))
+                 for pk, (name, category_names, description) in documents.items()])
+
+    def remove(self, item_ids):
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in item_ids])
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset
+
+        expression = ' '.join(f'"{token}"*' for token in tokens)
+        weights = ', '.join(str(weight) for weight in self.weights)
+
+        # Una sola búsqueda FTS unida por rowid; bm25 se evalúa sobre esa misma búsqueda
+        # y sigue siendo una anotación para que la paginación por llave pueda filtrar por ella
+        queryset = queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = prestamos_item.id', f'{FTS_TABLE} MATCH %s'],
+            params=[expression])
+
+        # bm25 es más relevante entre más negativo
+        rank = RawSQL(f'bm25({FTS_TABLE}, {weights})', [], output_field=FloatField())
+        return queryset.annotate(search_rank=rank).order_by('search_rank', 'pk')
+
+
+def get_backend(db_connection=connection):
+    """
+    :param db_connection: Conexión a la base de datos
+    :return: Backend de búsqueda adecuado para la conexión
+    """
+    if db_connection.vendor == 'mysql':
+        return MySQLSearchBackend(db_connection)
+    if db_connection.vendor == 'sqlite':
+        return SQLiteSearchBackend(db_connection)
+    return SearchBackend(db_connection)
+
+
+def search_items(queryset, query):
+    """
+    Busca artículos por nombre, descripción y nombre de categoría, sin
+    distinguir acentos ni mayúsculas.
+
+    :param queryset: QuerySet de `Item` sobre el que se busca
+    :param query: Término de búsqueda
+    :return: QuerySet ordenado por relevancia
+    """
+    return get_backend().search(queryset, query)
+
+
+def index_items(item_ids):
+    """
+    Recalcula el documento de búsqueda de los artículos indicados.
+
+    :param item_ids: Iterable de ids de artículos
+    """
+    item_ids = list(set(item_ids))
+    if not item_ids:
+        return
+
+    documents = {
+        item.pk: (item.name, [category.name for category in item.category.all()], item.description)
+        for item in Item.objects.filter(pk__in=item_ids).prefetch_related('category')
+    }
+    get_backend().index(documents)
@@ -0,0 +1,251 @@
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from extra_settings.models import Setting
+
+from .availability import invalidate_timelines
+from .catalog_cache import bump_catalog_version
+from .models import Category, Item, Order, Unit, Reservation, ACTIVE_ORDER_STATUSES
+from .runtime_settings import VersionStamp, publish_settings_version
+from .search import get_backend, index_items
+from .thumbnails import generate_thumbnails
+
+"""
+Sincronización de la tabla de reservaciones activas
+"""
+
+
+def reservations_enabled():
+    """La tabla de reservaciones es opcional, se activa con PRESTAMOS_ACTIVE_RESERVATIONS"""
+    return getattr(settings, 'PRESTAMOS_ACTIVE_RESERVATIONS', False)
+
+
+def sync_reservations(order):
+    """
+    Reconstruye las reservaciones de una orden: si está activa copia el
+    intervalo de cada una de sus unidades, en otro caso las elimina.
+
+    :param order: Orden a sincronizar
+    """
+    Reservation.objects.filter(order=order).delete()
+
+    if order.status not in ACTIVE_ORDER_STATUSES:
+        return
+
+    Reservation.objects.bulk_create([
+        Reservation(order=order, unit_id=unit_id, start_date=order.order_date, end_date=order.return_date)
+        for unit_id in order.units.values_list('pk', flat=True)
+    ])
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, **kwargs):
+    if not reservations_enabled():
+        return
+
+    # Cambios de estado (aprobar, rechazar, cancelar, entregar, devolver) y de fechas
+    sync_reservations(instance)
+
+
+@receiver(m2m_changed, sender=Order.units.through)
+def order_units_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reservations_enabled() or action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        sync_reservations(instance)
+        return
+
+    # `unit.orders.add(...)`: la instancia es la unidad y pk_set son órdenes
+    orders = Order.objects.filter(pk__in=pk_set) if pk_set else Order.objects.filter(
+        reservations__unit=instance)
+    for order in orders:
+        sync_reservations(order)
+
+
+@receiver(post_save, sender=Order.units.through)
+@receiver(post_delete, sender=Order.units.through)
+def order_unit_row_changed(sender, instance, **kwargs):
+    # Filas editadas directamente, como en el inline del admin
+    if not reservations_enabled():
+        return
+
+    order = Order.objects.filter(pk=instance.order_id).first()
+    if order is not None:
+        sync_reservations(order)
+
+
+"""
+Invalidación de las líneas de tiempo de capacidad en caché
+"""
+
+
+@receiver(post_save, sender=Order)
+def order_saved_invalidate(sender, instance, created, **kwargs):
+    # aprove, reject, cancel, deliver y return_order terminan en save()
+    if created:
+        return  # una orden nueva todavía no tiene unidades
+
+    invalidate_timelines(instance.units.values_list('item_id', flat=True))
+
+
+@receiver(m2m_changed, sender=Order.units.through)
+def order_units_changed_invalidate(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # `unit.orders.add(...)`: solo cambia la línea de tiempo del artículo de la unidad
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_timelines([instance.item_id])
+    elif action in ('post_add', 'post_remove'):
+        invalidate_timelines(Unit.objects.filter(pk__in=pk_set).values_list('item_id', flat=True))
+    elif action == 'pre_clear':
+        invalidate_timelines(instance.units.values_list('item_id', flat=True))
+
+
+@receiver(post_save, sender=Order.units.through)
+@receiver(post_delete, sender=Order.units.through)
+def order_unit_row_changed_invalidate(sender, instance, **kwargs):
+    invalidate_timelines(Unit.objects.filter(pk=instance.unit_id).values_list('item_id', flat=True))
+
+
+@receiver(post_save, sender=Unit)
+@receiver(post_delete, sender=Unit)
+def unit_changed_invalidate(sender, instance, **kwargs):
+    # Altas, bajas, cambios de `Unit.available` y de artículo
+    invalidate_timelines({instance.item_id, getattr(instance, '_previous_item_id', None)} - {None})
+
+
+"""
+Sincronización del índice de búsqueda del catálogo
+"""
+
+
+@receiver(post_save, sender=Item)
+def item_saved_index(sender, instance, **kwargs):
+    # `index_items` usa bulk_update, que no vuelve a emitir post_save
+    index_items([instance.pk])
+
+
+@receiver(post_delete, sender=Item)
+def item_deleted_index(sender, instance, **kwargs):
+    get_backend().remove([instance.pk])
+
+
+@receiver(m2m_changed, sender=Item.category.through)
+def item_categories_changed_index(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            index_items([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        # `category.items.add(...)`: pk_set son artículos
+        index_items(pk_set)
+    elif action == 'pre_clear':
+        instance._search_item_ids = list(instance.items.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        index_items(getattr(instance, '_search_item_ids', []))
+
+
+@receiver(post_save, sender=Item.category.through)
+@receiver(post_delete, sender=Item.category.through)
+def item_category_row_changed_index(sender, instance, **kwargs):
+    # Filas editadas directamente, como en CategoryItemInline del admin
+    index_items([instance.item_id])
+
+
+@receiver(post_save, sender=Category)
+def category_saved_index(sender, instance, created, **kwargs):
+    if not created:
+        index_items(instance.items.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Category)
+def category_deleting_index(sender, instance, **kwargs):
+    instance._search_item_ids = list(instance.items.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted_index(sender, instance, **kwargs):
+    index_items(getattr(instance, '_search_item_ids', []))
+
+
+"""
+Versión de la configuración en caché de cada proceso
+"""
+
+
+@receiver(post_save, sender=Setting)
+@receiver(post_delete, sender=Setting)
+def setting_changed(sender, instance, **kwargs):
+    if instance.name not in VersionStamp.names:
+        publish_settings_version()
+
+
+"""
+Conteo de unidades disponibles de cada artículo
+"""
+
+
+@receiver(pre_save, sender=Unit)
+def unit_saving_count(sender, instance, **kwargs):
+    # Si la unidad cambia de artículo también hay que recalcular el anterior
+    if not instance._state.adding:
+        previous = Unit.objects.filter(pk=instance.pk).values_list('item_id', 'available').first()
+        if previous:
+            instance._previous_item_id, instance._previous_available = previous
+
+
+@receiver(post_save, sender=Unit)
+@receiver(post_delete, sender=Unit)
+def unit_changed_count(sender, instance, **kwargs):
+    Item.update_available_units_count({instance.item_id, getattr(instance, '_previous_item_id', None)} - {None})
+
+
+"""
+Miniaturas de las imágenes de los artículos
+"""
+
+
+@receiver(post_save, sender=Item)
+def item_saved_thumbnails(sender, instance, **kwargs):
+    image = instance.image.name
+    # La imagen por defecto es un marcador pequeño compartido, no necesita miniaturas
+    if not image or image == Item._meta.get_field('image').default:
+        return
+
+    if (instance.thumbnails or {}).get('source') != image:
+        instance.thumbnails = generate_thumbnails(image) or {'source': image}
+        Item.objects.filter(pk=instance.pk).update(thumbnails=instance.thumbnails)
+
+
+"""
+Versión del catálogo para la caché de fragmentos
+"""
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Item.category.through)
+@receiver(post_delete, sender=Item.category.through)
+def catalog_changed(sender, instance, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Unit)
+@receiver(post_delete, sender=Unit)
+def unit_changed_catalog(sender, instance, signal, created=False, **kwargs):
+    # De las unidades los fragmentos solo muestran el número de disponibles de cada artículo
+    if signal is post_delete or created:
+        changed = instance.available
+    else:
+        previous = (getattr(instance, '_previous_item_id', None), getattr(instance, '_previous_available', None))
+        changed = previous != (instance.item_id, instance.available)
+
+    if changed:
+        bump_catalog_version()
+
+
+@receiver(m2m_changed, sender=Item.category.through)
+def item_categories_changed_catalog(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_catalog_version()
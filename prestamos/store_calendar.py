@@ -0,0 +1,228 @@
+import datetime
+import threading
+from bisect import bisect_right
+
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .runtime_settings import get_settings
+
+"""
+Calendario de la tienda
+
+Compila una sola vez por versión de la configuración los días de apertura
+(máscara de bits por día de la semana), el horario y los días de cierre
+(intervalos de fechas ordenados y fusionados). Las preguntas "¿se puede
+reservar esta ventana?" y "¿cuándo vuelve a abrir?" se responden con
+aritmética y búsqueda binaria, sin volver a leer ni interpretar los settings.
+"""
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+WEEKDAYS_ES = ['lunes', 'martes', 'miércoles', 'jueves', 'viernes', 'sábado', 'domingo']
+
+
+def parse_open_days(value):
+    """
+    :param value: Nombres de días en inglés separados por comas, p. ej. "Monday,Friday"
+    :return: Máscara de bits con el bit `weekday()` encendido para cada día abierto
+    """
+    mask = 0
+    for day in (value or '').split(','):
+        day = day.strip().lower()
+        if day in WEEKDAYS:
+            mask |= 1 << WEEKDAYS.index(day)
+    return mask
+
+
+def parse_closures(value):
+    """
+    :param value: Fechas ISO o rangos "AAAA-MM-DD..AAAA-MM-DD" separados por comas o saltos de línea
+    :return: Lista ordenada de intervalos (inicio, fin) inclusivos y sin traslapes
+    """
+    intervals = []
+    for entry in (value or '').replace('\n', ',').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        first, _, last = entry.partition('..')
+        try:
+            start = datetime.date.fromisoformat(first.strip())
+            end = datetime.date.fromisoformat(last.strip()) if last else start
+        except ValueError:
+            continue  # entradas mal escritas no bloquean las reservaciones
+        intervals.append((min(start, end), max(start, end)))
+
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + datetime.timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class StoreCalendar:
+    """Días y horario en los que se pueden entregar y devolver préstamos"""
+
+    def __init__(self, open_days_mask, opening_time, closing_time, closures=()):
+        """
+        :param open_days_mask: Máscara de bits de `parse_open_days`
+        :param opening_time: Hora de apertura
+        :param closing_time: Hora de cierre
+        :param closures: Intervalos de `parse_closures`
+        """
+        self.open_days_mask = open_days_mask
+        self.opening_time = opening_time
+        self.closing_time = closing_time
+        self.closures = list(closures)
+        self._closure_starts = [start for start, _ in self.closures]
+
+        # Días hasta el siguiente día de la semana abierto, partiendo de cada uno
+        self._next_open_offset = [
+            next((offset for offset in range(7) if open_days_mask >> (weekday + offset) % 7 & 1), None)
+            for weekday in range(7)
+        ]
+
+    @classmethod
+    def from_settings(cls, store_settings):
+        """
+        :param store_settings: SettingsSnapshot de `get_settings`
+        :return: StoreCalendar
+        """
+        return cls(
+            parse_open_days(store_settings.get('STORE_OPEN_DAYS', '')),
+            store_settings.get('STORE_OPENING_TIME', default=datetime.time(9, 0)),
+            store_settings.get('STORE_CLOSING_TIME', default=datetime.time(18, 0)),
+            parse_closures(store_settings.get('STORE_CLOSED_DATES', '')),
+        )
+
+    def closure(self, date):
+        """
+        :return: Intervalo de cierre que contiene la fecha, o None
+        """
+        index = bisect_right(self._closure_starts, date) - 1
+        if index >= 0 and self.closures[index][1] >= date:
+            return self.closures[index]
+        return None
+
+    def is_open_day(self, date):
+        return bool(self.open_days_mask >> date.weekday() & 1) and self.closure(date) is None
+
+    def is_open_at(self, moment):
+        """
+        :param moment: datetime con zona horaria
+        :return: True si la tienda atiende en ese momento
+        """
+        local = timezone.localtime(moment)
+        return self.is_open_day(local.date()) and self.opening_time <= local.time() <= self.closing_time
+
+    def is_bookable(self, start, end):
+        """La entrega y la devolución deben caer en un día y horario de atención"""
+        return start < end and self.is_open_at(start) and self.is_open_at(end)
+
+    def next_open_day(self, date):
+        """
+        :param date: Fecha a partir de la cual buscar (incluida)
+        :return: Primera fecha abierta, o None si la tienda nunca abre
+        """
+        while True:
+            offset = self._next_open_offset[date.weekday()]
+            if offset is None:
+                return None
+            date += datetime.timedelta(days=offset)
+
+            closure = self.closure(date)
+            if closure is None:
+                return date
+            date = closure[1] + datetime.timedelta(days=1)
+
+    def next_opening(self, moment):
+        """
+        :param moment: datetime con zona horaria
+        :return: El mismo momento si la tienda está abierta, si no la siguiente apertura
+        """
+        local = timezone.localtime(moment)
+        if self.is_open_day(local.date()) and local.time() <= self.closing_time:
+            if local.time() >= self.opening_time:
+                return moment
+            return timezone.make_aware(datetime.datetime.combine(local.date(), self.opening_time))
+
+        day = self.next_open_day(local.date() + datetime.timedelta(days=1))
+        if day is None:
+            return None
+        return timezone.make_aware(datetime.datetime.combine(day, self.opening_time))
+
+    def bookable_starts(self, first, duration, step, until, limit=None):
+        """
+        Inicios de ventana reservables en la malla `first + k * step`, saltando
+        de una vez las noches y los días cerrados.
+
+        :param first: Primer inicio candidato
+        :param duration: Duración de cada ventana
+        :param step: Separación entre inicios, positiva
+        :param until: Los inicios deben ser anteriores a este momento
+        :param limit: Número máximo de inicios
+        :return: Lista de datetimes
+        :raises ValueError: Si `step` no es positivo (la malla no avanzaría)
+        """
+        if step <= datetime.timedelta(0):
+            raise ValueError(f'La separación entre inicios debe ser positiva: {step}')
+
+        starts = []
+        current = first
+
+        while current < until and (limit is None or len(starts) < limit):
+            opening = self.next_opening(current)
+            if opening is None:
+                break
+
+            if opening > current:
+                # Siguiente punto de la malla a partir de la apertura
+                current += -(-(opening - current) // step) * step
+                continue
+
+            if self.is_open_at(current + duration):
+                starts.append(current)
+            current += step
+
+        return starts
+
+    def validate(self, start, end):
+        """
+        :raises ValidationError: Con el mismo mensaje que se muestra en el formulario de orden
+        """
+        for moment in (start, end):
+            local = timezone.localtime(moment)
+            if not self.open_days_mask >> local.weekday() & 1:
+                raise ValidationError(f'La tienda no está abierta el día {WEEKDAYS_ES[local.weekday()].capitalize()}.')
+            if self.closure(local.date()):
+                raise ValidationError(f'La tienda está cerrada el {local.date():%d/%m/%Y}.')
+
+        opening_12hr = self.opening_time.strftime("%I:%M %p")
+        closing_12hr = self.closing_time.strftime("%I:%M %p")
+        start_time, end_time = timezone.localtime(start).time(), timezone.localtime(end).time()
+
+        if start_time < self.opening_time or end_time < self.opening_time:
+            raise ValidationError(f'Lo más temprano que puede ordenar es {opening_12hr}')
+        if start_time > self.closing_time or end_time > self.closing_time:
+            raise ValidationError(f'Lo más tarde que puede ordenar es {closing_12hr}')
+
+
+_lock = threading.Lock()
+_compiled = (None, None)
+
+
+def get_calendar():
+    """
+    :return: StoreCalendar de la configuración vigente, compilado una vez por snapshot
+    """
+    global _compiled
+
+    store_settings = get_settings()
+    with _lock:
+        snapshot, calendar = _compiled
+        if snapshot is not store_settings:
+            calendar = StoreCalendar.from_settings(store_settings)
+            _compiled = (store_settings, calendar)
+        return calendar
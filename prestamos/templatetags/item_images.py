@@ -0,0 +1,23 @@
+from django import template
+
+from prestamos.thumbnails import srcset, thumbnail_url
+
+register = template.Library()
+
+
+@register.filter
+def webp_srcset(item):
+    """`srcset` con las miniaturas WebP del artículo"""
+    return srcset(item.thumbnails, 'webp')
+
+
+@register.filter
+def jpeg_srcset(item):
+    """`srcset` con las miniaturas JPEG del artículo"""
+    return srcset(item.thumbnails, 'jpeg')
+
+
+@register.filter
+def thumbnail(item, width=160):
+    """URL de la miniatura JPEG más cercana a `width`, o la imagen original si no hay miniaturas"""
+    return thumbnail_url(item.thumbnails, int(width)) or item.image.url
@@ -0,0 +1,11 @@
+from django import template
+
+from prestamos.qrcodes import qr_code_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def qr_image_url(text):
+    """URL del QR de `text`, generado una sola vez y guardado en media"""
+    return qr_code_url(str(text))
@@ -1,3 +1,1124 @@
-from django.test import TestCase
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, OperationalError, connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from extra_settings.models import Setting
+from PIL import Image
+from qr_code.qrcode.maker import make_qr_code_image
+
+from almacen.instrumentation import Registry, RequestMetrics, report
+
+from .availability import (TIMELINES_VERSION, AllocationConflict, available_slots, free_counts, free_units,
+                           free_units_by_item, retry_allocation)
+from .catalog_cache import CATALOG_VERSION
+from .exports import OrderExport
+from .facets import category_facets
+from .forms import OrderItemFormSet
+from .imports import import_file
+from .ingestion import CatalogIngestor, ingest_items
+from .models import Category, Item, Unit, Order, OrderStatusChoices, Report, Reservation
+from .pagination import ApproximateCountPaginator, KeysetPaginator, encode_cursor
+from .qrcodes import qr_code_name
+from .runtime_settings import get_settings, invalidate_settings
+from .search import index_items, search_items
+from .store_calendar import StoreCalendar, get_calendar, parse_closures, parse_open_days
+from .views import OrderCreateView
+
+
+class AvailabilityTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        TIMELINES_VERSION.invalidate()
+        self.user = User.objects.create_user(username='alumno', password='secreto')
+        self.item = Item.objects.create(name='Multímetro')
+        self.other = Item.objects.create(name='Osciloscopio')
+        self.units = [Unit.objects.create(item=self.item, serial_number=f'M-{n}') for n in range(3)]
+        self.other_unit = Unit.objects.create(item=self.other, serial_number='O-1')
+
+        self.start = timezone.now() + timedelta(days=1)
+        self.end = self.start + timedelta(hours=2)
+
+    def reserve(self, units, start, end, status=OrderStatusChoices.PENDING):
+        order = Order.objects.create(user=self.user, order_date=start, return_date=end, status=status)
+        order.units.add(*units)
+        return order
+
+    def test_matches_per_unit_check(self):
+        self.reserve(self.units[:1], self.start, self.end)
+        self.reserve(self.units[1:2], self.start, self.end, status=OrderStatusChoices.CANCELLED)
+        self.units[2].available = False
+        self.units[2].save()
+
+        expected = [unit for unit in self.item.units.all() if unit.is_available(self.start, self.end)]
+        self.assertEqual(self.item.units_available(self.start, self.end), expected)
+        self.assertEqual(expected, [self.units[1]])
+
+    def test_adjacent_orders_do_not_overlap(self):
+        self.reserve(self.units, self.start - timedelta(hours=1), self.start)
+        self.reserve(self.units, self.end, self.end + timedelta(hours=1))
+
+        self.assertEqual(len(self.item.units_available(self.start, self.end)), 3)
+
+    def test_many_items_in_one_query(self):
+        self.reserve([self.other_unit], self.start, self.end)
+
+        with self.assertNumQueries(1):
+            units_by_item = free_units_by_item([self.item, self.other], self.start, self.end)
+
+        self.assertEqual(len(units_by_item[self.item.pk]), 3)
+        self.assertNotIn(self.other.pk, units_by_item)
+        self.assertEqual(free_units([self.other], self.end, self.end + timedelta(hours=1)).count(), 1)
+
+    def test_add_items_in_constant_queries(self):
+        order = Order.objects.create(user=self.user, order_date=self.start, return_date=self.end)
+
+        with self.assertNumQueries(7):
+            units = order.add_items([(self.item, 1), (self.other, 1), (self.item, 1)])
+
+        self.assertEqual(len(units), 3)
+        self.assertEqual(order.units.filter(item=self.item).count(), 2)
+
+    def test_add_items_reports_shortage(self):
+        order = Order.objects.create(user=self.user, order_date=self.start, return_date=self.end)
+
+        with self.assertRaises(ValidationError):
+            order.add_items([(self.item, 4), (self.other, 1)])
+
+        self.assertEqual(order.units.count(), 0)
+
+    @override_settings(PRESTAMOS_ACTIVE_RESERVATIONS=True)
+    def test_active_reservations_table(self):
+        order = self.reserve(self.units[:2], self.start, self.end)
+        self.assertEqual(Reservation.objects.filter(order=order).count(), 2)
+        self.assertEqual(self.item.units_available(self.start, self.end), [self.units[2]])
+
+        order.cancel()
+        self.assertFalse(Reservation.objects.filter(order=order).exists())
+        self.assertEqual(len(self.item.units_available(self.start, self.end)), 3)
+
+    def test_available_slots_matches_per_slot_check(self):
+        duration = timedelta(hours=1)
+        self.reserve(self.units[:2], self.start, self.start + timedelta(hours=3))
+        self.reserve(self.units[:1], self.start + timedelta(hours=2), self.start + timedelta(hours=5))
+        self.reserve([self.other_unit], self.start + timedelta(hours=4), self.start + timedelta(hours=6))
+
+        slots = [self.start + timedelta(minutes=30 * n) for n in range(16)]
+        lines = [(self.item, 2), (self.other, 1)]
+
+        with self.assertNumQueries(2):
+            fits = available_slots(lines, slots, duration)
+
+        expected = [
+            sum(unit.is_available(slot, slot + duration) for unit in self.item.units.all()) >= 2 and
+            self.other_unit.is_available(slot, slot + duration)
+            for slot in slots
+        ]
+        self.assertEqual(list(fits), expected)
+
+    def test_timeline_cache(self):
+        self.item.units_available(self.start, self.end)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.item.units_available(self.start, self.end)), 3)
+            available_slots([(self.item, 3)], [self.start, self.end], timedelta(hours=1))
+
+        order = self.reserve(self.units[:1], self.start, self.end)
+        self.assertEqual(len(self.item.units_available(self.start, self.end)), 2)
+
+        order.cancel()
+        self.assertEqual(len(self.item.units_available(self.start, self.end)), 3)
+
+        self.units[0].available = False
+        self.units[0].save()
+        self.assertEqual(len(self.item.units_available(self.start, self.end)), 2)
+
+        # Una unidad que cambia de artículo también sale de la línea de tiempo del anterior
+        self.assertEqual(len(self.other.units_available(self.start, self.end)), 1)
+        self.units[1].item = self.other
+        self.units[1].save()
+        self.assertEqual(len(self.item.units_available(self.start, self.end)), 1)
+        self.assertEqual(len(self.other.units_available(self.start, self.end)), 2)
+
+    @override_settings(PRESTAMOS_SETTINGS_TTL=0)
+    def test_timeline_cache_follows_shared_version(self):
+        self.assertEqual(len(self.item.units_available(self.start, self.end)), 3)
+
+        # Otro proceso reserva una unidad (sin señales en este) y publica una nueva versión
+        order = Order.objects.create(user=self.user, order_date=self.start, return_date=self.end)
+        Order.units.through.objects.bulk_create([Order.units.through(order=order, unit=self.units[0])])
+        self.assertEqual(len(self.item.units_available(self.start, self.end)), 3)
+
+        Setting.objects.filter(name='TIMELINES_VERSION').update(value_int=F('value_int') + 1)
+        self.assertEqual(len(self.item.units_available(self.start, self.end)), 2)
+
+    def test_timelines_version_is_bumped_once_per_transaction(self):
+        order = self.reserve(self.units[:2], self.start, self.end)
+        order.units.remove(self.units[0])
+        order.cancel()
+
+        # Todas las señales de la transacción comparten un solo UPDATE al confirmar
+        bumps = [func for _, func, _ in connection.run_on_commit if func == TIMELINES_VERSION.bump]
+        self.assertEqual(len(bumps), 1)
+
+    @override_settings(PRESTAMOS_SETTINGS_TTL=0)
+    def test_free_counts_follow_shared_version(self):
+        self.assertEqual(free_counts([self.item.pk], self.start, self.end), {self.item.pk: 3})
+
+        # Una orden confirmada en otro proceso invalida los conteos en caché de este
+        order = Order.objects.create(user=self.user, order_date=self.start, return_date=self.end)
+        Order.units.through.objects.bulk_create([Order.units.through(order=order, unit=self.units[0])])
+        self.assertEqual(free_counts([self.item.pk], self.start, self.end), {self.item.pk: 3})
+
+        Setting.objects.filter(name='TIMELINES_VERSION').update(value_int=F('value_int') + 1)
+        self.assertEqual(free_counts([self.item.pk], self.start, self.end), {self.item.pk: 2})
+
+    @override_settings(PRESTAMOS_ALLOCATION_RETRIES=2)
+    def test_retry_allocation_on_deadlock(self):
+        calls = []
+
+        def deadlock():
+            calls.append(1)
+            raise OperationalError(1213, 'Deadlock found when trying to get lock')
+
+        with self.assertRaises(AllocationConflict):
+            retry_allocation(deadlock)
+        self.assertEqual(len(calls), 2)
+
+        calls.clear()
+        self.assertEqual(retry_allocation(lambda: calls.append(1) or 'ok'), 'ok')
+        self.assertEqual(len(calls), 1)
+
+    def test_available_slots_without_candidates(self):
+        self.assertEqual(len(available_slots([(self.item, 1)], [], timedelta(hours=1))), 0)
+
+        # Sin ventanas alternativas la vista responde con el mensaje, no con un error
+        self.reserve(self.units, self.start, self.end)
+        order_form = mock.Mock(cleaned_data={'order_date': self.start, 'return_date': self.end})
+        item_form = mock.Mock(cleaned_data={'item': self.item, 'quantity': 1}, **{'is_valid.return_value': True})
+        view = OrderCreateView()
+        with mock.patch('prestamos.views.get_calendar') as calendar:
+            calendar.return_value.bookable_starts.return_value = []
+            self.assertEqual(view.suggest_alternatives(order_form, [item_form]), [])
+
+    def test_alternatives_with_non_positive_slot_minutes_use_the_duration(self):
+        self.assertEqual(Setting.objects.filter(name='ALTERNATIVES_SLOT_MINUTES').update(value_int=-30), 1)
+        invalidate_settings()
+        self.addCleanup(invalidate_settings)
+
+        order_form = mock.Mock(cleaned_data={'order_date': self.start, 'return_date': self.end})
+        with mock.patch('prestamos.views.get_calendar') as calendar:
+            calendar.return_value.bookable_starts.return_value = []
+            OrderCreateView().suggest_alternatives(order_form, [])
+        self.assertEqual(calendar.return_value.bookable_starts.call_args.args[2], timedelta(hours=2))
+
+    def test_rebuild_reservations_inserts_in_batches(self):
+        self.reserve(self.units, self.start, self.end)
+        Reservation.objects.all().delete()
+
+        output = StringIO()
+        with mock.patch.object(Reservation.objects, 'bulk_create', wraps=Reservation.objects.bulk_create) as bulk:
+            call_command('rebuild_reservations', batch_size=2, stdout=output)
+
+        self.assertEqual([len(call.args[0]) for call in bulk.call_args_list], [2, 1])
+        self.assertIn('se crearon 3 reservaciones', output.getvalue())
+        self.assertEqual(Reservation.objects.count(), 3)
+
+    def test_cart_endpoint_returns_free_counts_cached_by_items_and_window(self):
+        first = timezone.localtime(timezone.now() + timedelta(days=1)).replace(minute=0, second=0, microsecond=0)
+        start = get_calendar().bookable_starts(first, timedelta(hours=1), timedelta(hours=1),
+                                               first + timedelta(days=14), limit=1)[0]
+        self.reserve(self.units[:2], start, start + timedelta(hours=1))
+        self.client.force_login(self.user)
+
+        def check(items):
+            return self.client.get(reverse('cart_availability'), {
+                'items': items,
+                'order_date': timezone.localtime(start).strftime('%Y-%m-%dT%H:%M'),
+                'return_date': timezone.localtime(start + timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M'),
+            })
+
+        response = check(f'{self.item.pk}:2,{self.other.pk}:1,999999:1')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['bookable'])
+        self.assertEqual([(line['id'], line['free'], line['available']) for line in response.json()['items']],
+                         [(self.item.pk, 1, False), (self.other.pk, 1, True), (999999, 0, False)])
+
+        # Otras cantidades de los mismos artículos y ventana salen de la caché
+        with CaptureQueriesContext(connection) as queries:
+            response = check(f'{self.item.pk}:1,{self.other.pk}:1,999999:1')
+        self.assertFalse(any('prestamos_unit' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(response.json()['items'][0]['available'], True)
+
+        response = self.client.get(reverse('cart_availability'), {'items': f'{self.item.pk}:1',
+                                                                   'order_date': '2000-01-01T10:00',
+                                                                   'return_date': '2000-01-01T09:00'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('No se puede hacer un pedido en el pasado.', response.json()['errors'])
+
+
+class BenchmarkCommandTestCase(TestCase):
+
+    def test_outputs_json_report(self):
+        cache.clear()
+        output = StringIO()
+        call_command('benchmark', use_current_db=True, items=10, units=2, categories=3, orders=20,
+                     iterations=2, warmup=0, stdout=output)
+
+        report = json.loads(output.getvalue())
+        self.assertEqual(report['meta']['dataset']['items'], 10)
+        self.assertIn('order_create_post', report['scenarios'])
+        self.assertGreater(report['scenarios']['order_history_list']['queries']['max'], 0)
+
+        # Las variantes en frío regeneran los fragmentos; la búsqueda encuentra el catálogo sembrado
+        scenarios = report['scenarios']
+        self.assertGreater(scenarios['order_create_get_cold']['queries']['min'],
+                           scenarios['order_create_get']['queries']['min'])
+        self.assertTrue(search_items(Item.objects.all(), 'libro 1').exists())
+
+
+class InstrumentationTestCase(TestCase):
+
+    def test_server_timing_and_report(self):
+        user = User.objects.create_user(username='alumno', password='secreto')
+        self.client.force_login(user)
+        past = timezone.now() - timedelta(days=1)
+        Order.objects.bulk_create(Order(user=user, order_date=past, return_date=past) for _ in range(6))
+
+        response = self.client.get(reverse('order_history_list'))
+        self.assertRegex(response['Server-Timing'], r'sql;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=')
+
+        routes = {route['route']: route for route in report(limit=50)['slowest']}
+        self.assertGreaterEqual(routes['GET /orders/history/']['count'], 1)
+        self.assertGreaterEqual(routes['GET /orders/history/']['nplusone_requests'], 1)
+
+    def test_report_merges_registries_published_by_other_processes(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        metrics = RequestMetrics()
+        metrics.sql_count = 3
+
+        # Dos procesos sin memoria compartida: solo comparten el directorio
+        with override_settings(INSTRUMENTATION_DIR=directory.name):
+            for name, total in [('worker-1', 0.010), ('worker-2', 0.030)]:
+                worker = Registry(name)
+                worker.record('GET /medido/', total, metrics)
+                worker.flush()
+
+            self.assertEqual(sorted(os.listdir(directory.name)), ['worker-1.json', 'worker-2.json'])
+            routes = {route['route']: route for route in report(limit=50)['slowest']}
+
+        self.assertEqual(routes['GET /medido/']['count'], 2)
+        self.assertEqual(routes['GET /medido/']['mean_queries'], 3)
+        self.assertEqual(routes['GET /medido/']['p95_ms'], 30.0)
+
+    def test_report_requires_staff(self):
+        user = User.objects.create_user(username='alumno', password='secreto')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('instrumentation_report')).status_code, 302)
+
+        user.is_staff = True
+        user.save()
+        self.assertIn('nplusone', self.client.get(reverse('instrumentation_report')).json())
+
+        # Un límite inválido o negativo no produce un error 500
+        for limit in ('abc', '-5'):
+            response = self.client.get(reverse('instrumentation_report'), {'limit': limit})
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json()['slowest']), 10 if limit == 'abc' else 1)
+
+
+class SearchTestCase(TestCase):
+
+    def test_accent_insensitive_search_ranks_names_first(self):
+        fisica = Category.objects.create(name='Física')
+        by_category = Item.objects.create(name='Multímetro', description='Medición de voltaje')
+        by_category.category.add(fisica)
+        by_description = Item.objects.create(name='Cable', description='Para prácticas de fisica')
+        by_name = Item.objects.create(name='Física universitaria', description='Libro de texto')
+        Item.objects.create(name='Calculadora', description='Científica')
+
+        results = list(search_items(Item.objects.all(), 'FISICA'))
+        self.assertEqual(results[0], by_name)
+        self.assertCountEqual(results, [by_name, by_category, by_description])
+
+        # Renombrar la categoría actualiza el índice de sus artículos
+        fisica.name = 'Electrónica'
+        fisica.save()
+        self.assertEqual(list(search_items(Item.objects.all(), 'electronica')), [by_category])
+
+
+    def test_fts_query_runs_once_per_page(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Plan de la tabla FTS5 de SQLite')
+
+        items = Item.objects.bulk_create(Item(name=f'Libro {n}', description='Texto') for n in range(300))
+        index_items(item.pk for item in items)
+        paginator = KeysetPaginator(search_items(Item.objects.all(), 'libro 1'), per_page=20)
+
+        with CaptureQueriesContext(connection) as queries:
+            first = paginator.page()
+            second = paginator.page(first.next_cursor)
+        self.assertEqual(len(queries), 2)
+        self.assertTrue(all(str(item.name).startswith('Libro 1') for item in list(first) + list(second)))
+
+        # Una sola búsqueda en la tabla FTS, sin subconsultas correlacionadas por artículo
+        sql, params = paginator.queryset[:21].query.sql_with_params()
+        with connection.cursor() as cursor:
+            plan = ' '.join(str(row[-1]) for row in cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall())
+        self.assertEqual(plan.count('VIRTUAL TABLE'), 1)
+        self.assertNotIn('CORRELATED', plan)
+
+
+class KeysetPaginationTestCase(TestCase):
+
+    def test_walks_pages_forward_and_back(self):
+        items = Item.objects.bulk_create(Item(name=f'Artículo {n % 3}') for n in range(7))
+        expected = sorted(items, key=lambda item: (item.name, item.pk))
+        paginator = KeysetPaginator(Item.objects.order_by('name'), per_page=3)
+
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        third = paginator.page(second.next_cursor)
+        self.assertEqual(list(first) + list(second) + list(third), expected)
+        self.assertFalse(first.has_previous())
+        self.assertFalse(third.has_next())
+
+        self.assertEqual(list(paginator.page(third.previous_cursor)), list(second))
+        self.assertEqual(list(paginator.page(second.previous_cursor)), list(first))
+        self.assertEqual(list(paginator.page('no-es-un-cursor')), list(first))
+
+        # Valores alterados o un cursor más allá del final regresan a la primera página
+        last = items[-1]
+        for values in (['Artículo 0', 'abc'], [['x'], 1], ['ZZZ', last.pk]):
+            page = paginator.page(encode_cursor(values))
+            self.assertEqual(list(page), list(first))
+            self.assertTrue(page.has_next())
+
+    def test_search_rank_cursor_is_validated(self):
+        items = Item.objects.bulk_create(Item(name=f'Libro {n}') for n in range(5))
+        index_items(item.pk for item in items)
+        paginator = KeysetPaginator(search_items(Item.objects.all(), 'libro'), per_page=2)
+        first = paginator.page()
+
+        self.assertEqual(list(paginator.page(encode_cursor(['abc', items[0].pk]))), list(first))
+        self.assertEqual(len(paginator.page(first.next_cursor)), 2)
+
+
+class RuntimeSettingsTestCase(TestCase):
+
+    def setUp(self):
+        invalidate_settings()
+        self.addCleanup(invalidate_settings)
+
+    @override_settings(PRESTAMOS_SETTINGS_TTL=3600)
+    def test_snapshot_reads_once_and_follows_published_version(self):
+        get_settings()
+        with self.assertNumQueries(0):
+            get_settings().get('STORE_OPENING_TIME')
+            get_settings().get('STORE_OPEN_DAYS')
+
+        # Guardar un setting publica una nueva versión y descarta la copia local
+        version = get_settings().version
+        Setting.objects.filter(name='STORE_OPEN_DAYS').update(value_string='Monday')
+        call_command('reload_settings', stdout=StringIO())
+        self.assertEqual(get_settings().version, version + 1)
+        self.assertEqual(get_settings().get('STORE_OPEN_DAYS'), 'Monday')
+
+    @override_settings(PRESTAMOS_SETTINGS_TTL=0)
+    def test_other_processes_pick_up_the_version(self):
+        get_settings()
+        # Otro proceso incrementa la versión sin pasar por la copia de este
+        Setting.objects.filter(name='SETTINGS_VERSION').update(value_int=F('value_int') + 1)
+        Setting.objects.filter(name='WAREHOUSE_PHONE').update(value_string='+52 555')
+        self.assertEqual(get_settings().get('WAREHOUSE_PHONE'), '+52 555')
+
+
+class StoreCalendarTestCase(TestCase):
+
+    def setUp(self):
+        self.calendar = StoreCalendar(
+            parse_open_days('Monday,Tuesday,Wednesday,Thursday,Friday'), datetime.time(9, 0), datetime.time(18, 0),
+            parse_closures('2030-01-08..2030-01-09, 2030-01-10, fecha-invalida'))
+
+    def at(self, day, hour, minute=0):
+        return timezone.make_aware(datetime.datetime(2030, 1, day, hour, minute))
+
+    def test_validates_days_closures_and_hours(self):
+        # 2030-01-07 es lunes; 8, 9 y 10 se fusionan en un solo cierre
+        self.assertEqual(self.calendar.closures, [(datetime.date(2030, 1, 8), datetime.date(2030, 1, 10))])
+        self.assertTrue(self.calendar.is_bookable(self.at(7, 10), self.at(7, 12)))
+        self.assertFalse(self.calendar.is_bookable(self.at(9, 10), self.at(9, 12)))
+
+        with self.assertRaisesMessage(ValidationError, 'La tienda no está abierta el día Sábado.'):
+            self.calendar.validate(self.at(5, 10), self.at(5, 12))
+        with self.assertRaisesMessage(ValidationError, 'La tienda está cerrada el 08/01/2030.'):
+            self.calendar.validate(self.at(8, 10), self.at(8, 12))
+        with self.assertRaisesMessage(ValidationError, 'Lo más tarde que puede ordenar es 06:00 PM'):
+            self.calendar.validate(self.at(7, 17), self.at(7, 19))
+
+    def test_bookable_starts_skip_nights_and_closures(self):
+        starts = self.calendar.bookable_starts(
+            self.at(7, 16), timedelta(hours=2), timedelta(hours=2), self.at(14, 0))
+        self.assertEqual(starts[:3], [self.at(7, 16), self.at(11, 10), self.at(11, 12)])
+
+        with self.assertRaises(ValueError):
+            self.calendar.bookable_starts(self.at(7, 10), timedelta(hours=1), timedelta(0), self.at(8, 0))
+
+
+class CatalogTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_available_units_count_follows_units(self):
+        item = Item.objects.create(name='Osciloscopio')
+        unit = Unit.objects.create(item=item, serial_number='A')
+        Unit.objects.create(item=item, serial_number='B')
+        item.refresh_from_db()
+        self.assertEqual(item.available_units_count, 2)
+
+        unit.available = False
+        unit.save()
+        item.refresh_from_db()
+        self.assertEqual(item.available_units_count, 1)
+
+        Unit.objects.get(serial_number='B').delete()
+        item.refresh_from_db()
+        self.assertEqual(item.available_units_count, 0)
+
+    def test_saving_a_stale_item_keeps_signal_maintained_fields(self):
+        item = Item.objects.create(name='Osciloscopio')
+        Unit.objects.create(item=item, serial_number='A')
+
+        # `item` se leyó antes de que la señal actualizara el conteo
+        item.name = 'Osciloscopio digital'
+        item.save()
+        item.refresh_from_db()
+        self.assertEqual(item.available_units_count, 1)
+        self.assertIn('osciloscopio digital', item.search_document)
+
+    def test_catalog_page_queries_do_not_grow_with_items(self):
+        user = User.objects.create_user(username='alumno', password='secreto')
+        self.client.force_login(user)
+        category = Category.objects.create(name='Electrónica')
+
+        def add_items(count):
+            for n in range(count):
+                item = Item.objects.create(name=f'Artículo {Item.objects.count()}')
+                item.category.add(category)
+                Unit.objects.create(item=item, serial_number='A')
+
+        add_items(2)
+        self.client.get(reverse('order_create'))  # carga la configuración del proceso
+        cache.clear()
+        with CaptureQueriesContext(connection) as few:
+            self.assertContains(self.client.get(reverse('order_create')), '1 disponibles', count=2)
+
+        add_items(8)
+        self.client.get(reverse('order_create'))  # lee la nueva versión del catálogo
+        cache.clear()
+        with CaptureQueriesContext(connection) as many:
+            self.assertContains(self.client.get(reverse('order_create')), '1 disponibles', count=10)
+
+        self.assertEqual(len(few), len(many))
+
+    def test_catalog_fragments_are_shared_and_versioned(self):
+        category = Category.objects.create(name='Óptica')
+        item = Item.objects.create(name='Lupa')
+        item.category.add(category)
+        Unit.objects.create(item=item, serial_number='A')
+
+        self.client.force_login(User.objects.create_user(username='alumno1'))
+        self.assertContains(self.client.get(reverse('order_create')), 'Lupa')
+
+        # Otro usuario recibe los fragmentos de la caché, sin consultar artículos ni categorías
+        self.client.force_login(User.objects.create_user(username='alumno2'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('order_create'))
+        self.assertContains(response, 'Lupa')
+        self.assertContains(response, 'Óptica')
+        tables = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('prestamos_item', tables)
+        self.assertNotIn('prestamos_category', tables)
+
+        # Los parámetros de búsqueda forman parte de la llave
+        self.assertNotContains(self.client.get(reverse('order_create'), {'search': 'microscopio'}), 'Lupa')
+
+        # Cambiar el catálogo incrementa la versión y los fragmentos se vuelven a generar
+        item.name = 'Lupa de aumento'
+        item.save()
+        self.assertContains(self.client.get(reverse('order_create')), 'Lupa de aumento')
+        item.category.add(Category.objects.create(name='Mecánica'))
+        self.assertContains(self.client.get(reverse('order_create')), 'Mecánica')
+
+    def test_units_bump_catalog_only_when_available_count_changes(self):
+        unit = Unit.objects.create(item=Item.objects.create(name='Lupa'), serial_number='A')
+        version = CATALOG_VERSION.current()
+
+        # El número de serie no aparece en los fragmentos
+        unit.serial_number = 'B'
+        unit.save()
+        self.assertEqual(CATALOG_VERSION.current(), version)
+
+        unit.available = False
+        unit.save()
+        self.assertEqual(CATALOG_VERSION.current(), version + 1)
+        unit.delete()
+        self.assertEqual(CATALOG_VERSION.current(), version + 1)
+
+
+class CategoryFacetsTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.optics, self.mechanics, self.empty = [Category.objects.create(name=name)
+                                                   for name in ('Óptica', 'Mecánica', 'Vacía')]
+        for name, categories in [('Lupa', [self.optics]), ('Microscopio óptico', [self.optics, self.mechanics]),
+                                 ('Vernier', [self.mechanics]), ('Balanza', [])]:
+            Item.objects.create(name=name).category.set(categories)
+
+    def test_counts_by_search_term_in_one_cached_query(self):
+        with self.assertNumQueries(2):  # versión del catálogo y conteos agrupados
+            facets = category_facets()
+        self.assertEqual([(facet.name, facet.count) for facet in facets], [('Mecánica', 2), ('Óptica', 2)])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(category_facets(), facets)
+
+        self.assertEqual([(facet.pk, facet.count) for facet in category_facets('microscopio')],
+                         [(self.mechanics.pk, 1), (self.optics.pk, 1)])
+        self.assertEqual(category_facets('telescopio'), [])
+
+        Item.objects.create(name='Telescopio').category.add(self.empty)
+        self.assertIn(('Vacía', 1), [(facet.name, facet.count) for facet in category_facets()])
+
+    def test_catalog_filters_by_category_id(self):
+        self.client.force_login(User.objects.create_user(username='alumno'))
+
+        response = self.client.get(reverse('order_create'), {'category': self.mechanics.pk})
+        self.assertContains(response, 'Vernier')
+        self.assertNotContains(response, 'Lupa')
+        self.assertNotContains(response, 'Vacía')  # sin artículos, no se muestra
+        self.assertContains(response, f'?category={self.optics.pk}&search=')
+
+        # Enlaces antiguos con el nombre de la categoría
+        self.assertContains(self.client.get(reverse('order_create'), {'category': 'Óptica'}), 'Lupa')
+
+
+class OrderItemFormSetTestCase(TestCase):
+
+    def setUp(self):
+        self.items = [Item.objects.create(name=f'Osciloscopio {n}') for n in range(5)]
+        for item in self.items:
+            Unit.objects.create(item=item, serial_number='O-1')
+
+    def formset(self, lines):
+        data = {'form-TOTAL_FORMS': str(len(lines)), 'form-INITIAL_FORMS': '0'}
+        for index, (item_id, quantity) in enumerate(lines):
+            data[f'form-{index}-item'] = item_id
+            data[f'form-{index}-quantity'] = quantity
+        return OrderItemFormSet(data)
+
+    def test_items_are_validated_with_one_query(self):
+        formset = self.formset([(item.pk, 1) for item in self.items])
+        with self.assertNumQueries(1):
+            self.assertTrue(formset.is_valid())
+        self.assertEqual([form.cleaned_data['item'] for form in formset], self.items)
+
+        formset = self.formset([(self.items[0].pk, 2), (999999, 1), ('abc', 1)])
+        self.assertFalse(formset.is_valid())
+        self.assertEqual(formset.errors[1]['item'], ['El artículo seleccionado no existe.'])
+        self.assertIn('item', formset.errors[2])
+        self.assertIn("Solo existen 1 unidad(es) del artículo 'Osciloscopio 0'", formset.errors[0]['__all__'])
+
+    def test_lookup_endpoint_returns_cart_items(self):
+        self.client.force_login(User.objects.create_user(username='alumno', password='secreto'))
+        ids = f'{self.items[1].pk},{self.items[3].pk},999999,abc'
+
+        with self.assertNumQueries(3):  # sesión, usuario y artículos
+            response = self.client.get(reverse('item_lookup'), {'ids': ids})
+
+        self.assertEqual([(item['id'], item['name'], item['availableUnits']) for item in response.json()['items']],
+                         [(self.items[1].pk, 'Osciloscopio 1', 1), (self.items[3].pk, 'Osciloscopio 3', 1)])
+        self.assertTrue(response.json()['items'][0]['imageUrl'].endswith('default.png'))
+
+
+class OrderDetailTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(username='alumno', password='secreto')
+        self.client.force_login(self.user)
+
+    def order(self, units):
+        order = Order.objects.create(user=self.user)
+        order.units.add(*[Unit.objects.create(item=Item.objects.create(name=f'Pinza {order.pk}-{n}'),
+                                              serial_number=f'P-{n}') for n in range(units)])
+        return order
+
+    def detail_queries(self, order):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('order_detail', args=[order.pk]))
+        self.assertContains(response, 'P-0')
+        return len(queries)
+
+    def test_queries_do_not_grow_with_units_and_qr_is_generated_once(self):
+        small, large = self.order(1), self.order(6)
+        self.detail_queries(small)  # primera petición: sesión y configuración
+
+        with mock.patch('prestamos.qrcodes.make_qr_code_image', wraps=make_qr_code_image) as make_qr:
+            self.assertEqual(self.detail_queries(small), self.detail_queries(large))
+            self.detail_queries(large)
+        self.assertEqual(make_qr.call_count, 1)  # el QR de `small` ya existía
+
+        url = f'http://testserver{reverse("order_detail", args=[large.pk])}'
+        self.assertTrue(default_storage.exists(qr_code_name(url)))
+
+    def test_deleted_qr_is_regenerated_after_cache_timeout(self):
+        order = self.order(1)
+        self.detail_queries(order)
+        name = qr_code_name(f'http://testserver{reverse("order_detail", args=[order.pk])}')
+        default_storage.delete(name)
+
+        self.detail_queries(order)
+        self.assertFalse(default_storage.exists(name))  # todavía en caché
+
+        later = time.time() + settings.PRESTAMOS_QR_CACHE_TIMEOUT + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            self.detail_queries(order)
+        self.assertTrue(default_storage.exists(name))
+
+
+class DownloadBookCoversTestCase(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.requests = []
+
+        test = self
+
+        class StubHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                test.requests.append(url.path)
+
+                if url.path == '/volumes':
+                    params = parse_qs(url.query)
+                    start, size = int(params['startIndex'][0]), int(params['maxResults'][0])
+                    body = json.dumps({'items': [{
+                        'id': f'vol{n}',
+                        'volumeInfo': {'title': f'Libro {n}', 'categories': ['Ficción'],
+                                       'imageLinks': {'thumbnail': f'http://{self.headers["Host"]}/cover/{n}'}},
+                    } for n in range(start, min(start + size, 5))]}).encode()
+                elif url.path == '/cover/1' and test.requests.count('/cover/1') == 1:
+                    # La primera descarga de esta portada falla y se reintenta
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                else:
+                    body = b'imagen ' + url.path.encode()
+
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def download(self, limit):
+        with override_settings(MEDIA_ROOT=self.media.name,
+                               PRESTAMOS_DOWNLOAD_MANIFEST_DIR=os.path.join(self.media.name, 'privado')):
+            call_command('download_book_covers', 'Novela', limit=limit, page_size=2, workers=3, backoff=0,
+                         api_url=f'http://127.0.0.1:{self.server.server_port}/volumes', stdout=StringIO())
+
+    def test_pages_downloads_in_parallel_and_resumes(self):
+        self.download(limit=3)
+        self.assertEqual(self.requests.count('/volumes'), 2)
+        self.assertEqual(Item.objects.count(), 3)
+        with open(os.path.join(self.media.name, 'book_covers', 'vol1.jpg'), 'rb') as cover:
+            self.assertEqual(cover.read(), b'imagen /cover/1')
+
+        # El manifiesto no queda entre los archivos públicos de MEDIA_ROOT
+        self.assertFalse(os.path.exists(os.path.join(self.media.name, 'book_covers', 'Novela.json')))
+        manifest_path = os.path.join(self.media.name, 'privado', 'Novela.json')
+        with open(manifest_path) as manifest:
+            self.assertEqual({entry['status'] for entry in json.load(manifest).values()}, {'done'})
+
+        # Una segunda ejecución solo descarga lo que falta
+        self.requests.clear()
+        self.download(limit=5)
+        self.assertEqual(sorted(path for path in self.requests if path.startswith('/cover')),
+                         ['/cover/3', '/cover/4'])
+        self.assertEqual(Item.objects.filter(category__name='Ficción').count(), 5)
+
+
+class IngestionTestCase(TestCase):
+
+    def test_batches_deduplicate_and_link_categories(self):
+        Item.objects.create(name='Existente')
+        Category.objects.create(name='Física')
+        records = [
+            {'name': 'Existente', 'categories': ['Física']},
+            {'name': 'Nuevo 1', 'description': 'Óptica', 'categories': ['Física', 'Óptica']},
+            {'name': 'Nuevo 1', 'categories': ['Repetido']},
+            {'name': '', 'categories': ['Física']},
+            *({'name': f'Nuevo {n}', 'categories': ['Física']} for n in range(2, 6)),
+        ]
+
+        result = ingest_items(records, batch_size=3)
+
+        self.assertEqual(len(result.created), 5)
+        self.assertEqual(list(result.existing), ['Existente'])
+        self.assertEqual(result.skipped, 1)
+        # Las categorías de registros repetidos se combinan
+        self.assertEqual(result.categories_created, 2)
+        self.assertEqual(Item.objects.get(name='Nuevo 1').category.count(), 3)
+        self.assertEqual(Category.objects.get(name='Física').items.count(), 5)
+        self.assertEqual(list(search_items(Item.objects.all(), 'optica')), [Item.objects.get(name='Nuevo 1')])
+
+    def test_names_differing_in_case_or_accents_are_the_same(self):
+        Item.objects.create(name='Existente')
+        Category.objects.create(name='Física')
+
+        result = ingest_items([
+            {'name': 'existente', 'categories': ['fisica']},
+            {'name': 'Péndulo', 'categories': ['FÍSICA', 'fisica ']},
+            {'name': 'pendulo', 'categories': ['Mecánica']},
+        ])
+
+        self.assertEqual((list(result.created), list(result.existing)), (['Péndulo'], ['existente']))
+        # Solo 'Mecánica' es nueva; las categorías del registro repetido se combinan
+        self.assertEqual(result.categories_created, 1)
+        self.assertEqual(sorted(Item.objects.get(name='Péndulo').category.values_list('name', flat=True)),
+                         ['Física', 'Mecánica'])
+
+    def test_rolled_back_batch_is_removed_from_the_indexes(self):
+        ingestor = CatalogIngestor()
+        record = {'name': 'Lente', 'categories': ['Óptica']}
+
+        with mock.patch('prestamos.ingestion.index_items', side_effect=DatabaseError('falla')):
+            with self.assertRaises(DatabaseError):
+                ingestor.ingest([record])
+        self.assertFalse(Item.objects.filter(name='Lente').exists())
+
+        self.assertEqual(list(ingestor.ingest([record]).created), ['Lente'])
+        self.assertEqual(Item.objects.get(name='Lente').category.get().name, 'Óptica')
+
+    def test_queries_do_not_grow_with_batch_size(self):
+        def run(prefix, count):
+            with CaptureQueriesContext(connection) as queries:
+                ingest_items(({'name': f'{prefix} {n}', 'categories': [f'{prefix} {n % 3}']} for n in range(count)),
+                             batch_size=100)
+            return len(queries)
+
+        self.assertEqual(run('Libro', 5), run('Revista', 50))
+
+
+class ImportTestCase(TestCase):
+
+    def test_units_are_upserted_in_batches_with_row_errors(self):
+        laptop = Item.objects.create(name='Laptop')
+        Unit.objects.create(item=laptop, serial_number='L-1', available=True)
+        rows = [
+            'item,item_id,serial_number,available',
+            'Laptop,,L-1,no',  # ya existe: se actualiza
+            f',{laptop.pk},L-2,',
+            '  laptop,,L-3,si',  # mismo nombre normalizado
+            'Proyector,,P-1,1',  # artículo inexistente
+            'Laptop,,,1',  # sin número de serie
+            'Laptop,,L-4,quizá',
+            f'Laptop,,{"L" * 256},1',  # número de serie demasiado largo
+        ]
+
+        result = import_file('units', BytesIO('\n'.join(rows).encode()), 'csv', batch_size=2)
+
+        self.assertEqual((result.rows, result.batches, result.imported), (7, 4, 3))
+        self.assertEqual([row for row, _ in result.errors], [5, 6, 7, 8])
+        self.assertEqual(dict(laptop.units.values_list('serial_number', 'available')),
+                         {'L-1': False, 'L-2': True, 'L-3': True})
+        laptop.refresh_from_db()
+        self.assertEqual(laptop.available_units_count, 2)
+
+    def test_numeric_names_are_not_taken_as_ids(self):
+        Item.objects.create(name='Otro')
+        calendar = Item.objects.create(name='2024')
+        rows = BytesIO(f'item,serial_number\n2024,C-1\n{calendar.pk},C-2\n'.encode())
+
+        result = import_file('units', rows, 'csv')
+
+        self.assertEqual(result.imported, 1)
+        self.assertEqual(list(calendar.units.values_list('serial_number', flat=True)), ['C-1'])
+
+    def test_units_upsert_without_conflict_target_on_mysql(self):
+        Item.objects.create(name='Laptop')
+        rows = BytesIO(b'item,serial_number\nLaptop,L-1\n')
+
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                mock.patch.object(Unit.objects, 'bulk_create', return_value=[]) as bulk_create:
+            result = import_file('units', rows, 'csv')
+
+        self.assertEqual((result.imported, result.failed_batches), (1, 0))
+        self.assertTrue(bulk_create.call_args.kwargs['update_conflicts'])
+        self.assertNotIn('unique_fields', bulk_create.call_args.kwargs)
+
+    def test_xlsx_items_and_queries_do_not_grow_with_rows(self):
+        from openpyxl import Workbook
+
+        def workbook(prefix, count):
+            book = Workbook()
+            book.active.append(['Name', 'Description', 'Categories'])
+            for n in range(count):
+                book.active.append([f'{prefix} {n}', None, 'Física;Óptica'])
+            buffer = BytesIO()
+            book.save(buffer)
+            buffer.seek(0)
+            return buffer
+
+        def run(kind, file):
+            with CaptureQueriesContext(connection) as queries:
+                result = import_file(kind, file, 'xlsx' if kind == 'items' else 'csv', batch_size=100)
+            self.assertEqual(result.errors, [])
+            return len(queries)
+
+        Category.objects.bulk_create([Category(name='Física'), Category(name='Óptica')])
+        self.assertEqual(run('items', workbook('Lente', 3)), run('items', workbook('Prisma', 30)))
+        self.assertEqual(Category.objects.get(name='Óptica').items.count(), 33)
+
+        # Los artículos que ya existían se omiten y no cuentan como importados
+        self.assertEqual(import_file('items', workbook('Lente', 5), 'xlsx').imported, 2)
+
+        def units(count):
+            return BytesIO('\n'.join(['item,serial_number'] + [f'Lente 0,S-{n}' for n in range(count)]).encode())
+
+        self.assertEqual(run('units', units(3)), run('units', units(30)))
+
+
+class AdminTestCase(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='secreto')
+        self.client.force_login(self.admin)
+
+    def seed(self, start, stop):
+        for n in range(start, stop):
+            item = Item.objects.create(name=f'Multímetro {n}')
+            unit = Unit.objects.create(item=item, serial_number=f'M-{n}')
+            order = Order.objects.create(user=User.objects.create_user(username=f'alumno{n}'))
+            order.units.add(unit)
+            Report.objects.create(order=order, user=order.user)
+
+    def queries(self, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data)
+            self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        urls = [reverse(f'admin:prestamos_{model}_changelist') for model in ('order', 'unit', 'item', 'report')]
+
+        self.seed(0, 2)
+        self.queries(urls[0])  # la primera petición carga la sesión y el usuario
+        before = [self.queries(url)[0] for url in urls]
+        self.seed(2, 10)
+        self.assertEqual([self.queries(url)[0] for url in urls], before)
+
+    def test_autocomplete_uses_search_and_select_related(self):
+        def autocomplete(model_name, field_name, term):
+            return self.queries(reverse('admin:autocomplete'), {
+                'app_label': 'prestamos', 'model_name': model_name, 'field_name': field_name, 'term': term})
+
+        self.seed(0, 3)
+        few, response = autocomplete('order_units', 'unit', 'M-')
+        self.assertEqual(len(response.json()['results']), 3)
+        self.seed(3, 12)
+        self.assertEqual(autocomplete('order_units', 'unit', 'M-')[0], few)
+
+        _, response = autocomplete('item_category', 'item', 'multimetro 7')
+        self.assertEqual(response.json()['results'][0]['text'], 'Multímetro 7')
+
+    def test_large_tables_use_estimated_count(self):
+        self.seed(0, 3)
+        paginator = ApproximateCountPaginator(Order.objects.all(), 2)
+
+        with override_settings(PRESTAMOS_ADMIN_APPROXIMATE_COUNT_THRESHOLD=1), \
+                mock.patch('prestamos.pagination.estimated_count', return_value=1000):
+            self.assertEqual(paginator.count, 1000)
+            self.assertEqual(ApproximateCountPaginator(Order.objects.filter(status='pending'), 2).count, 3)
+        self.assertEqual(ApproximateCountPaginator(Order.objects.all(), 2).count, 3)
+
+
+class ThumbnailsTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def png(self, width, height):
+        buffer = BytesIO()
+        Image.new('RGBA', (width, height), (200, 30, 30, 128)).save(buffer, 'PNG')
+        return ContentFile(buffer.getvalue())
+
+    def test_saving_an_image_generates_thumbnails_and_srcset(self):
+        item = Item.objects.create(name='Microscopio')
+        self.assertEqual(item.thumbnails, {})  # la imagen por defecto no genera miniaturas
+
+        item.image.save('microscopio.png', self.png(500, 250))
+        item.refresh_from_db()
+        self.assertEqual(sorted(item.thumbnails['webp'], key=int), ['160', '320'])  # sin ampliar a 640
+        with default_storage.open(item.thumbnails['jpeg']['160']) as thumbnail:
+            self.assertEqual(Image.open(thumbnail).size, (160, 80))
+
+        user = User.objects.create_user(username='alumno', password='secreto')
+        self.client.force_login(user)
+        response = self.client.get(reverse('order_create'))
+        self.assertContains(response, f'{default_storage.url(item.thumbnails["webp"]["320"])} 320w')
+
+    def test_backfill_command(self):
+        items = [Item.objects.create(name=f'Artículo {n}') for n in range(3)]
+        name = default_storage.save('compartida.png', self.png(400, 400))
+        Item.objects.filter(pk__in=[item.pk for item in items]).update(image=name)
+
+        output = StringIO()
+        call_command('generate_thumbnails', workers=2, stdout=output)
+        self.assertIn('Se procesaron 1 imágenes (0 con error) de 3 artículos', output.getvalue())
+        self.assertEqual({item.thumbnails['source'] for item in Item.objects.all()}, {name})
+
+        # --force vuelve a escribir las miniaturas existentes con el mismo nombre
+        thumbnail = Item.objects.first().thumbnails['jpeg']['160']
+        default_storage.delete(thumbnail)
+        default_storage.save(thumbnail, ContentFile(b'miniatura vieja'))
+        call_command('generate_thumbnails', workers=1, stdout=StringIO())
+        with default_storage.open(thumbnail) as stale:
+            self.assertEqual(stale.read(), b'miniatura vieja')
+
+        call_command('generate_thumbnails', workers=1, force=True, stdout=StringIO())
+        with default_storage.open(thumbnail) as regenerated:
+            self.assertEqual(Image.open(regenerated).size, (160, 160))
+        self.assertEqual(Item.objects.first().thumbnails['jpeg']['160'], thumbnail)
+
+
+class StaticFilesTestCase(TestCase):
+
+    def test_collectstatic_writes_hashed_and_precompressed_files(self):
+        source, root = tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()
+        self.addCleanup(source.cleanup)
+        self.addCleanup(root.cleanup)
+        with open(os.path.join(source.name, 'app.css'), 'w') as css:
+            css.write('body { color: #333; }\n' * 100)
+
+        storages = {**settings.STORAGES,
+                    'staticfiles': {'BACKEND': 'almacen.storage.CompressedManifestStaticFilesStorage'}}
+        with override_settings(STATIC_ROOT=root.name, STATICFILES_DIRS=[source.name], STORAGES=storages,
+                               STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder']):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            hashed = staticfiles_storage.stored_name('app.css')
+
+        self.assertRegex(hashed, r'^app\.[0-9a-f]{12}\.css$')
+        with gzip.open(os.path.join(root.name, f'{hashed}.gz'), 'rt') as compressed:
+            self.assertEqual(compressed.read(), 'body { color: #333; }\n' * 100)
+
+
+class ExportTestCase(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='alumno', password='secreto')
+        item = Item.objects.create(name='Multímetro, digital')
+        for n in range(3):
+            unit = Unit.objects.create(item=item, serial_number=f'S-{n}')
+            order = Order.objects.create(user=user)
+            order.units.add(unit)
+        Report.objects.create(user=user, order=order, details='Pantalla rota')
+
+    def test_command_exports_orders_with_units_and_reports(self):
+        output = StringIO()
+        # Consultas fijas: órdenes con usuario y reporte, y sus unidades con artículo
+        with self.assertNumQueries(2):
+            call_command('export_data', 'orders', format='jsonl', stdout=output)
+
+        rows = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([row['units'] for row in rows],
+                         [f'Multímetro, digital (S-{n})' for n in range(3)])
+        self.assertEqual(rows[-1]['report_details'], 'Pantalla rota')
+
+    def test_rows_are_read_in_primary_key_batches(self):
+        with CaptureQueriesContext(connection) as context:
+            rows = list(OrderExport().rows(chunk_size=2))
+
+        self.assertEqual([row[0] for row in rows], list(Order.objects.order_by('pk').values_list('pk', flat=True)))
+        # Dos bloques, cada uno con su consulta de órdenes y la de sus unidades
+        orders = [query['sql'] for query in context.captured_queries if 'FROM "prestamos_order"' in query['sql']]
+        self.assertEqual(len(orders), 2)
+        self.assertTrue(all('LIMIT 2' in sql for sql in orders))
+        self.assertIn('"prestamos_order"."id" >', orders[1])
+
+    def test_command_counts_written_rows(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+
+        def exported(export, file_format):
+            errors = StringIO()
+            call_command('export_data', export, format=file_format, output=os.path.join(media.name, 'salida'),
+                         stderr=errors)
+            return errors.getvalue()
+
+        for file_format in ('csv', 'jsonl'):
+            self.assertIn('Se exportaron 3 registros', exported('orders', file_format))
+
+        Item.objects.all().delete()
+        for file_format in ('csv', 'jsonl'):
+            self.assertIn('Se exportaron 0 registros', exported('items', file_format))
+
+    def test_admin_action_streams_csv(self):
+        admin_user = User.objects.create_superuser(username='admin', password='secreto')
+        self.client.force_login(admin_user)
+
+        response = self.client.post(reverse('admin:prestamos_unit_changelist'), {
+            'action': 'export_csv_stream',
+            'select_across': '1',
+            '_selected_action': Unit.objects.values_list('pk', flat=True),
+        })
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,item,item_name,serial_number,available')
+        self.assertEqual(lines[1].split(',', 2)[2], '"Multímetro, digital",S-0,True')
@@ -0,0 +1,117 @@
+import hashlib
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+"""
+Miniaturas de las imágenes de los artículos
+
+Por cada imagen original se generan versiones WebP y JPEG en varios anchos
+fijos. Los nombres dependen solo del nombre de la imagen original, así que
+una imagen compartida (como `default.png`) se procesa una sola vez. Las
+rutas generadas se guardan en `Item.thumbnails` para armar el `srcset` sin
+tocar el almacenamiento al renderizar.
+"""
+
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+
+def thumbnail_widths():
+    return tuple(getattr(settings, 'PRESTAMOS_THUMBNAIL_WIDTHS', (160, 320, 640)))
+
+
+def derivative_name(source, width, extension):
+    """
+    :param source: Nombre de la imagen original en el almacenamiento
+    :param width: Ancho de la miniatura
+    :param extension: 'webp' o 'jpeg'
+    :return: Nombre de la miniatura en el almacenamiento
+    """
+    stem = os.path.splitext(os.path.basename(source))[0]
+    digest = hashlib.sha1(source.encode()).hexdigest()[:8]
+    return f'thumbnails/{stem}-{digest}-{width}.{extension}'
+
+
+def generate_thumbnails(source, storage=default_storage, force=False):
+    """
+    Genera las miniaturas de una imagen. Solo usa el almacenamiento y Pillow,
+    así que puede correr en otro proceso.
+
+    :param source: Nombre de la imagen original en el almacenamiento
+    :param storage: Almacenamiento de archivos
+    :param force: Reemplazar las miniaturas que ya existen en lugar de reutilizarlas
+    :return: Diccionario {'source': nombre, 'webp': {ancho: nombre}, 'jpeg': {ancho: nombre}},
+             o None si la imagen no existe o no se puede leer
+    """
+    try:
+        with storage.open(source, 'rb') as original:
+            image = Image.open(original)
+            image = ImageOps.exif_transpose(image)
+            image.load()
+    except (OSError, ValueError):
+        return None
+
+    # JPEG no soporta transparencia: se aplana sobre fondo blanco
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    variants = {'source': source, **{extension: {} for extension in FORMATS}}
+
+    # No se amplían imágenes: los anchos mayores al original se omiten, salvo el más chico
+    widths = [width for width in thumbnail_widths() if width < image.width] or [min(thumbnail_widths())]
+
+    for width in widths:
+        resized = None
+        for extension, options in FORMATS.items():
+            name = derivative_name(source, width, extension)
+            exists = storage.exists(name)
+            if force or not exists:
+                if resized is None:
+                    height = max(1, round(image.height * width / image.width))
+                    resized = image.resize((width, height), Image.LANCZOS) if width < image.width else image
+
+                buffer = BytesIO()
+                resized.save(buffer, **options)
+                if exists:
+                    storage.delete(name)  # `save` no sobrescribe, cambiaría el nombre
+                storage.save(name, ContentFile(buffer.getvalue()))
+
+            variants[extension][str(width)] = name
+
+    return variants
+
+
+def srcset(variants, extension):
+    """
+    :param variants: Valor de `Item.thumbnails`
+    :param extension: 'webp' o 'jpeg'
+    :return: Cadena para el atributo `srcset`, vacía si no hay miniaturas
+    """
+    names = (variants or {}).get(extension) or {}
+    return ', '.join(f'{default_storage.url(name)} {width}w'
+                     for width, name in sorted(names.items(), key=lambda pair: int(pair[0])))
+
+
+def thumbnail_url(variants, width, extension='jpeg'):
+    """
+    :return: URL de la miniatura más chica con al menos `width` de ancho (o la más grande), None si no hay
+    """
+    names = (variants or {}).get(extension) or {}
+    if not names:
+        return None
+
+    widths = sorted(int(key) for key in names)
+    chosen = next((candidate for candidate in widths if candidate >= width), widths[-1])
+    return default_storage.url(names[str(chosen)])
@@ -1,9 +1,9 @@
-from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib.auth.views import LoginView, LogoutView
 from django.urls import path
 
 from prestamos.views import CancelOrderView
+from prestamos.views import CartAvailabilityView
+from prestamos.views import ItemLookupView
 from prestamos.views import OrderAuthorize
 from prestamos.views import OrderCreateView
 from prestamos.views import OrderDetailView
@@ -34,10 +34,12 @@ urlpatterns = [
 
     path(route='reports/', view=ReportListView.as_view(), name='report_list'),
     path(route='items/', view=OrderCreateView.as_view(), name='order_create'),
+    path(route='items/lookup.json', view=ItemLookupView.as_view(), name='item_lookup'),
+    path(route='items/availability.json', view=CartAvailabilityView.as_view(), name='cart_availability'),
     path(route='items/<str:category>', view=OrderCreateView.as_view(), name='order_create'),
 
     path(route='settings', view=SettingsView.as_view(), name='settings'),
     path(route='schedule', view=ScheduleView.as_view(), name='schedule'),
     path(route='profile/', view=UserProfileView.as_view(), name='user_profile'),
 
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
@@ -1,42 +1,53 @@
 # views.py
 
 import math
+import operator
 from datetime import time, timedelta
-from random import shuffle
+from functools import partial
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import ValidationError
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import Prefetch, Q
+from django.http import JsonResponse
 from django.shortcuts import redirect, get_object_or_404
 from django.shortcuts import render
 from django.urls import reverse_lazy
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from django.views import View
 from django.views.generic import CreateView, TemplateView
 from django.views.generic import DetailView
 from django.views.generic import ListView
-from extra_settings.models import Setting
 
+from .availability import available_slots, free_counts, retry_allocation
+from .catalog_cache import catalog_version
+from .facets import category_facets
 from .forms import OrderForm, OrderItemFormSet, ReporteForm
-from .models import Order, Report, Item, Category, OrderStatusChoices
+from .models import Order, Report, Item, OrderStatusChoices, Unit
+from .pagination import KeysetPaginationMixin, paginate
+from .runtime_settings import get_settings
+from .search import search_items
+from .store_calendar import get_calendar
+from .thumbnails import thumbnail_url
 
 
 class ScheduleView(LoginRequiredMixin, View):
     template = "schedule.html"
 
     def get(self, request):
-        # Renderizar la plantilla con los datos obtenidos directamente desde Setting.get()
+        # Renderizar la plantilla con los datos de la configuración local del proceso
+        store_settings = get_settings()
         return render(request, self.template, {
-            'opening_days': Setting.get("STORE_OPEN_DAYS", default="Indefinido").split(','),  # Días de apertura
-            'opening_time': Setting.get("STORE_OPENING_TIME", default=time(0, 0)),  # Horario de apertura
-            'closing_time': Setting.get("STORE_CLOSING_TIME", default=time(23, 0)),  # Horario de cierre
-            'warehouse_phone': Setting.get("WAREHOUSE_PHONE", default="+00 000000000"),  # Teléfono del almacén
-            'warehouse_email': Setting.get("WAREHOUSE_EMAIL", default="warehouse@doe.com"),  # Email del almacén
-            'support_phone': Setting.get("SUPPORT_PHONE", default="+00 000000000"),  # Teléfono de soporte
-            'support_email': Setting.get("SUPPORT_EMAIL", default="joe@doe.com"),  # Email de soporte
+            'opening_days': store_settings.get("STORE_OPEN_DAYS", default="Indefinido").split(','),  # Días de apertura
+            'opening_time': store_settings.get("STORE_OPENING_TIME", default=time(0, 0)),  # Horario de apertura
+            'closing_time': store_settings.get("STORE_CLOSING_TIME", default=time(23, 0)),  # Horario de cierre
+            'warehouse_phone': store_settings.get("WAREHOUSE_PHONE", default="+00 000000000"),  # Teléfono del almacén
+            'warehouse_email': store_settings.get("WAREHOUSE_EMAIL", default="warehouse@doe.com"),  # Email del almacén
+            'support_phone': store_settings.get("SUPPORT_PHONE", default="+00 000000000"),  # Teléfono de soporte
+            'support_email': store_settings.get("SUPPORT_EMAIL", default="joe@doe.com"),  # Email de soporte
         })
 
 
@@ -77,7 +88,7 @@ class OrderListView(LoginRequiredMixin, ListView):
             user=self.request.user,
             order_date__gt=timezone.now(),
             status__in=[OrderStatusChoices.DELIVERED],
-        )
+        ).prefetch_related('units')  # `order_details_card.html` cuenta las unidades
 
 
 class ReportCreateView(LoginRequiredMixin, CreateView):
@@ -102,31 +113,17 @@ class OrderCreateView(LoginRequiredMixin, View):
         search_query = request.GET.get('search', '')  # Obtener el término de búsqueda de la URL
         items, selected_category = self.get_items_by_category(request.GET.get('category', ''), search_query)
 
-        # Paginación
-        paginator = Paginator(items, Setting.get("CATALOG_ITEMS_PAGINATION", default=10))
-        page = request.GET.get('page', 1)
-
-        try:
-            paginated_items = paginator.page(page)
-        except PageNotAnInteger:
-            paginated_items = paginator.page(1)
-        except EmptyPage:
-            paginated_items = paginator.page(paginator.num_pages)
-
         return render(request, self.select_item_template, {
             'order_form': OrderForm(),
             'item_formset': OrderItemFormSet(),
-            'categories': Category.objects.all(),
-            'items': paginated_items,  # Usar items paginados
-            'paginator': paginator,
-            'page_obj': paginated_items,
-            'is_paginated': paginated_items.has_other_pages(),
+            **self.catalog_context(request, items),
         })
 
     def post(self, request, category=None):
         order_form = OrderForm(request.POST)
         item_formset = OrderItemFormSet(request.POST)
-        items, selected_category = self.get_items_by_category(request.GET.get('category', ''))
+        items, selected_category = self.get_items_by_category(request.GET.get('category', ''),
+                                                              request.GET.get('search', ''))
         alternative_slots = []
 
         if order_form.is_valid() and item_formset.is_valid():
@@ -137,161 +134,209 @@ class OrderCreateView(LoginRequiredMixin, View):
             except Exception as e:
                 # Mostrar opciones para el equipo
                 alternative_slots = self.suggest_alternatives(order_form, item_formset)
+                error = '. '.join(e.messages) if isinstance(e, ValidationError) else e
 
                 if alternative_slots:
                     # Añadir el mensaje de error con las alternativas
-                    messages.error(request, f"{e}. Horarios Alternativos:")
+                    messages.error(request, f"{error}. Horarios Alternativos:")
                 else:
-                    messages.error(request, f"{e}. No se encontraron horarios alternativos.")
+                    messages.error(request, f"{error}. No se encontraron horarios alternativos.")
 
             else:
                 messages.success(request, "La orden se ha creado exitosamente.")
                 return redirect('order_detail', order.pk)
 
         # Si el formulario es inválido o hay excepciones, realizar la paginación nuevamente
-        paginator = Paginator(items, Setting.get("CATALOG_ITEMS_PAGINATION", default=10))
-        page = request.GET.get('page', 1)
-
-        try:
-            paginated_items = paginator.page(page)
-        except PageNotAnInteger:
-            paginated_items = paginator.page(1)
-        except EmptyPage:
-            paginated_items = paginator.page(paginator.num_pages)
-
         return render(request, self.select_item_template, {
             'order_form': order_form,
             'item_formset': item_formset,
-            'categories': Category.objects.all(),
             'alternative_slots': alternative_slots,
             'abrir_modal': True,
-            'items': paginated_items,  # Usar items paginados
-            'paginator': paginator,
-            'page_obj': paginated_items,
-            'is_paginated': paginated_items.has_other_pages(),
+            **self.catalog_context(request, items),
         })
 
+    def catalog_context(self, request, items):
+        """
+        Contexto de la barra de categorías y de la cuadrícula de artículos. Las
+        consultas solo se ejecutan si la plantilla usa los valores, es decir,
+        si los fragmentos no están en la caché.
+
+        :return: Contexto con `categories` (facetas con el número de artículos), la paginación y `catalog_version`
+        """
+        page = SimpleLazyObject(lambda: self.paginate_items(request, items))
+
+        search_query = request.GET.get('search', '')
+
+        return {
+            'categories': SimpleLazyObject(lambda: category_facets(search_query)),
+            **{name: SimpleLazyObject(partial(operator.getitem, page, name))
+               for name in ('items', 'paginator', 'page_obj', 'is_paginated', 'pagination_query')},
+            'catalog_version': catalog_version(),
+            'catalog_cache_timeout': getattr(settings, 'PRESTAMOS_CATALOG_CACHE_TIMEOUT', 600),
+        }
+
+    def paginate_items(self, request, items):
+        """
+        Pagina los artículos por llave (nombre, id), o por relevancia si hay búsqueda.
+
+        :return: Contexto de paginación, con la página también como `items`
+        """
+        if not items.ordered:
+            items = items.order_by('name', 'pk')
+
+        context = paginate(request, items, get_settings().get("CATALOG_ITEMS_PAGINATION", default=10))
+        context['items'] = context['page_obj']
+        return context
+
     def get_items_by_category(self, category, search_query=''):
         """
         Obtiene los artículos filtrados por categoría y por término de 
         búsqueda, si se proporcionan.
+
+        La categoría se indica por id y se filtra directamente sobre la tabla
+        intermedia, sin consultar antes la categoría; los enlaces antiguos con
+        el nombre de la categoría siguen funcionando.
         """
 
-        if category:
-            category_obj = get_object_or_404(Category, name=category)
-            items = category_obj.items.all()
+        if category.isdigit():
+            items = Item.objects.filter(category=int(category))
+        elif category:
+            items = Item.objects.filter(category__name=category)
         else:
             items = Item.objects.all()
 
-        # Filtrar por el término de búsqueda
+        # Las categorías de la página en una sola consulta; el documento de búsqueda no se muestra
+        items = items.defer('search_document').prefetch_related('category')
+
+        # Búsqueda de texto completo en nombre, categorías y descripción
         if search_query:
-            items = items.filter(name__icontains=search_query)
+            items = search_items(items, search_query)
 
         return items, category
 
     def transaction_order(self, order_form, item_formset) -> Order:
-        with transaction.atomic():
-            # Create the order and add units
-            order_form.instance.user = self.request.user
-            order = order_form.save()
+        # Reservar las unidades de todas las líneas del formset en un solo lote
+        lines = [(form.cleaned_data['item'], form.cleaned_data['quantity'])
+                 for form in item_formset if form.is_valid() and form.cleaned_data]
 
-            for item_form in item_formset:
-                if item_form.is_valid():
-                    item = item_form.cleaned_data['item']
-                    quantity = item_form.cleaned_data['quantity']
-                    order_date = order_form.cleaned_data['order_date']
-                    return_date = order_form.cleaned_data['return_date']
+        def create_order():
+            with transaction.atomic():
+                # Cada intento crea su propia orden, la del intento fallido se revierte
+                order = Order.objects.create(
+                    user=self.request.user,
+                    order_date=order_form.cleaned_data['order_date'],
+                    return_date=order_form.cleaned_data['return_date'],
+                )
+                units = order.add_items(lines)
 
-                    if quantity < 0:
-                        # Skip if quantity is less than 0
-                        continue
+                if len(units) <= 0:
+                    raise ValueError("La orden no tiene unidades disponibles.")
 
-                    units = item.units_available(order_date, return_date)
+            return order
 
-                    if quantity > len(units):  # Verificar que hay suficientes unidades
-                        raise Exception(f"No hay suficientes unidades de '{item.name}' disponibles")
-
-                    shuffle(units)  # Revolver los elementos de la lista
-                    order.units.add(*units[:quantity])  # Agregar la cantidad de unidades especificadas
-
-            if order.units.count() <= 0:
-                raise ValueError("La orden no tiene unidades disponibles.")
-
-        return order
+        # Reintentar si otra solicitud bloquea las mismas unidades o hay un deadlock
+        return retry_allocation(create_order)
 
     def suggest_alternatives(self, order_form, item_formset):
         """
         Sugiere alternativas de horarios donde TODOS los artículos solicitados
-        estén disponibles simultáneamente, dentro del horario de apertura de la tienda.
+        estén disponibles simultáneamente, dentro de los días y horario de la tienda.
+
+        La disponibilidad de todas las ventanas candidatas se calcula de una sola
+        vez con `available_slots`, sin consultas por ventana ni por artículo.
         """
 
-        opening_time = Setting.get("STORE_OPENING_TIME", default=time(9, 0))  # Hora de apertura
-        closing_time = Setting.get("STORE_CLOSING_TIME", default=time(18, 0))  # Hora de cierre
+        store_settings = get_settings()
+        search_hours = store_settings.get("ALTERNATIVES_SEARCH_HOURS", default=24)  # Horizonte de búsqueda
+        slot_minutes = store_settings.get("ALTERNATIVES_SLOT_MINUTES", default=0)  # Granularidad (0 = la duración)
         order_date = order_form.cleaned_data['order_date']
         return_date = order_form.cleaned_data['return_date']
 
         max_alternatives = 3  # Limitar a 3 alternativas
-        alternatives = []
 
-        # Inicializamos un rango de búsqueda en el tiempo original de la orden
-        current_start_time = order_date
         duration = return_date - order_date
-        time_increment = timedelta(
-            minutes=math.ceil(duration.total_seconds() / 60))  # Incremento en minutos según la duración
+        if slot_minutes <= 0:  # el admin permite valores negativos; se tratan como 0
+            slot_minutes = max(1, math.ceil(duration.total_seconds() / 60))
+        time_increment = timedelta(minutes=slot_minutes)  # Incremento en minutos
+        max_search_time = order_date + timedelta(hours=search_hours)
 
-        # Limitar el tiempo máximo de búsqueda a 24 horas adicionales
-        max_search_time = order_date + timedelta(days=1)
+        # Ventanas candidatas dentro de los días y el horario de atención
+        candidates = get_calendar().bookable_starts(order_date, duration, time_increment, max_search_time)
 
-        while current_start_time < max_search_time and len(alternatives) < max_alternatives:
-            all_items_available = True
+        lines = [(form.cleaned_data['item'], form.cleaned_data['quantity'])
+                 for form in item_formset if form.is_valid() and form.cleaned_data]
+        fits = available_slots(lines, candidates, duration)
 
-            # Verificar si la hora de inicio y fin están dentro del horario de apertura y cierre
-            start_time_only = current_start_time.time()
-            end_time_only = (current_start_time + duration).time()
+        return [
+            {'start_time': start_time, 'end_time': start_time + duration}
+            for start_time, fit in zip(candidates, fits) if fit
+        ][:max_alternatives]
 
-            start_in_hours = opening_time <= start_time_only <= closing_time
-            end_in_hours = opening_time <= end_time_only <= closing_time
 
-            if not start_in_hours or not end_in_hours:
-                current_start_time += time_increment
-                continue  # Si el horario no está dentro de los límites, se pasa al siguiente intervalo
+class ItemLookupView(LoginRequiredMixin, View):
+    """
+    Nombre, miniatura y unidades disponibles de los artículos del carrito,
+    por ejemplo `?ids=1,2,3`. Los ids que ya no existen se omiten.
+    """
 
-            for item_form in item_formset:
-                if not item_form.is_valid():
-                    continue
+    max_ids = 50  # igual que el máximo de líneas de `OrderItemFormSet`
 
-                item = item_form.cleaned_data['item']
-                quantity = item_form.cleaned_data['quantity']
-
-                if quantity < 1:
-                    continue
+    def get(self, request):
+        ids = {int(value) for value in request.GET.get('ids', '').split(',') if value.strip().isdigit()}
+        items = (Item.objects
+                 .only('name', 'image', 'thumbnails', 'available_units_count')
+                 .in_bulk(sorted(ids)[:self.max_ids]))
+
+        return JsonResponse({'items': [
+            {
+                'id': item.pk,
+                'name': item.name,
+                'imageUrl': thumbnail_url(item.thumbnails, 160) or item.image.url,
+                'availableUnits': item.available_units_count,
+            }
+            for item in items.values()
+        ]})
+
+
+class CartAvailabilityView(LoginRequiredMixin, View):
+    """
+    Unidades libres de cada artículo del carrito en la ventana elegida, para
+    avisar antes de enviar la orden. Parámetros: `items` (`id:cantidad`
+    separados por comas), `order_date` y `return_date`.
+    """
+
+    max_items = 50  # igual que el máximo de líneas de `OrderItemFormSet`
 
-                # Verificar si el artículo tiene suficientes unidades disponibles en el intervalo actual
-                available_units = item.units_available(current_start_time, current_start_time + duration)
-                if len(available_units) < quantity:
-                    all_items_available = False
-                    break  # Si uno de los artículos no tiene suficientes unidades, pasamos a la siguiente iteración
+    def get(self, request):
+        # Las mismas validaciones de fechas y horario que al crear la orden
+        order_form = OrderForm(request.GET)
+        if not order_form.is_valid():
+            return JsonResponse({'errors': [error for errors in order_form.errors.values() for error in errors]},
+                                status=400)
 
-            if all_items_available:
-                # Si todos los artículos están disponibles en este intervalo, añadimos la alternativa
-                alternatives.append({
-                    'start_time': current_start_time,
-                    'end_time': current_start_time + duration
-                })
+        requested = {}
+        for line in request.GET.get('items', '').split(',')[:self.max_items]:
+            item_id, _, quantity = line.partition(':')
+            if item_id.strip().isdigit():
+                requested[int(item_id)] = requested.get(int(item_id), 0) + (int(quantity) if quantity.isdigit() else 1)
 
-            # Incrementamos el tiempo de búsqueda según el incremento definido
-            current_start_time += time_increment
+        counts = free_counts(requested, order_form.cleaned_data['order_date'], order_form.cleaned_data['return_date'])
+        lines = [
+            {'id': item_id, 'requested': quantity, 'free': counts[item_id], 'available': counts[item_id] >= quantity}
+            for item_id, quantity in requested.items()
+        ]
 
-        return alternatives
+        return JsonResponse({'items': lines, 'bookable': all(line['available'] for line in lines)})
 
 
-class OrderHistoryListView(LoginRequiredMixin, ListView):
+class OrderHistoryListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Order
     template_name = 'order_history_list.html'
     context_object_name = 'orders'
 
     # agregar esto a una configuración del sistema
     paginate_by = 100
+    pagination_ordering = ['-order_date', '-pk']
 
     def get_queryset(self):
         # Incluye las órdenes del usuario que han pasado su fecha o que tienen uno de los estados específicos
@@ -314,7 +359,12 @@ class OrderDetailView(LoginRequiredMixin, DetailView):
     context_object_name = 'order'
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        # Reporte en el mismo JOIN y unidades con su artículo en una consulta, sin importar cuántas sean
+        return (Order.objects
+                .filter(user=self.request.user)
+                .select_related('reports')
+                .prefetch_related(Prefetch('units', Unit.objects.select_related('item').only(
+                    'serial_number', 'item__name'))))
 
 
 class OrderAuthorize(LoginRequiredMixin, View):